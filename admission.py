@@ -0,0 +1,405 @@
+"""
+Admission control for the question-answering endpoints.
+
+Each answer can fan out into several LLM, search and page fetch calls, so
+the number of requests in flight is capped. Requests beyond the cap wait
+in a bounded priority queue (questions without web search first, batches
+last). A request is rejected immediately with 503 and Retry-After when the
+queue is full or its expected wait would break the latency SLO. Each
+client is also rate limited with a token bucket (429).
+
+WebSocket voice turns take the same rate limit and processing slots
+through admit().
+
+Limits apply per worker process.
+"""
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import time
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import (
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_LATENCY_SLO,
+    RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_BURST,
+)
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+in_flight_gauge = registry.gauge("admission_in_flight", "Requests being processed")
+queue_depth_gauge = registry.gauge("admission_queue_depth", "Requests waiting for a processing slot")
+rejections = registry.counter(
+    "admission_rejections_total", "Requests rejected by admission control", labels=("reason",)
+)
+queue_wait = registry.histogram(
+    "admission_queue_wait_seconds", "Time requests waited for a processing slot", labels=("priority",)
+)
+
+# Lower values are admitted first
+PRIORITY_HIGH = 0  # No web search: one vector search and LLM calls only
+PRIORITY_NORMAL = 1  # Web search
+PRIORITY_LOW = 2  # Batches
+
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+# Endpoints that run the RAG pipeline
+ADMISSION_PATHS = {"/ask", "/ask/batch", "/ask-voice"}
+
+# Endpoints whose durations feed the wait estimate. Batches and audio streams hold a slot for as long as
+# they stream, which says nothing about how soon a queued question will be answered.
+SERVICE_TIME_PATHS = {"/ask"}
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request cannot be admitted in time.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a fixed rate.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take one token.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Per-client token buckets.
+    """
+
+    def __init__(self, per_minute: int = RATE_LIMIT_PER_MINUTE, burst: int = RATE_LIMIT_BURST, max_clients: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def take(self, client: str) -> float:
+        """
+        Take a token for a client.
+
+        Returns:
+            0 if the request is allowed, otherwise the seconds until it would be.
+        """
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune()
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    def _prune(self) -> None:
+        # Buckets that have refilled completely carry no state worth keeping
+        now = time.monotonic()
+        for client, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[client]
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded priority wait queue and SLO-based shedding.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        latency_slo: float = ADMISSION_LATENCY_SLO,
+    ):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent: Requests processed at once.
+            max_queue: Requests allowed to wait for a slot.
+            latency_slo: Target end-to-end latency in seconds, including queueing.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.latency_slo = latency_slo
+        self.in_flight = 0
+        self.queued = 0
+        # Exponentially weighted average processing time of single questions, seeded conservatively
+        self.service_time = latency_slo / 4
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _update_gauges(self) -> None:
+        in_flight_gauge.set(self.in_flight)
+        queue_depth_gauge.set(self.queued)
+
+    def estimated_wait(self, priority: int) -> float:
+        """
+        Estimate how long a new request of this priority would wait for a slot.
+        """
+        ahead = sum(1 for p, _, future in self._waiters if p <= priority and not future.done())
+        return math.ceil((ahead + 1) / self.max_concurrent) * self.service_time
+
+    async def acquire(self, priority: int) -> None:
+        """
+        Wait for a processing slot.
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait would break the SLO.
+        """
+        if self.in_flight < self.max_concurrent and not self.queued:
+            self.in_flight += 1
+            self._update_gauges()
+            return
+
+        if self.queued >= self.max_queue:
+            raise AdmissionRejected("queue_full", self.estimated_wait(PRIORITY_LOW))
+        wait = self.estimated_wait(priority)
+        if wait + self.service_time > self.latency_slo:
+            raise AdmissionRejected("slo", wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.queued += 1
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            # A slot is handed over by release(); give up once the SLO can no longer be met
+            await asyncio.wait_for(future, timeout=max(0.0, self.latency_slo - self.service_time))
+        except asyncio.TimeoutError:
+            raise AdmissionRejected("timeout", self.service_time)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the request was abandoned
+                self._hand_over()
+            raise
+        finally:
+            self.queued -= 1
+            self._update_gauges()
+            queue_wait.observe(time.perf_counter() - start, PRIORITY_NAMES[priority])
+
+    def release(self, duration: Optional[float] = None) -> None:
+        """
+        Free a slot, handing it straight to the highest-priority waiter if there is one.
+
+        Args:
+            duration: How long the finished request took, for the wait estimate.
+                None leaves the estimate unchanged (e.g. for long streaming requests).
+        """
+        if duration is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * duration
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+
+_controller: Optional[AdmissionController] = None
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Get the process-wide admission controller, shared by the middleware and WebSocket turns.
+    """
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Get the process-wide per-client rate limiter.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+@asynccontextmanager
+async def admit(client: str, priority: int) -> AsyncIterator[None]:
+    """
+    Hold a processing slot for a question that does not pass through the
+    middleware, such as a WebSocket voice turn. The time spent inside feeds
+    the wait estimate, so wrap the processing of a single question only.
+
+    Args:
+        client: The client, as identified by client_id().
+        priority: The question's priority.
+
+    Raises:
+        AdmissionRejected: With reason "rate_limit" if the client is over its rate,
+            or if the question could not get a slot in time.
+    """
+    if not ADMISSION_ENABLED:
+        yield
+        return
+
+    wait = get_rate_limiter().take(client)
+    if wait:
+        rejections.inc(1, "rate_limit")
+        logger.info("Rate limited client", extra={"fields": {"client": client}})
+        raise AdmissionRejected("rate_limit", wait)
+
+    controller = get_admission_controller()
+    try:
+        await controller.acquire(priority)
+    except AdmissionRejected as e:
+        rejections.inc(1, e.reason)
+        logger.warning("Shed request", extra={"fields": {
+            "reason": e.reason, "priority": PRIORITY_NAMES[priority], "retry_after_s": round(e.retry_after, 1),
+        }})
+        raise
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        controller.release(time.perf_counter() - start)
+
+
+def client_id(scope: Scope) -> str:
+    """
+    Identify the client for rate limiting by its address (uvicorn resolves trusted proxy headers).
+    """
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def classify(path: str, body: bytes) -> int:
+    """
+    Pick a request's priority from its endpoint and body.
+    """
+    if path == "/ask/batch":
+        return PRIORITY_LOW
+    try:
+        web_search = json.loads(body or b"{}").get("web_search", True)
+    except (ValueError, AttributeError):
+        web_search = True
+    return PRIORITY_NORMAL if web_search else PRIORITY_HIGH
+
+
+async def _read_body(receive: Receive) -> Tuple[bytes, Receive]:
+    """
+    Read the request body, and return it with a receive callable that replays it to the app.
+    """
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body = b"".join(chunks)
+
+    replayed = False
+
+    async def replay() -> Message:
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return body, replay
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying rate limits and admission control to the RAG endpoints.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: Optional[AdmissionController] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in ADMISSION_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(scope)
+        wait = self.rate_limiter.take(client)
+        if wait:
+            rejections.inc(1, "rate_limit")
+            logger.info("Rate limited client", extra={"fields": {"client": client}})
+            response = JSONResponse(
+                {"detail": "Too many requests. Please slow down."}, status_code=429, headers=_retry_after(wait)
+            )
+            await response(scope, receive, send)
+            return
+
+        body, receive = await _read_body(receive)
+        priority = classify(scope["path"], body)
+        try:
+            await self.controller.acquire(priority)
+        except AdmissionRejected as e:
+            rejections.inc(1, e.reason)
+            logger.warning("Shed request", extra={"fields": {
+                "reason": e.reason, "priority": PRIORITY_NAMES[priority], "retry_after_s": round(e.retry_after, 1),
+            }})
+            response = JSONResponse(
+                {"detail": "The assistant is busy. Please retry shortly."}, status_code=503, headers=_retry_after(e.retry_after)
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration = time.perf_counter() - start
+            self.controller.release(duration if scope["path"] in SERVICE_TIME_PATHS else None)
@@ -1,36 +1,66 @@
 """
 FastAPI application for Ali Haider's personal assistant.
 """
-from typing import Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Depends, Request, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, StreamingResponse, Response
+from typing import Optional, Dict, Any, List, Literal
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, File, UploadFile, Form, WebSocket
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import uvicorn
 import os
 import pathlib
-import base64
-import io
+import json
+import asyncio
+import re
+import time
 
-from config import GEMINI_API_KEY
+from config import GEMINI_API_KEY, TELEMETRY_ENABLED, BATCH_MAX_QUESTIONS, STT_MAX_UPLOAD_BYTES, WARMUP_RETRY_AFTER, ADMISSION_ENABLED
 from rag_graph import run_rag_graph
-from initialize_assistant import initialize_assistant
-from vector_store import VectorStore
-from voice import VoiceProcessor
+from vector_store import VectorStore, get_shared_vector_store
+from audio_decode import AudioLimitError
+from tts_pool import SentenceSpeechStream, finalize_wav, shutdown_tts_pool, wav_stream, TTSBusyError
+from audio_cache import get_audio_cache, cached_audio_response
+from admission import AdmissionMiddleware
+from resilience import DeadlineExceeded, CircuitOpenError
+from sessions import valid_session_id
+from namespaces import UnknownPersona, get_namespaces, list_personas
+from telemetry import render_metrics, http_request_duration
+from structured_logging import get_logger, new_request_id, set_request_id, reset_request_id
+from warmup import warm_up
+
+
+logger = get_logger(__name__)
 
 
 # Check if the API key is set
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY environment variable is not set. Please set it in a .env file.")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up in the background, so the server accepts connections (and
+    answers /health) immediately, and stop the text-to-speech workers on shutdown.
+    """
+    asyncio.get_running_loop().run_in_executor(None, warm_up.run)
+    yield
+    shutdown_tts_pool()
+
+
 # Initialize the FastAPI app
 app = FastAPI(
     title="Ali Haider's Personal Assistant API",
     description="API for interacting with Ali Haider's personal AI assistant",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Limit concurrent questions and per-client rates (innermost, so rejections still get CORS and request ID headers)
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +70,35 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    """
+    Bind a request ID (from the X-Request-ID header or a new one) to every log record of the request.
+    """
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    token = set_request_id(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_id(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+if TELEMETRY_ENABLED:
+    @app.middleware("http")
+    async def record_request_duration(request: Request, call_next):
+        """
+        Record the duration of every HTTP request, labelled by route template.
+        """
+        start = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        http_request_duration.observe(time.perf_counter() - start, request.method, path, str(response.status_code))
+        return response
+
 # Get the directory of the current file
 current_dir = pathlib.Path(__file__).parent.absolute()
 
@@ -52,12 +111,44 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 
 # Define request and response models
+class ContextFilters(BaseModel):
+    """
+    Conditions on the chunks an answer may use; each one set must hold.
+    """
+    sources: Optional[List[str]] = None  # File names (e.g. "profile.txt"), or URLs for web results
+    file_types: Optional[List[str]] = None  # e.g. ["txt", "md"]
+    sections: Optional[List[str]] = None  # Section headings
+    origin: Optional[Literal["local", "web"]] = None  # Indexed documents only, or web results only
+    ingested_after: Optional[float] = None  # Unix time
+    ingested_before: Optional[float] = None  # Unix time
+
+
 class QuestionRequest(BaseModel):
     """
     Request model for asking a question.
     """
     question: str
     web_search: bool = True
+    session_id: Optional[str] = None  # Client-chosen conversation ID (e.g. a UUID); omit for a standalone question
+    persona: Optional[str] = None  # Assistant to answer as; omit for the default one
+    filters: Optional[ContextFilters] = None  # Restrict the context to matching chunks
+
+
+class BatchQuestionItem(BaseModel):
+    """
+    A single question within a batch request.
+    """
+    id: Optional[Any] = None
+    question: str
+    web_search: Optional[bool] = None
+
+
+class BatchQuestionRequest(BaseModel):
+    """
+    Request model for asking many questions at once.
+    """
+    questions: List[BatchQuestionItem]
+    web_search: bool = True
 
 
 class VoiceQuestionRequest(BaseModel):
@@ -73,6 +164,7 @@ class AnswerResponse(BaseModel):
     Response model for an answer.
     """
     answer: str
+    session_id: Optional[str] = None
 
 
 class VoiceAnswerResponse(BaseModel):
@@ -96,42 +188,28 @@ class TranscriptionResponse(BaseModel):
     Response model for speech-to-text transcription.
     """
     text: str
+    backend: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    real_time_factor: Optional[float] = None
 
 
-# Dependency to get or initialize the vector store
+# Dependency to get the vector store once warm-up has loaded it
 def get_vector_store():
     """
-    Get the vector store, initializing it if necessary.
+    Get the vector store, or fail fast with 503 while the assistant is still warming up.
     """
-    try:
-        vector_store = VectorStore()
-
-        # If vector store is not initialized, initialize it automatically
-        if vector_store.vector_store is None:
-            print("Vector store not initialized. Initializing automatically...")
-            success = initialize_assistant()
-            if not success:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to initialize the assistant automatically."
-                )
-
-            # Refresh the vector store instance after initialization
-            vector_store = VectorStore()
-
-            if vector_store.vector_store is None:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Vector store initialization failed."
-                )
-
-        return vector_store
-    except Exception as e:
-        print(f"Error in get_vector_store: {str(e)}")
+    if not warm_up.index_ready:
+        if warm_up.error:
+            raise HTTPException(
+                status_code=503,
+                detail=f"The assistant failed to initialize: {warm_up.error}"
+            )
         raise HTTPException(
-            status_code=500,
-            detail=f"Error accessing vector store: {str(e)}"
+            status_code=503,
+            detail="The assistant is still warming up. Please retry shortly.",
+            headers={"Retry-After": str(WARMUP_RETRY_AFTER)}
         )
+    return get_shared_vector_store()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -152,41 +230,101 @@ async def api_root():
     """
     return StatusResponse(
         status="success",
-        message="Welcome to Ali Haider's Personal Assistant API. Use /ask to ask questions. The assistant will initialize automatically when needed."
+        message="Welcome to Ali Haider's Personal Assistant API. Use /ask to ask questions. Check /health for warm-up progress."
     )
 
 
+@app.get("/ready", response_model=StatusResponse)
+async def ready():
+    """
+    Readiness probe: 200 once this worker has finished warming up, 503 until then.
+    """
+    if not warm_up.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": warm_up.stage, "message": "The assistant is still warming up."},
+            headers={"Retry-After": str(WARMUP_RETRY_AFTER)},
+        )
+    return StatusResponse(status="ready", message="The assistant is ready.")
+
+
+@app.get("/health")
+async def health():
+    """
+    Warm-up progress, index size and load time of this worker, and the personas it has loaded.
+    """
+    return {**warm_up.status(), "personas_loaded": get_namespaces().status()}
+
+
+@app.get("/personas")
+async def personas():
+    """
+    Personas that questions can be addressed to.
+    """
+    return {"personas": list_personas()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics for graph nodes, external calls and HTTP requests.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def upstream_error(error: Exception) -> HTTPException:
+    """
+    Map a timed-out or unavailable upstream to 504, or to 503 with Retry-After.
+    """
+    if isinstance(error, CircuitOpenError):
+        logger.warning("Upstream unavailable", extra={"fields": {"upstream": error.upstream}})
+        return HTTPException(
+            status_code=503,
+            detail="The assistant is temporarily unavailable. Please retry shortly.",
+            headers={"Retry-After": str(max(1, round(error.retry_after)))},
+        )
+    logger.warning("Question timed out")
+    return HTTPException(status_code=504, detail="The assistant took too long to answer. Please try again.")
+
+
 @app.post("/ask", response_model=AnswerResponse)
 async def ask_question(request: QuestionRequest, vector_store: VectorStore = Depends(get_vector_store)):
     """
     Endpoint for asking a question to the assistant.
-    The vector store will be automatically initialized if needed.
+    Questions with the same session_id form a conversation.
+    Returns 503 with Retry-After until the assistant has warmed up.
     """
+    if request.session_id is not None and not valid_session_id(request.session_id):
+        raise HTTPException(status_code=400, detail="session_id must be 16-64 letters, digits, '-' or '_'")
+
     try:
         # Log the question for debugging
-        print(f"Processing question: {request.question}")
-        print(f"Web search enabled: {request.web_search}")
-
-        # Import here to ensure we're using the latest configuration
-        from llm import get_llm
-
-        # Log the model being used
-        llm = get_llm()
-        print(f"Using LLM model: {llm.model}")
-
-        # Run the RAG graph to get the answer
-        answer = run_rag_graph(request.question, web_search_enabled=request.web_search)
+        logger.debug("Processing question", extra={"fields": {
+            "question_chars": len(request.question),
+            "web_search": request.web_search,
+        }})
+
+        # Run the RAG graph off the event loop to get the answer
+        answer = await run_in_threadpool(
+            run_rag_graph,
+            request.question,
+            web_search_enabled=request.web_search,
+            session_id=request.session_id,
+            persona=request.persona,
+            filters=request.filters.dict(exclude_none=True) if request.filters else None,
+        )
 
         # Log success
-        print(f"Successfully generated answer for question: {request.question}")
+        logger.info("Generated answer", extra={"fields": {"answer_chars": len(answer)}})
 
-        return AnswerResponse(answer=answer)
+        return AnswerResponse(answer=answer, session_id=request.session_id)
+    except UnknownPersona:
+        raise HTTPException(status_code=404, detail=f"Unknown persona: {request.persona}")
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        raise upstream_error(e)
     except Exception as e:
         # Log the error
-        import traceback
-        print(f"Error processing question: {request.question}")
-        print(f"Error details: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error processing question")
 
         # Return a more user-friendly error message
         error_message = str(e)
@@ -199,8 +337,78 @@ async def ask_question(request: QuestionRequest, vector_store: VectorStore = Dep
         )
 
 
+async def speech_response(http_request: Request, text: str, headers: Dict[str, str]) -> Response:
+    """
+    Return speech for text from the audio cache, or synthesize it sentence by
+    sentence, streaming each sentence as soon as it is ready and caching the result.
+    """
+    cache = await run_in_threadpool(get_audio_cache)
+    key = cache.key_for(text)
+    headers = {**headers, "X-Audio-URL": f"/audio/{key}"}
+
+    cached = await cache.lookup(key)
+    if cached is not None:
+        return cached_audio_response(http_request, key, cached, cache.media_type, headers)
+
+    # Sentences are synthesized as separate clips and streamed as one WAV file
+    audio_stream = wav_stream(SentenceSpeechStream(text))
+    return StreamingResponse(
+        cache.record(key, audio_stream, finalize=finalize_wav),
+        media_type=cache.media_type,
+        headers={**headers, "ETag": f'"{key}"'},
+    )
+
+
+@app.get("/audio/{key}")
+async def get_audio(key: str, http_request: Request):
+    """
+    Serve previously synthesized audio by its content hash, with ETag and Range support.
+    """
+    cache = await run_in_threadpool(get_audio_cache)
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    cached = await cache.lookup(key)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return cached_audio_response(http_request, key, cached, cache.media_type)
+
+
+@app.post("/ask/batch", response_class=StreamingResponse)
+async def ask_batch(request: BatchQuestionRequest, vector_store: VectorStore = Depends(get_vector_store)):
+    """
+    Endpoint for asking many questions at once.
+    Results are streamed back as JSON lines in the order they finish.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many questions: at most {BATCH_MAX_QUESTIONS} per batch"
+        )
+
+    from batch import BatchRunner
+
+    items = [
+        {
+            "id": item.id if item.id is not None else index,
+            "question": item.question,
+            "web_search": request.web_search if item.web_search is None else item.web_search,
+        }
+        for index, item in enumerate(request.questions)
+    ]
+    runner = BatchRunner(vector_store=vector_store)
+
+    # StreamingResponse iterates this generator in the threadpool
+    def stream_results():
+        for result in runner.run(items):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
 @app.post("/ask-voice", response_class=StreamingResponse)
-async def ask_question_voice(request: VoiceQuestionRequest, vector_store: VectorStore = Depends(get_vector_store)):
+async def ask_question_voice(request: VoiceQuestionRequest, http_request: Request, vector_store: VectorStore = Depends(get_vector_store)):
     """
     Endpoint for asking a question and getting the answer as audio.
     Takes text input and returns audio output.
@@ -214,40 +422,34 @@ async def ask_question_voice(request: VoiceQuestionRequest, vector_store: Vector
             )
 
         # Log the question
-        print(f"Processing question: {request.question}")
-        print(f"Web search enabled: {request.web_search}")
-
-        # Run the RAG graph to get the answer
-        answer = run_rag_graph(request.question, web_search_enabled=request.web_search)
+        logger.debug("Processing voice question", extra={"fields": {
+            "question_chars": len(request.question),
+            "web_search": request.web_search,
+        }})
 
-        # Initialize the voice processor
-        voice_processor = VoiceProcessor()
+        # Run the RAG graph off the event loop to get the answer
+        answer = await run_in_threadpool(run_rag_graph, request.question, web_search_enabled=request.web_search)
 
-        # Convert the answer to speech
-        audio_data = voice_processor.text_to_speech(answer)
-        if audio_data is None:
+        if not answer.strip():
             raise HTTPException(
                 status_code=500,
                 detail="Failed to convert answer to speech"
             )
 
-        # Return the audio as a streaming response
-        return StreamingResponse(
-            io.BytesIO(audio_data),
-            media_type="audio/mpeg",
-            headers={
-                "Content-Disposition": "attachment; filename=answer.mp3",
-                "X-Answer-Text": answer  # Include the text answer in headers for reference
-            }
-        )
+        # Serve cached audio, or synthesize and stream it sentence by sentence
+        return await speech_response(http_request, answer, headers={
+            "Content-Disposition": "attachment; filename=answer.wav",
+            "X-Answer-Text": answer  # Include the text answer in headers for reference
+        })
     except HTTPException as e:
         raise e
+    except TTSBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        raise upstream_error(e)
     except Exception as e:
         # Log the error
-        import traceback
-        print(f"Error processing question")
-        print(f"Error details: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error processing voice question")
 
         raise HTTPException(
             status_code=500,
@@ -260,23 +462,29 @@ async def upload_audio(file: UploadFile = File(...)):
     """
     Endpoint for uploading an audio file and converting it to text.
     """
-    try:
-        # Read the audio file
-        audio_data = await file.read()
-
-        # Initialize the voice processor
-        voice_processor = VoiceProcessor()
-
-        # Convert speech to text
-        text = voice_processor.speech_to_text(audio_data)
+    # Speech recognition loads on first use, not at startup
+    from voice import transcribe_async
 
-        return TranscriptionResponse(text=text)
+    try:
+        # Read the audio file, but never more than the upload limit
+        audio_data = await file.read(STT_MAX_UPLOAD_BYTES + 1)
+        if len(audio_data) > STT_MAX_UPLOAD_BYTES:
+            raise AudioLimitError(f"Audio upload exceeds {STT_MAX_UPLOAD_BYTES} bytes")
+
+        # Decode and transcribe on the speech-to-text worker pool
+        result = await transcribe_async(audio_data)
+
+        return TranscriptionResponse(
+            text=result.text,
+            backend=result.backend,
+            duration_seconds=round(result.duration, 3),
+            real_time_factor=round(result.real_time_factor, 3),
+        )
+    except AudioLimitError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         # Log the error
-        import traceback
-        print(f"Error processing audio file: {file.filename}")
-        print(f"Error details: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error processing audio file", extra={"fields": {"filename": file.filename}})
 
         raise HTTPException(
             status_code=500,
@@ -285,36 +493,28 @@ async def upload_audio(file: UploadFile = File(...)):
 
 
 @app.post("/text-to-speech", response_class=StreamingResponse)
-async def text_to_speech(text: str = Form(...)):
+async def text_to_speech(http_request: Request, text: str = Form(...)):
     """
     Endpoint for converting text to speech.
     """
     try:
-        # Initialize the voice processor
-        voice_processor = VoiceProcessor()
-
-        # Convert text to speech
-        audio_data = voice_processor.text_to_speech(text)
-        if audio_data is None:
+        if not text.strip():
             raise HTTPException(
-                status_code=500,
-                detail="Failed to convert text to speech"
+                status_code=400,
+                detail="No text provided"
             )
 
-        # Return the audio as a streaming response
-        return StreamingResponse(
-            io.BytesIO(audio_data),
-            media_type="audio/mpeg",
-            headers={"Content-Disposition": "attachment; filename=speech.mp3"}
-        )
+        # Serve cached audio, or synthesize and stream it sentence by sentence
+        return await speech_response(http_request, text, headers={
+            "Content-Disposition": "attachment; filename=speech.wav"
+        })
     except HTTPException as e:
         raise e
+    except TTSBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         # Log the error
-        import traceback
-        print(f"Error converting text to speech: {text}")
-        print(f"Error details: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error converting text to speech", extra={"fields": {"text_chars": len(text)}})
 
         raise HTTPException(
             status_code=500,
@@ -322,11 +522,27 @@ async def text_to_speech(text: str = Form(...)):
         )
 
 
+@app.websocket("/ws/voice")
+async def voice_conversation(websocket: WebSocket):
+    """
+    Voice conversation over a WebSocket: audio is transcribed while it
+    arrives and the spoken answer is streamed back sentence by sentence.
+    """
+    if not warm_up.index_ready:
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+
+    from voice_session import VoiceConversation
+    await VoiceConversation(websocket).run()
+
+
 def start():
     """
-    Start the FastAPI server.
+    Start the FastAPI server with the production launcher.
     """
-    uvicorn.run("rag-v.api:app", host="0.0.0.0", port=8000, reload=True)
+    from serve import serve
+    serve()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,300 @@
+"""
+Content-addressed cache for synthesized speech.
+
+Audio is keyed by a hash of the text and every setting that affects the
+output (voice, rate, volume, format). Recent entries are kept in an
+in-memory LRU tier; all entries are kept in a size-bounded on-disk tier
+from which they are served directly as files. Disk access from the event
+loop (lookups, stores and eviction) runs in the threadpool.
+"""
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from config import (
+    AUDIO_CACHE_DIR,
+    AUDIO_CACHE_MEMORY_BYTES,
+    AUDIO_CACHE_DISK_BYTES,
+    TTS_VOICE_PREFERENCE,
+    TTS_RATE,
+    TTS_VOLUME,
+    TTS_AUDIO_FORMAT,
+)
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+MEDIA_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav", "aiff": "audio/aiff"}
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class AudioCache:
+    """
+    Two-tier (memory, disk) cache of synthesized audio.
+    """
+
+    def __init__(
+        self,
+        directory: str = AUDIO_CACHE_DIR,
+        memory_bytes: int = AUDIO_CACHE_MEMORY_BYTES,
+        disk_bytes: int = AUDIO_CACHE_DISK_BYTES,
+        audio_format: str = TTS_AUDIO_FORMAT,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Directory for the on-disk tier.
+            memory_bytes: Size limit of the in-memory tier.
+            disk_bytes: Size limit of the on-disk tier.
+            audio_format: Format of the cached audio.
+        """
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.audio_format = audio_format
+        self.media_type = MEDIA_TYPES.get(audio_format, "application/octet-stream")
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        for path, size, _ in self._disk_entries():
+            self._disk_size += size
+
+    def key_for(self, text: str) -> str:
+        """
+        Compute the cache key for text synthesized with the current settings.
+        """
+        material = json.dumps([text, TTS_VOICE_PREFERENCE, TTS_RATE, TTS_VOLUME, self.audio_format])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{self.audio_format}")
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(f".{self.audio_format}"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    async def lookup(self, key: str) -> Optional[Union[bytes, Tuple[str, int]]]:
+        """
+        Look up cached audio, checking the disk tier in the threadpool.
+
+        Returns:
+            The audio bytes from the memory tier, the file path and size from the disk tier, or None.
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                return audio
+        return await run_in_threadpool(self._lookup_disk, key)
+
+    def _lookup_disk(self, key: str) -> Optional[Tuple[str, int]]:
+        path = self.path_for(key)
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # Recency for disk eviction
+        except OSError:
+            pass
+        return path, size
+
+    def store(self, key: str, audio: bytes) -> None:
+        """
+        Store audio in both tiers, evicting the least recently used entries over the limits.
+        """
+        if not audio:
+            return
+
+        with self._lock:
+            if len(audio) <= self.memory_bytes and key not in self._memory:
+                self._memory[key] = audio
+                self._memory_size += len(audio)
+                while self._memory_size > self.memory_bytes:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_size -= len(evicted)
+
+        path = self.path_for(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+        finally:
+            # Left behind only if the write or rename failed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self._disk_size += len(audio)
+            over_limit = self._disk_size > self.disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_size = total
+        logger.info("Evicted audio cache entries", extra={"fields": {"disk_bytes": total}})
+
+    async def record(
+        self,
+        key: str,
+        chunks: AsyncIterable[bytes],
+        finalize: Optional[Callable[[bytes], bytes]] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Pass audio chunks through while collecting them, and store the
+        complete audio once the stream finishes successfully.
+
+        Args:
+            key: The cache key.
+            chunks: The audio stream.
+            finalize: Turns the collected stream into the file to store, e.g. to fill in header sizes.
+        """
+        collected = bytearray()
+        async for chunk in chunks:
+            collected.extend(chunk)
+            yield chunk
+        audio = finalize(bytes(collected)) if finalize is not None else bytes(collected)
+        # Writing the file and evicting old entries would block the event loop
+        await run_in_threadpool(self.store, key, audio)
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=start-end" header into an inclusive range.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    return start, min(end, size - 1)
+
+
+def _read_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def cached_audio_response(
+    request: Request,
+    key: str,
+    audio: Union[bytes, Tuple[str, int]],
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Build a response for cached audio with ETag and Range support.
+
+    Args:
+        request: The incoming request.
+        key: The cache key, used as the ETag.
+        audio: The audio bytes, or the path and size of the cached file, as returned by AudioCache.lookup.
+        media_type: The audio media type.
+        headers: Extra response headers.
+
+    Returns:
+        A 304, 206, 416 or 200 response.
+    """
+    etag = f'"{key}"'
+    headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    # The size of a cached file comes from the lookup, so nothing here touches the disk on the event loop
+    if isinstance(audio, bytes):
+        size = len(audio)
+    else:
+        path, size = audio
+    byte_range = _parse_range(request.headers.get("range"), size)
+
+    if byte_range is not None:
+        start, end = byte_range
+        if start > end or start >= size:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        if isinstance(audio, bytes):
+            return Response(audio[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+        return StreamingResponse(_read_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+    if isinstance(audio, bytes):
+        return Response(audio, media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_read_range(path, 0, size - 1), media_type=media_type, headers=headers)
+
+
+_cache: Optional[AudioCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache:
+    """
+    Get the process-wide audio cache, creating it on first use.
+
+    Creating it walks the disk tier, so the warm-up creates it at startup;
+    code on the event loop should call this through the threadpool.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AudioCache()
+    return _cache
@@ -0,0 +1,117 @@
+"""
+In-memory decoding of uploaded audio into PCM for speech recognition.
+"""
+from typing import TYPE_CHECKING, Union
+import audioop
+import io
+import subprocess
+import wave
+
+from config import STT_MAX_UPLOAD_BYTES, STT_MAX_DURATION_SECONDS, STT_MAX_SAMPLE_RATE
+
+if TYPE_CHECKING:
+    import speech_recognition as sr
+
+
+class AudioLimitError(ValueError):
+    """
+    Raised when uploaded audio exceeds the configured size or duration limits.
+    """
+
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+def _check_size(data: BytesLike) -> None:
+    if len(data) > STT_MAX_UPLOAD_BYTES:
+        raise AudioLimitError(f"Audio upload exceeds {STT_MAX_UPLOAD_BYTES} bytes")
+
+
+def _check_duration(frames: int, sample_rate: int) -> None:
+    if sample_rate and frames / sample_rate > STT_MAX_DURATION_SECONDS:
+        raise AudioLimitError(f"Audio is longer than {STT_MAX_DURATION_SECONDS} seconds")
+
+
+def _is_wav(data: BytesLike) -> bool:
+    return len(data) >= 12 and bytes(data[0:4]) == b"RIFF" and bytes(data[8:12]) == b"WAVE"
+
+
+def _decode_wav(data: BytesLike):
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        sample_rate = wav.getframerate()
+
+        # Check the duration from the header before reading any frames
+        _check_duration(wav.getnframes(), sample_rate)
+        frames = wav.readframes(wav.getnframes())
+
+    return frames, channels, sample_width, sample_rate
+
+
+def _decode_with_ffmpeg(data: BytesLike):
+    """
+    Decode any container ffmpeg understands to 16-bit mono PCM through pipes, without temp files.
+    """
+    from pydub import AudioSegment
+
+    process = subprocess.run(
+        [
+            AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-t", str(STT_MAX_DURATION_SECONDS + 1),
+            "-f", "s16le", "-ac", "1", "-ar", str(STT_MAX_SAMPLE_RATE),
+            "pipe:1",
+        ],
+        input=bytes(data),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+    if process.returncode != 0 or not process.stdout:
+        raise ValueError(f"Could not decode audio: {process.stderr.decode('utf-8', 'replace').strip()}")
+
+    sample_width = 2
+    _check_duration(len(process.stdout) // sample_width, STT_MAX_SAMPLE_RATE)
+    return process.stdout, 1, sample_width, STT_MAX_SAMPLE_RATE
+
+
+def decode_audio(data: BytesLike) -> "sr.AudioData":
+    """
+    Decode uploaded audio into an AudioData for the recognizer.
+
+    WAV is parsed in memory; other formats are decoded by ffmpeg over pipes.
+    The result is mono, and it is resampled only when its rate is above
+    STT_MAX_SAMPLE_RATE.
+
+    Args:
+        data: The uploaded audio.
+
+    Returns:
+        The audio data.
+
+    Raises:
+        AudioLimitError: If the audio is too large or too long.
+        ValueError: If the audio cannot be decoded.
+    """
+    import speech_recognition as sr
+
+    _check_size(data)
+    if not data:
+        raise ValueError("Empty audio data received")
+
+    if _is_wav(data):
+        frames, channels, sample_width, sample_rate = _decode_wav(data)
+    else:
+        frames, channels, sample_width, sample_rate = _decode_with_ffmpeg(data)
+
+    if channels == 2:
+        frames = audioop.tomono(frames, sample_width, 0.5, 0.5)
+    elif channels > 2:
+        raise ValueError(f"Unsupported channel count: {channels}")
+
+    if sample_rate > STT_MAX_SAMPLE_RATE:
+        frames, _ = audioop.ratecv(frames, sample_width, 1, sample_rate, STT_MAX_SAMPLE_RATE, None)
+        sample_rate = STT_MAX_SAMPLE_RATE
+
+    return sr.AudioData(frames, sample_rate, sample_width)
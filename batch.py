@@ -0,0 +1,308 @@
+"""
+Batch question answering for bulk evaluation and offline workloads.
+"""
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import os
+import re
+import time
+
+import numpy as np
+from langchain.schema.document import Document
+
+from llm import ModelCascade, get_model_cascade
+from vector_store import VectorStore, get_shared_vector_store
+from prompt_templates import get_query_transformation_prompt, render_rag_messages
+from prompt_cache import get_context_cache, record_uncached_prompt
+from rag_graph import format_context, get_shared_web_retriever, merge_context
+from namespaces import DEFAULT_PERSONA, get_namespaces, load_persona
+from source_registry import get_source_registry
+from resilience import DeadlineExceeded, get_caller, should_fall_back, stage_budget
+from config import (
+    BATCH_MAX_CONCURRENCY,
+    BATCH_QUERY_SIMILARITY,
+    PROMPT_CACHE_ENABLED,
+    REQUEST_DEADLINE,
+    ROUTER_MAX_QUERY_WORDS,
+)
+from telemetry import span, estimate_tokens
+from structured_logging import get_logger
+
+
+if TYPE_CHECKING:
+    from web_retriever import WebRetriever
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class BatchQuestion:
+    """
+    A unique question in a batch and the request items that asked it.
+    """
+    question: str
+    web_search: bool
+    ids: List[Any] = field(default_factory=list)
+    search_query: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+    context: List[Document] = field(default_factory=list)
+    top_relevance: Optional[float] = None
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for deduplication.
+    """
+    return re.sub(r"\s+", " ", question).strip().casefold()
+
+
+class BatchRunner:
+    """
+    Answer many questions at once, sharing work between them:
+
+    - identical questions are answered once,
+    - query embeddings are computed in one batched call,
+    - near-identical queries share one retrieval,
+    - LLM calls run with bounded concurrency and results are yielded as they finish.
+
+    Each question is answered like a single request: through the model
+    cascade, with the pre-rendered prompt prefix, and with its LLM calls
+    retried and bounded by the request deadline.
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        cascade: Optional[ModelCascade] = None,
+        vector_store: Optional[VectorStore] = None,
+        web_retriever: Optional["WebRetriever"] = None,
+        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+        similarity_threshold: float = BATCH_QUERY_SIMILARITY,
+        persona: Optional[str] = None,
+    ):
+        """
+        Initialize the batch runner.
+
+        Args:
+            llm: A single LLM for every call. If None, uses the model cascade.
+            cascade: The model tiers to use, if llm is not given. If None, the process-wide cascade is used.
+            vector_store: The vector store to retrieve from. If None, uses the persona's index.
+            web_retriever: The web retriever to use. If None, uses the process-wide one.
+            max_concurrency: Maximum concurrent LLM calls.
+            similarity_threshold: Cosine similarity above which queries share retrieval.
+            persona: The assistant to answer as. If None, uses the default persona.
+
+        Raises:
+            UnknownPersona: If the persona is not configured.
+        """
+        settings = load_persona(persona or DEFAULT_PERSONA)
+        if vector_store is None:
+            # The same index, built on first use, that the persona's single questions are answered from
+            if settings.name == DEFAULT_PERSONA:
+                vector_store = get_shared_vector_store()
+            else:
+                vector_store = get_namespaces().get(settings.name).vector_store
+        self.prompt_prefix = settings.prompt_prefix
+        self.query_transformation_prompt = (
+            get_query_transformation_prompt(settings.query_prompt) if settings.query_prompt
+            else get_query_transformation_prompt()
+        )
+        self.sources = (
+            get_source_registry() if settings.name == DEFAULT_PERSONA
+            else get_source_registry(os.path.join(settings.data_dir, "sources.json"))
+        )
+
+        use_gemini = llm is None and cascade is None
+        self.cascade = ModelCascade.single(llm) if llm is not None else cascade or get_model_cascade()
+        # Provider-side caching of the static prompt prefix, only for the real Gemini models
+        self.context_caches = {
+            tier: get_context_cache(self.cascade.model_name(tier), self.prompt_prefix) for tier in self.cascade.order
+        } if use_gemini and PROMPT_CACHE_ENABLED else {}
+        self.vector_store = vector_store
+        self.web_retriever = web_retriever or get_shared_web_retriever()
+        self.max_concurrency = max_concurrency
+        self.similarity_threshold = similarity_threshold
+
+    def _dedupe(self, items: Iterable[Dict[str, Any]]) -> List[BatchQuestion]:
+        unique: Dict[tuple, BatchQuestion] = {}
+        for index, item in enumerate(items):
+            question = item["question"]
+            web_search = bool(item.get("web_search", True))
+            key = (normalize_question(question), web_search)
+            if key not in unique:
+                unique[key] = BatchQuestion(question=question, web_search=web_search)
+            unique[key].ids.append(item.get("id", index))
+        return list(unique.values())
+
+    def _transform(self, question: BatchQuestion) -> None:
+        tier = self.cascade.fastest
+        chain = self.query_transformation_prompt | self.cascade.llm(tier)
+        deadline = time.monotonic() + REQUEST_DEADLINE
+        try:
+            with span("llm.invoke", purpose="transform_query", tier=tier), \
+                    self.cascade.measure(tier, "transform_query") as usage:
+                question.search_query = get_caller(f"llm.{self.cascade.model_name(tier)}").call(
+                    lambda: chain.invoke({"question": question.question}),
+                    timeout=stage_budget(deadline, "transform_query"),
+                ).content
+                usage["prompt_tokens"] = estimate_tokens(question.question)
+                usage["completion_tokens"] = estimate_tokens(question.search_query)
+        except Exception as e:
+            if not (should_fall_back(e) or isinstance(e, DeadlineExceeded)):
+                raise
+            # As in the graph, retrieval still works with the question itself
+            logger.warning("Query rewrite failed; searching with the question", extra={"fields": {"error": type(e).__name__}})
+            question.search_query = question.question
+
+    def _retrieve_one(self, question: BatchQuestion) -> None:
+        results = self.vector_store.similarity_search_with_relevance_by_vector(question.embedding.tolist())
+        documents = [document for document, _ in results]
+        question.top_relevance = max((score for _, score in results), default=None)
+        if question.web_search:
+            # As in the graph, a failed web search leaves the question with the indexed context
+            deadline = time.monotonic() + REQUEST_DEADLINE
+            try:
+                web_documents = get_caller("web", max_attempts=1, hedge=False).call(
+                    lambda: self.web_retriever.retrieve_from_web(
+                        question.search_query, vector_store=self.vector_store, sources=self.sources,
+                    ),
+                    timeout=stage_budget(deadline, "retrieve_from_web"),
+                )
+            except Exception as e:
+                if not (should_fall_back(e) or isinstance(e, DeadlineExceeded)):
+                    raise
+                logger.warning("Web search failed; answering from the index", extra={"fields": {"error": type(e).__name__}})
+                web_documents = []
+            documents = merge_context(documents, web_documents)
+        question.context = documents
+
+    def _retrieve(self, questions: List[BatchQuestion], executor: ThreadPoolExecutor) -> Tuple[int, Dict[int, str]]:
+        """
+        Retrieve context for all questions, sharing retrieval across
+        near-identical queries.
+
+        Returns:
+            The number of retrievals performed, and the errors of the questions
+            whose retrieval failed, keyed by their position in questions.
+        """
+        try:
+            embeddings = self.vector_store.embed_queries([question.search_query for question in questions])
+        except Exception as e:
+            logger.error("Batch query embedding failed: %s", e)
+            return 0, {i: str(e) for i in range(len(questions))}
+        for question, embedding in zip(questions, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            question.embedding = vector / (np.linalg.norm(vector) or 1.0)
+
+        # Greedy clustering: each query joins the first representative it is close enough to
+        representatives: List[int] = []
+        followers: Dict[int, int] = {}
+        for i, question in enumerate(questions):
+            for r in representatives:
+                representative = questions[r]
+                if (representative.web_search == question.web_search
+                        and float(representative.embedding @ question.embedding) >= self.similarity_threshold):
+                    followers[i] = r
+                    break
+            else:
+                representatives.append(i)
+
+        failed: Dict[int, str] = {}
+        futures = {executor.submit(self._retrieve_one, questions[r]): r for r in representatives}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                logger.error("Batch retrieval failed: %s", future.exception())
+                failed[futures[future]] = str(future.exception())
+        for i, r in followers.items():
+            if r in failed:
+                failed[i] = failed[r]
+            else:
+                questions[i].context = questions[r].context
+                questions[i].top_relevance = questions[r].top_relevance
+
+        return len(representatives), failed
+
+    def _generate(self, question: BatchQuestion) -> Tuple[str, str]:
+        """
+        Answer one question from its context, through the model cascade.
+
+        Returns:
+            The answer, and the tier that produced it.
+        """
+        context_text = format_context(question.context)
+        messages = render_rag_messages(context_text, question.question, prefix=self.prompt_prefix)
+        suffix = messages[-1].content
+        deadline = time.monotonic() + REQUEST_DEADLINE
+
+        def generate_with(tier: str) -> str:
+            with span("llm.invoke", purpose="generate_answer", tier=tier, context_chunks=len(question.context)), \
+                    self.cascade.measure(tier, "generate_answer") as usage:
+                cache = self.context_caches.get(tier)
+
+                def invoke() -> str:
+                    answer = cache.generate(suffix) if cache is not None else None
+                    if answer is not None:
+                        return answer
+                    record_uncached_prompt(self.prompt_prefix, suffix)
+                    return self.cascade.llm(tier).invoke(messages).content
+
+                answer = get_caller(f"llm.{self.cascade.model_name(tier)}").call(
+                    invoke, timeout=stage_budget(deadline, "generate_answer")
+                )
+                usage["prompt_tokens"] = estimate_tokens(self.prompt_prefix) + estimate_tokens(suffix)
+                usage["completion_tokens"] = estimate_tokens(answer)
+            return answer
+
+        simple = len(question.question.split()) <= ROUTER_MAX_QUERY_WORDS
+        answer, tier, _ = self.cascade.generate(generate_with, question.top_relevance, simple)
+        return answer, tier
+
+    def run(self, items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Answer a batch of questions.
+
+        Args:
+            items: Dicts with a "question", an optional "id" and an optional "web_search" flag.
+
+        Yields:
+            One result dict per input item, in completion order.
+        """
+        questions = self._dedupe(items)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # Query rewriting is one LLM call per unique question
+            failed: Dict[int, str] = {}
+            futures = {executor.submit(self._transform, question): i for i, question in enumerate(questions)}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed[futures[future]] = str(future.exception())
+
+            for i, error in failed.items():
+                for item_id in questions[i].ids:
+                    yield {"id": item_id, "question": questions[i].question, "error": error}
+            remaining = [question for i, question in enumerate(questions) if i not in failed]
+
+            if remaining:
+                retrievals, failed = self._retrieve(remaining, executor)
+                logger.info("Batch retrieval", extra={"fields": {
+                    "unique_questions": len(remaining),
+                    "retrievals": retrievals,
+                    "failed": len(failed),
+                }})
+                for i, error in failed.items():
+                    for item_id in remaining[i].ids:
+                        yield {"id": item_id, "question": remaining[i].question, "error": error}
+                remaining = [question for i, question in enumerate(remaining) if i not in failed]
+
+            futures = {executor.submit(self._generate, question): question for question in remaining}
+            for future in as_completed(futures):
+                question = futures[future]
+                try:
+                    answer, tier = future.result()
+                    result = {"answer": answer, "tier": tier}
+                except Exception as e:
+                    logger.error("Batch generation failed: %s", e)
+                    result = {"error": str(e)}
+                for item_id in question.ids:
+                    yield {"id": item_id, "question": question.question, **result}
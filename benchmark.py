@@ -0,0 +1,596 @@
+"""
+Offline, deterministic benchmark harness for the RAG pipeline.
+
+Gemini, the embedding model, Tavily search and the fetched web pages are all
+replaced with local stand-ins that have configurable latency, so runs are
+repeatable and can be compared between commits:
+
+    python benchmark.py --output bench.json
+"""
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import math
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+# The application refuses to start without a key; the fakes never use it
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-fake-key")
+# The API load test sends every request from one address, which the per-client rate limit would mostly reject
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+from langchain.schema.embeddings import Embeddings
+
+
+# Node names of the RAG graph, in execution order
+GRAPH_NODES = ["route", "transform_query", "retrieve_from_vector_store", "retrieve_from_web", "combine_context", "generate_answer"]
+
+BENCHMARK_QUESTIONS = [
+    "Who is Ali Haider?",
+    "What is Frellectra AI?",
+    "What are Ali's areas of expertise?",
+    "What projects has Ali worked on?",
+    "What is Ali's role at Frellectra AI?",
+    "What technologies does Ali work with?",
+]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stand-in for ChatGoogleGenerativeAI with a fixed first-token latency and token rate.
+    """
+    model: str = "fake-gemini"
+    latency: float = 0.3
+    tokens_per_second: float = 200.0
+    output_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+
+        # Deterministic output derived from the prompt
+        words = [word for word in prompt.split() if word.isalpha()] or ["answer"]
+        digest = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+        content = " ".join(words[(digest + i) % len(words)] for i in range(self.output_tokens))
+
+        time.sleep(self.latency + self.output_tokens / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+class StubTierModel(FakeChatModel):
+    """
+    FakeChatModel that admits it does not know on a deterministic share of prompts.
+    """
+    uncertain_share: float = 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        prompt = "\n".join(str(message.content) for message in messages)
+        if int(hashlib.md5(prompt.encode("utf-8")).hexdigest(), 16) % 100 < self.uncertain_share * 100:
+            content = "I'm not sure; the context does not contain this."
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+        return result
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-hashed-words embeddings with a fixed per-call latency.
+    """
+
+    def __init__(self, dimension: int = 768, latency: float = 0.05):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            index = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimension
+            vector[index] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    Serve deterministic HTML pages with a configurable delay.
+    """
+    delay = 0.05
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = (
+            f"<html><head><title>{self.path}</title></head><body>"
+            f"<h1>Benchmark page {self.path}</h1>"
+            + "".join(f"<p>Ali Haider works on Agentic AI and RAG applications at Frellectra AI. Paragraph {i}.</p>"
+                      for i in range(40))
+            + "</body></html>"
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_page_server(delay: float) -> ThreadingHTTPServer:
+    """
+    Start the local page server on a free port in a background thread.
+    """
+    handler = type("ConfiguredPageHandler", (PageHandler,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_fake_search_tool(base_url: str, latency: float):
+    """
+    Build a stand-in for TavilySearchResults that returns pages from the local server.
+    """
+
+    class FakeSearchTool:
+        def __init__(self, max_results: int = 5, **kwargs):
+            self.max_results = max_results
+
+        def invoke(self, query: str) -> List[Dict[str, Any]]:
+            time.sleep(latency)
+            digest = hashlib.sha1(query.encode("utf-8")).hexdigest()
+            return [
+                {"title": f"Result {i}", "url": f"{base_url}/page/{digest[:8]}/{i}", "content": query}
+                for i in range(self.max_results)
+            ]
+
+    return FakeSearchTool
+
+
+def install_fakes(args) -> Dict[str, Any]:
+    """
+    Replace every external dependency of the pipeline with a local stand-in and
+    build a vector index over the bundled data with the fake embeddings.
+
+    Returns:
+        The fake components and the page server.
+    """
+    import llm
+    import vector_store
+    import web_retriever
+    from document_loader import load_documents_from_directory
+
+    fake_llm = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.token_rate)
+    embeddings = FakeEmbeddings(latency=args.embedding_latency)
+    server = start_page_server(args.page_delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    llm.get_llm = lambda *a, **kw: fake_llm
+    vector_store.get_embedding_model = lambda: embeddings
+    vector_store.get_document_embedding_model = lambda: embeddings
+    vector_store.VECTOR_STORE_PATH = tempfile.mkdtemp(prefix="bench_vector_store_")
+    web_retriever.TavilySearchResults = make_fake_search_tool(base_url, args.search_latency)
+    if args.no_local_sources:
+        import rag_graph
+        from source_registry import SourceRegistry
+        rag_graph.get_source_registry = lambda *a, **kw: SourceRegistry([])
+
+    # Plain text sources only, so the index does not depend on optional parsers
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    documents = load_documents_from_directory(data_dir, file_extensions=[".txt"])
+    vector_store.VectorStore().add_documents(documents)
+
+    return {"llm": fake_llm, "embeddings": embeddings, "server": server, "documents": len(documents)}
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples in milliseconds.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def bench_graph(iterations: int, web_search: bool) -> Dict[str, Any]:
+    """
+    Run the graph sequentially and measure per-node and end-to-end latency.
+    """
+    from rag_graph import create_rag_graph
+
+    graph = create_rag_graph()
+    node_samples: Dict[str, List[float]] = {node: [] for node in GRAPH_NODES}
+    end_to_end: List[float] = []
+
+    for i in range(iterations):
+        question = BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)]
+        start = last = time.perf_counter()
+
+        # Each streamed item is emitted when its node finishes
+        for step in graph.stream({"question": question, "web_search_enabled": web_search}):
+            now = time.perf_counter()
+            for node in step:
+                if node in node_samples:
+                    node_samples[node].append(now - last)
+            last = now
+
+        end_to_end.append(time.perf_counter() - start)
+
+    return {
+        "nodes": {node: percentiles(samples) for node, samples in node_samples.items() if samples},
+        "end_to_end": percentiles(end_to_end),
+    }
+
+
+def bench_cascade(iterations: int, web_search: bool, args) -> Dict[str, Any]:
+    """
+    Evaluate the model cascade offline with stub tiers: latency, tier usage,
+    escalations and estimated spend, against sending every call to the strong tier.
+    """
+    from llm import FAST_TIER, STRONG_TIER, ModelCascade
+    from rag_graph import create_rag_graph
+
+    fast = StubTierModel(
+        model="stub-fast", latency=args.llm_latency, tokens_per_second=args.token_rate,
+        uncertain_share=args.fast_uncertain_share,
+    )
+    strong = FakeChatModel(
+        model="stub-strong", latency=args.llm_latency * args.strong_slowdown,
+        tokens_per_second=args.token_rate / args.strong_slowdown,
+    )
+
+    def evaluate(cascade: ModelCascade) -> Dict[str, Any]:
+        graph = create_rag_graph(cascade=cascade)
+        latencies: List[float] = []
+        tiers: Dict[str, int] = {}
+        reasons: Dict[str, int] = {}
+        for i in range(iterations):
+            question = BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)]
+            start = time.perf_counter()
+            result = graph.invoke({"question": question, "web_search_enabled": web_search})
+            latencies.append(time.perf_counter() - start)
+            tiers[result["answer_tier"]] = tiers.get(result["answer_tier"], 0) + 1
+            reason = result.get("escalation_reason")
+            if reason:
+                reasons[reason] = reasons.get(reason, 0) + 1
+        return {
+            "end_to_end": percentiles(latencies),
+            "answers_per_tier": tiers,
+            "escalations": reasons,
+            "spend_usd_per_question": {tier: round(spend / iterations, 8) for tier, spend in cascade.spend.items()},
+        }
+
+    return {
+        "cascade": evaluate(ModelCascade({FAST_TIER: fast, STRONG_TIER: strong})),
+        "strong_only": evaluate(ModelCascade({STRONG_TIER: strong})),
+    }
+
+
+def bench_api(requests_total: int, concurrency: int, web_search: bool) -> Dict[str, Any]:
+    """
+    Serve api.app locally and measure throughput under concurrent load.
+    """
+    import requests
+    import uvicorn
+    from api import app
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/ask"
+
+    # Questions are refused with 503 until warm-up has loaded the index
+    ready_deadline = time.monotonic() + 300
+    while requests.get(f"http://127.0.0.1:{port}/ready", timeout=5).status_code != 200:
+        if time.monotonic() > ready_deadline:
+            server.should_exit = True
+            raise RuntimeError("The API did not finish warming up within 300s")
+        time.sleep(0.2)
+
+    def ask(i: int):
+        question = BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)]
+        start = time.perf_counter()
+        response = requests.post(url, json={"question": question, "web_search": web_search}, timeout=120)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(ask, range(requests_total)))
+    elapsed = time.perf_counter() - start
+
+    server.should_exit = True
+    thread.join(timeout=5)
+
+    latencies = [latency for latency, status in results if status == 200]
+    return {
+        "requests": requests_total,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, status in results if status != 200),
+        "requests_per_second": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency": percentiles(latencies),
+    }
+
+
+class MockCachedModel:
+    """
+    Stand-in for a Gemini model bound to cached content. Input tokens cost
+    latency and billing; cached prefix tokens cost a fraction of both.
+    """
+
+    def __init__(self, prefix_tokens: int, token_latency: float, cached_cost: float):
+        self.prefix_tokens = prefix_tokens
+        self.token_latency = token_latency
+        self.cached_cost = cached_cost
+        self.billed_tokens = 0.0
+
+    def generate_content(self, suffix: str):
+        from telemetry import estimate_tokens
+
+        tokens = self.prefix_tokens * self.cached_cost + estimate_tokens(suffix)
+        time.sleep(tokens * self.token_latency)
+        self.billed_tokens += tokens
+        return type("Response", (), {"text": "answer"})()
+
+
+def make_mock_context_cache(prefix: str, token_latency: float, cached_cost: float):
+    """
+    Build a ContextCache whose provider is simulated locally.
+    """
+    from prompt_cache import ContextCache
+
+    class MockContextCache(ContextCache):
+        def _supported(self) -> bool:
+            return True
+
+        def _create(self):
+            return MockCachedModel(self.prefix_tokens, token_latency, cached_cost)
+
+    return MockContextCache("mock-gemini", prefix, min_tokens=0)
+
+
+def bench_prompt_cache(iterations: int, token_latency: float, cached_cost: float) -> Dict[str, Any]:
+    """
+    Measure prompt assembly cost, and simulated provider latency and billed
+    tokens with and without the cached prefix.
+    """
+    from prompt_templates import RAG_PREFIX, get_rag_prompt_template, render_rag_messages
+    from telemetry import estimate_tokens
+
+    context = "\n\n".join(
+        f"Ali Haider works on Agentic AI and RAG applications at Frellectra AI. Paragraph {i}." for i in range(40)
+    )
+    questions = [BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)] for i in range(iterations)]
+
+    # Local formatting: full template per request versus pre-rendered prefix plus suffix
+    template = get_rag_prompt_template()
+    start = time.perf_counter()
+    for question in questions:
+        template.format_messages(context=context, question=question)
+    template_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for question in questions:
+        render_rag_messages(context, question)
+    prerendered_seconds = time.perf_counter() - start
+
+    # Simulated provider: the whole prompt every time versus the cached prefix
+    prefix_tokens = estimate_tokens(RAG_PREFIX)
+    uncached_latencies, uncached_billed = [], 0
+    for question in questions:
+        tokens = prefix_tokens + estimate_tokens(render_rag_messages(context, question)[-1].content)
+        start = time.perf_counter()
+        time.sleep(tokens * token_latency)
+        uncached_latencies.append(time.perf_counter() - start)
+        uncached_billed += tokens
+
+    cache = make_mock_context_cache(RAG_PREFIX, token_latency, cached_cost)
+    cached_latencies = []
+    for question in questions:
+        suffix = render_rag_messages(context, question)[-1].content
+        start = time.perf_counter()
+        cache.generate(suffix)
+        cached_latencies.append(time.perf_counter() - start)
+    cached_billed = cache._get_model().billed_tokens
+
+    return {
+        "prefix_tokens_est": prefix_tokens,
+        "formatting_us_per_request": {
+            "template": round(template_seconds / iterations * 1e6, 1),
+            "prerendered_prefix": round(prerendered_seconds / iterations * 1e6, 1),
+        },
+        "uncached": {"billed_tokens_per_request": round(uncached_billed / iterations, 1), "latency": percentiles(uncached_latencies)},
+        "cached": {"billed_tokens_per_request": round(cached_billed / iterations, 1), "latency": percentiles(cached_latencies)},
+        "billed_token_savings": round(1 - cached_billed / uncached_billed, 3) if uncached_billed else 0.0,
+    }
+
+
+def synthetic_corpus(chunks: int, words_per_chunk: int = 80, vocabulary: int = 5000, seed: int = 7) -> List[Any]:
+    """
+    Build a deterministic corpus of random-word chunks spread over 50 source files.
+    """
+    import random
+    from langchain.schema.document import Document
+
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    return [
+        Document(
+            page_content=" ".join(rng.choice(words) for _ in range(words_per_chunk)),
+            metadata={"source": f"synthetic/doc_{i % 50:02d}.txt"},
+        )
+        for i in range(chunks)
+    ]
+
+
+def bench_sharding(shard_counts: List[int], chunks: int, queries: int, k: int = 10) -> Dict[str, Any]:
+    """
+    Ingest a synthetic corpus into indexes with a growing number of shards, and
+    measure ingest throughput, query latency (scatter-gather only, the query
+    embedding is precomputed) and agreement of the top k with a single index.
+    """
+    import random
+    from vector_store import VectorStore
+    from sharded_vector_store import ShardedVectorStore
+
+    corpus = synthetic_corpus(chunks)
+    rng = random.Random(11)
+    query_texts = [
+        " ".join(rng.sample(corpus[rng.randrange(len(corpus))].page_content.split(), 8)) for _ in range(queries)
+    ]
+
+    results: Dict[str, Any] = {}
+    baseline: Optional[List[List[str]]] = None
+    for count in shard_counts:
+        directory = tempfile.mkdtemp(prefix=f"bench_shards_{count}_")
+        store = ShardedVectorStore(persist_directory=directory, num_shards=count) if count > 1 else VectorStore(persist_directory=directory)
+
+        start = time.perf_counter()
+        store.add_documents(corpus)
+        ingest_seconds = time.perf_counter() - start
+
+        embeddings = store.embed_queries(query_texts)
+        samples: List[float] = []
+        top: List[List[str]] = []
+        for embedding in embeddings:
+            start = time.perf_counter()
+            found = store.similarity_search_with_relevance_by_vector(embedding, k=k)
+            samples.append(time.perf_counter() - start)
+            top.append([document.page_content for document, _ in found])
+
+        if baseline is None:
+            baseline = top
+        agreement = sum(len(set(a) & set(b)) for a, b in zip(top, baseline)) / max(1, sum(len(b) for b in baseline))
+        results[str(count)] = {
+            "ingest_seconds": round(ingest_seconds, 3),
+            "ingest_chunks_per_second": round(chunks / ingest_seconds, 1) if ingest_seconds else None,
+            "query": percentiles(samples),
+            "top_k_agreement": round(agreement, 4),
+        }
+        store.clear_vector_store()
+
+    return {"chunks": chunks, "queries": queries, "k": k, "shards": results}
+
+
+def bench_compression(chunks: int, k: int = 10) -> Dict[str, Any]:
+    """
+    Memory saved and recall@k of each compressed index mode on the synthetic corpus.
+    """
+    import vector_store
+    from index_compression import compression_report
+
+    corpus = synthetic_corpus(chunks)
+    # The fake embeddings installed by install_fakes
+    vectors = vector_store.get_document_embedding_model().embed_documents([document.page_content for document in corpus])
+    return {"chunks": chunks, "k": k, "modes": compression_report(vectors, k=k)}
+
+
+def git_commit() -> Optional[str]:
+    """
+    Get the current commit hash, if available.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmark for the RAG pipeline")
+    parser.add_argument("--iterations", type=int, default=20, help="Sequential graph runs")
+    parser.add_argument("--requests", type=int, default=50, help="Total API requests for the load test")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent API clients")
+    parser.add_argument("--no-web", dest="no_web", action="store_true", help="Disable web search")
+    parser.add_argument("--no-local-sources", dest="no_local_sources", action="store_true",
+                        help="Search the fake web for every question, even ones about registered local sources")
+    parser.add_argument("--skip-api", dest="skip_api", action="store_true", help="Skip the API load test")
+    parser.add_argument("--llm-latency", dest="llm_latency", type=float, default=0.3, help="Fake LLM latency in seconds")
+    parser.add_argument("--token-rate", dest="token_rate", type=float, default=200.0, help="Fake LLM tokens per second")
+    parser.add_argument("--embedding-latency", dest="embedding_latency", type=float, default=0.05, help="Fake embedding latency in seconds")
+    parser.add_argument("--search-latency", dest="search_latency", type=float, default=0.2, help="Fake search latency in seconds")
+    parser.add_argument("--page-delay", dest="page_delay", type=float, default=0.05, help="Local page server delay in seconds")
+    parser.add_argument("--prompt-token-latency", dest="prompt_token_latency", type=float, default=0.0001,
+                        help="Simulated provider seconds per uncached input token")
+    parser.add_argument("--cached-token-cost", dest="cached_token_cost", type=float, default=0.25,
+                        help="Simulated cost of a cached prefix token relative to an uncached one")
+    parser.add_argument("--strong-slowdown", dest="strong_slowdown", type=float, default=3.0,
+                        help="How many times slower the stub strong tier is than the fast tier")
+    parser.add_argument("--fast-uncertain-share", dest="fast_uncertain_share", type=float, default=0.2,
+                        help="Share of prompts the stub fast tier says it cannot answer")
+    parser.add_argument("--shard-counts", dest="shard_counts", default="1,2,4,8",
+                        help="Comma-separated shard counts for the sharding benchmark")
+    parser.add_argument("--synthetic-chunks", dest="synthetic_chunks", type=int, default=10000,
+                        help="Size of the synthetic corpus for the sharding benchmark")
+    parser.add_argument("--output", "-o", help="Write results as JSON to this file")
+
+    args = parser.parse_args()
+
+    fakes = install_fakes(args)
+    web_search = not args.no_web
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "documents": fakes["documents"],
+        "graph": bench_graph(args.iterations, web_search),
+        "cascade": bench_cascade(args.iterations, web_search, args),
+        "prompt_cache": bench_prompt_cache(args.iterations, args.prompt_token_latency, args.cached_token_cost),
+        "compression": bench_compression(args.synthetic_chunks),
+        "sharding": bench_sharding(
+            [int(count) for count in args.shard_counts.split(",")], args.synthetic_chunks, max(args.iterations, 50)
+        ),
+    }
+    if not args.skip_api:
+        results["api"] = bench_api(args.requests, args.concurrency, web_search)
+
+    fakes["server"].shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Benchmark results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Startup import-time budget check.
+
+Imports each entry point in a fresh interpreter with `python -X importtime`
+and fails (exit code 1) if an import takes longer than its budget, or if a
+dependency that should load lazily (voice, web scraping, ingestion) was
+imported at startup.
+
+Usage:
+    python check_import_time.py
+    python check_import_time.py --module api --budget-ms 2500
+"""
+from typing import List, Tuple
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+
+# Cumulative import time allowed for each entry point, in milliseconds
+DEFAULT_BUDGETS_MS = {
+    "api": 3000,
+    "main": 2500,
+}
+
+# Modules that must only load when a request first needs them
+DEFERRED_MODULES = (
+    # Voice
+    "speech_recognition",
+    "pyttsx3",
+    "pydub",
+    "voice",
+    "voice_session",
+    "transcription",
+    # Web search and scraping
+    "bs4",
+    "web_retriever",
+    "langchain_community.tools.tavily_search",
+    # Ingestion
+    "document_loader",
+    "initialize_assistant",
+    "langchain_community.document_loaders",
+)
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure(module: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        (name, depth, self_us, cumulative_us) for every module imported.
+    """
+    # api refuses to import without an API key; no request is made, so any value will do
+    env = {"GEMINI_API_KEY": "import-time-check", **os.environ}
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=False,
+    )
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {module} failed:\n" + "\n".join(errors[-20:]))
+
+    imports = []
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def check(module: str, budget_ms: float, repeat: int) -> bool:
+    """
+    Check one entry point against its budget and the deferred-module list.
+
+    Returns:
+        True if the check passed.
+    """
+    # The fastest run is the least noisy (and the first also compiles bytecode)
+    def total_ms(imports) -> float:
+        return next((cumulative for name, depth, _, cumulative in imports if name == module and depth == 0), 0) / 1000
+
+    imports = min((measure(module) for _ in range(repeat)), key=total_ms)
+    best_ms = total_ms(imports)
+
+    # Children are reported just before their parent: find the module's subtree
+    end = next((i for i, (name, depth, _, _) in enumerate(imports) if name == module and depth == 0), 0)
+    start = end
+    while start > 0 and imports[start - 1][1] > 0:
+        start -= 1
+    loaded = {name for name, _, _, _ in imports[start:end]}
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+
+    print(f"{module}: {best_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+    direct = [entry for entry in imports[start:end] if entry[1] == 1]
+    heaviest = sorted(direct, key=lambda entry: entry[3], reverse=True)[:10]
+    for name, _, _, cumulative in heaviest:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    passed = True
+    if best_ms > budget_ms:
+        print(f"FAIL: importing {module} took {best_ms:.0f} ms, over its {budget_ms:.0f} ms budget")
+        passed = False
+    if eager:
+        print(f"FAIL: {module} imports modules that should load lazily: {', '.join(eager)}")
+        passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that startup imports stay within budget")
+    parser.add_argument("--module", dest="modules", action="append", help="Entry point to check (default: api and main)")
+    parser.add_argument("--budget-ms", dest="budget_ms", type=float, help="Override the budget for every module")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module; the fastest is used")
+    args = parser.parse_args()
+
+    modules = args.modules or list(DEFAULT_BUDGETS_MS)
+    passed = True
+    for module in modules:
+        budget_ms = args.budget_ms or DEFAULT_BUDGETS_MS.get(module, 3000)
+        passed = check(module, budget_ms, args.repeat) and passed
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,12 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Vector store settings
 VECTOR_STORE_PATH = "vector_store"
+VECTOR_STORE_SHARDS = int(os.getenv("VECTOR_STORE_SHARDS", "1"))  # Index shards for a new index; an existing index keeps its own count
+VECTOR_STORE_SHARD_BY = os.getenv("VECTOR_STORE_SHARD_BY", "hash").lower()  # "hash" (of the chunk) or "source" (file, kept together)
+VECTOR_SEARCH_WORKERS = int(os.getenv("VECTOR_SEARCH_WORKERS", "8"))  # Threads searching and building shards in parallel
+VECTOR_INDEX_COMPRESSION = os.getenv("VECTOR_INDEX_COMPRESSION", "none").lower()  # "none", "float16", "int8" or "pq", for a new index
+VECTOR_RESCORE_FACTOR = 4  # Compressed indexes fetch this many candidates per result, then re-score them exactly
+VECTOR_PQ_SUBQUANTIZERS = 96  # Bytes per vector with product quantization (768-d embeddings: 32x smaller)
 
 # Embedding settings
 EMBEDDING_MODEL = "models/embedding-001"  # Gemini embedding model
@@ -25,3 +31,111 @@ TOP_K_RESULTS = 100  # Number of results to retrieve from vector store
 
 # Web retrieval settings
 MAX_SEARCH_RESULTS = 5  # Number of search results to process
+SOURCE_REGISTRY_PATH = os.getenv("SOURCE_REGISTRY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sources.json"))  # Subjects and URLs served from local documents
+
+# Telemetry settings
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"  # Record spans and /metrics
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")  # Append finished spans as JSON lines to this file
+OTEL_EXPORTER_ENDPOINT = os.getenv("OTEL_EXPORTER_ENDPOINT")  # OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces
+
+# Logging settings
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" or "text"
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))  # Fraction of DEBUG records kept
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records beyond this are dropped, never blocked on
+
+# Batch settings
+BATCH_MAX_QUESTIONS = 500  # Maximum questions accepted in one batch
+BATCH_MAX_CONCURRENCY = 4  # Concurrent LLM calls while processing a batch
+BATCH_QUERY_SIMILARITY = 0.95  # Cosine similarity above which queries share retrieval
+
+# Text-to-speech settings
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))  # Worker processes, each with its own long-lived engine
+TTS_MAX_PENDING = int(os.getenv("TTS_MAX_PENDING", "16"))  # Queued + running syntheses before rejecting
+TTS_TIMEOUT = 30  # Seconds to wait for one synthesis
+TTS_VOICE_PREFERENCE = "female"  # Substring of the preferred voice name
+TTS_RATE = 150  # Speed of speech
+TTS_VOLUME = 0.9  # Volume (0.0 to 1.0)
+TTS_AUDIO_FORMAT = "wav"  # The pyttsx3 drivers write WAV; responses are served as one WAV stream
+
+# Audio cache settings
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MEMORY_BYTES = 32 * 1024 * 1024  # In-memory LRU tier
+AUDIO_CACHE_DISK_BYTES = int(os.getenv("AUDIO_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))  # On-disk tier
+
+# Speech-to-text settings
+STT_MAX_UPLOAD_BYTES = int(os.getenv("STT_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+STT_MAX_DURATION_SECONDS = int(os.getenv("STT_MAX_DURATION_SECONDS", "120"))
+STT_MAX_SAMPLE_RATE = 16000  # Audio above this rate is downsampled before recognition
+STT_WORKERS = int(os.getenv("STT_WORKERS", "4"))  # Threads decoding and transcribing uploads
+STT_BACKEND = os.getenv("STT_BACKEND", "google")  # "google" (remote), "vosk" or "whisper" (local CPU)
+STT_WHISPER_MODEL = os.getenv("STT_WHISPER_MODEL", "base")
+STT_SEGMENT_SECONDS = 15  # Longer audio is split on silence into segments of about this length
+STT_MIN_SILENCE_MS = 300  # Shortest pause treated as a segment boundary
+STT_PROCESS_WORKERS = int(os.getenv("STT_PROCESS_WORKERS", str(os.cpu_count() or 2)))  # Processes for local backends
+STT_ENDPOINT_SILENCE_MS = 800  # Trailing pause that ends an utterance on the voice WebSocket
+
+# Production server settings
+SERVER_HOST = os.getenv("HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))  # Forked worker processes
+SERVER_KEEP_ALIVE = int(os.getenv("SERVER_KEEP_ALIVE", "75"))  # Seconds; longer than a typical load balancer idle timeout
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))  # Seconds to finish in-flight requests on shutdown
+SERVER_BACKLOG = 2048
+
+# Warm-up settings
+WARMUP_LOCK_PATH = os.getenv("WARMUP_LOCK_PATH", "vector_store.lock")  # Serializes index builds across processes
+WARMUP_RETRY_AFTER = 5  # Seconds clients are told to wait while the assistant warms up
+
+# Admission control settings (per worker process)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))  # Questions processed at once
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))  # Questions waiting for a slot
+ADMISSION_LATENCY_SLO = float(os.getenv("ADMISSION_LATENCY_SLO", "20"))  # Seconds; shed load rather than exceed it
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))  # Sustained questions per client
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))  # Questions a client may send at once
+
+# Query routing settings
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"  # Skip the rewrite and web search when local features allow
+ROUTER_MAX_QUERY_WORDS = 20  # Longer questions are always rewritten into a search query
+ROUTER_MIN_COVERAGE = 0.5  # Fraction of a question's keywords found in the index for it to be used as the query
+ROUTER_MIN_RELEVANCE = 0.75  # Top vector store relevance above which in-domain questions skip web search
+
+# Prompt caching settings
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"  # Gemini context caching of the static prompt prefix
+PROMPT_CACHE_TTL = 3600  # Seconds the provider keeps the cached prefix
+PROMPT_CACHE_MIN_TOKENS = 32768  # Gemini's minimum cacheable size; smaller prefixes are sent with every request
+
+# Model cascade settings
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gemini-1.5-flash")  # Query rewrites and confident, well-grounded answers
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gemini-1.5-pro")  # Answers with weak retrieval or an unsure fast tier
+LLM_CASCADE_ENABLED = os.getenv("LLM_CASCADE_ENABLED", "true").lower() == "true"  # When false, the fast model handles every call
+LLM_ESCALATE_RELEVANCE = float(os.getenv("LLM_ESCALATE_RELEVANCE", "0.6"))  # Top relevance below which answers use the strong model
+LLM_TIER_PRICES = {  # USD per million input and output tokens, for the cost estimate
+    "fast": (0.075, 0.30),
+    "strong": (1.25, 5.00),
+}
+
+# Upstream call resilience settings
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "15"))  # Seconds to answer one question, split across the graph stages
+LLM_MAX_ATTEMPTS = 3  # Attempts per LLM call on transient errors, including the first
+LLM_RETRY_BASE_DELAY = 0.25  # Seconds; doubles per retry, with full jitter
+LLM_RETRY_MAX_DELAY = 4.0
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"  # Duplicate calls still running after the p95 latency
+LLM_HEDGE_MIN_SAMPLES = 20  # Calls observed before hedging starts
+LLM_CALL_WORKERS = int(os.getenv("LLM_CALL_WORKERS", "32"))  # Threads running upstream calls, including hedges
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures that open a circuit breaker
+CIRCUIT_RESET_TIMEOUT = 30  # Seconds a circuit stays open before a probe call
+
+# Conversation session settings
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.db")  # SQLite file shared by all worker processes
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))  # Seconds of inactivity after which a session is forgotten
+SESSION_MAX_TURNS = 6  # Recent turns kept verbatim; older ones are folded into a short summary
+SESSION_SUMMARY_TOKENS = 300  # Size of that summary; its oldest lines are dropped beyond this
+SESSION_HISTORY_TOKENS = 800  # History included in a prompt, latest and most relevant turns first
+SESSION_TOPIC_OVERLAP = 0.5  # Share of a question's keywords from the previous turn for it to reuse that turn's context
+SESSION_MAX_WEB_CHUNKS = 20  # Web chunks kept for reuse (indexed chunks are kept by key)
+
+# Persona settings
+PERSONAS_DIR = os.getenv("PERSONAS_DIR", "personas")  # One subdirectory per additional persona
+PERSONA_INDEX_MEMORY_BYTES = int(os.getenv("PERSONA_INDEX_MEMORY_BYTES", str(512 * 1024 * 1024)))  # Loaded persona indexes; least recently used are unloaded beyond this
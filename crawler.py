@@ -0,0 +1,322 @@
+"""
+Concurrent, polite crawler for refreshing the documents in the data directory.
+"""
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+from fetch_web_data import html_to_text, data_dir, DEFAULT_HEADERS
+
+
+# Name of the manifest that remembers validators and content hashes per URL
+MANIFEST_FILENAME = ".crawl_manifest.json"
+
+SITEMAP_NAMESPACE = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+@dataclass
+class CrawlResult:
+    """
+    Outcome of fetching a single URL.
+    """
+    url: str
+    status: str  # "changed", "unchanged" or "failed"
+    file_path: Optional[str] = None
+    bytes_fetched: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class CrawlStats:
+    """
+    Aggregate statistics for a crawl run.
+    """
+    results: List[CrawlResult] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def pages(self) -> int:
+        return len(self.results)
+
+    @property
+    def bytes_fetched(self) -> int:
+        return sum(result.bytes_fetched for result in self.results)
+
+    @property
+    def changed_files(self) -> List[str]:
+        return [result.file_path for result in self.results if result.status == "changed"]
+
+    def count(self, status: str) -> int:
+        return sum(1 for result in self.results if result.status == status)
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class DomainThrottle:
+    """
+    Per-domain politeness limits: a cap on concurrent requests and a minimum
+    delay between the start of consecutive requests to the same host.
+    """
+
+    def __init__(self, max_per_domain: int = 2, min_delay: float = 1.0):
+        self.max_per_domain = max_per_domain
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+        self._next_slot: Dict[str, float] = {}
+
+    def _semaphore(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.Semaphore(self.max_per_domain)
+            return self._semaphores[host]
+
+    def acquire(self, host: str) -> None:
+        """
+        Block until a request to the host is allowed.
+        """
+        self._semaphore(host).acquire()
+
+        # Reserve the next start slot for this host, then sleep outside the lock
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = start + self.min_delay
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, host: str) -> None:
+        self._semaphore(host).release()
+
+
+def filename_for_url(url: str) -> str:
+    """
+    Build a stable, filesystem-safe filename for a URL.
+    """
+    parsed = urlparse(url)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{parsed.netloc}{parsed.path}").strip("_")[:80]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    return f"{slug or 'page'}_{digest}.txt"
+
+
+def write_file_atomically(path: str, text: str) -> None:
+    """
+    Write text through a temporary file, so readers never see a partial file.
+    The temporary file is removed if the write fails.
+    """
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_url_list(path: str) -> List[str]:
+    """
+    Read URLs from a text file, one per line. Blank lines and '#' comments are ignored.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+def read_sitemap(location: str, session: Optional[requests.Session] = None) -> List[str]:
+    """
+    Read page URLs from a sitemap URL or local sitemap file. Sitemap indexes are
+    followed recursively.
+    """
+    if os.path.exists(location):
+        with open(location, "rb") as f:
+            content = f.read()
+    else:
+        session = session or requests.Session()
+        response = session.get(location, headers=DEFAULT_HEADERS, timeout=10)
+        response.raise_for_status()
+        content = response.content
+
+    root = ET.fromstring(content)
+    locations = [loc.text.strip() for loc in root.iter(f"{SITEMAP_NAMESPACE}loc") if loc.text]
+
+    if root.tag == f"{SITEMAP_NAMESPACE}sitemapindex":
+        urls = []
+        for sitemap in locations:
+            urls.extend(read_sitemap(sitemap, session))
+        return urls
+
+    return locations
+
+
+class Crawler:
+    """
+    Fetch many pages concurrently, skipping pages that have not changed since
+    the previous crawl and writing only changed documents to the data directory.
+    """
+
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        max_workers: int = 16,
+        max_per_domain: int = 2,
+        min_delay: float = 1.0,
+        timeout: float = 10.0,
+    ):
+        """
+        Initialize the crawler.
+
+        Args:
+            output_dir: Directory to write documents to. If None, uses the data directory.
+            max_workers: Total number of concurrent fetches.
+            max_per_domain: Maximum concurrent fetches per host.
+            min_delay: Minimum delay in seconds between requests to the same host.
+            timeout: Request timeout in seconds.
+        """
+        self.output_dir = output_dir or data_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.throttle = DomainThrottle(max_per_domain=max_per_domain, min_delay=min_delay)
+
+        self.manifest_path = os.path.join(self.output_dir, MANIFEST_FILENAME)
+        self.manifest = self._load_manifest()
+        self._manifest_lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable crawl manifest {self.manifest_path}: {e}")
+        return {}
+
+    def _save_manifest(self) -> None:
+        write_file_atomically(self.manifest_path, json.dumps(self.manifest, indent=2, sort_keys=True))
+
+    def _session(self) -> requests.Session:
+        # requests.Session is not thread-safe, so keep one per worker thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            self._local.session = session
+        return session
+
+    def fetch(self, url: str) -> CrawlResult:
+        """
+        Fetch a single URL with a conditional GET and write it if it changed.
+
+        Args:
+            url: The URL to fetch.
+
+        Returns:
+            The crawl result.
+        """
+        with self._manifest_lock:
+            entry = dict(self.manifest.get(url, {}))
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        host = urlparse(url).netloc
+        self.throttle.acquire(host)
+        try:
+            response = self._session().get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return CrawlResult(url=url, status="failed", error=str(e))
+        finally:
+            self.throttle.release(host)
+
+        bytes_fetched = len(response.content)
+        file_path = os.path.join(self.output_dir, entry.get("filename") or filename_for_url(url))
+
+        if response.status_code == 304:
+            return CrawlResult(url=url, status="unchanged", file_path=file_path, bytes_fetched=bytes_fetched)
+
+        if not response.ok:
+            return CrawlResult(url=url, status="failed", bytes_fetched=bytes_fetched,
+                               error=f"HTTP {response.status_code}")
+
+        # A page that cannot be converted or written fails on its own, without aborting the crawl
+        try:
+            text = html_to_text(response.text)
+            content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+            # Servers without validators still send a full body; skip the write if the text is identical
+            status = "unchanged"
+            if content_hash != entry.get("sha256") or not os.path.exists(file_path):
+                write_file_atomically(file_path, text)
+                status = "changed"
+        except Exception as e:
+            return CrawlResult(url=url, status="failed", bytes_fetched=bytes_fetched,
+                               error=f"{type(e).__name__}: {e}")
+
+        with self._manifest_lock:
+            self.manifest[url] = {
+                "filename": os.path.basename(file_path),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": content_hash,
+                "fetched_at": time.time(),
+            }
+
+        return CrawlResult(url=url, status=status, file_path=file_path, bytes_fetched=bytes_fetched)
+
+    def crawl(self, urls: List[str]) -> CrawlStats:
+        """
+        Fetch all URLs concurrently.
+
+        Args:
+            urls: The URLs to fetch. Duplicates are fetched once.
+
+        Returns:
+            Statistics for the run.
+        """
+        stats = CrawlStats()
+        unique_urls = list(dict.fromkeys(urls))
+        start = time.monotonic()
+
+        # The manifest is saved even if the run is interrupted, keeping the validators already fetched
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self.fetch, url): url for url in unique_urls}
+                for future in as_completed(futures):
+                    result = future.result()
+                    stats.results.append(result)
+                    if result.status == "failed":
+                        print(f"Failed {result.url}: {result.error}")
+        finally:
+            stats.elapsed = time.monotonic() - start
+            self._save_manifest()
+        return stats
+
+
+def print_crawl_stats(stats: CrawlStats) -> None:
+    """
+    Print a summary of a crawl run.
+    """
+    print(f"Crawled {stats.pages} pages in {stats.elapsed:.2f}s "
+          f"({stats.pages_per_second:.2f} pages/sec, {stats.bytes_fetched} bytes fetched)")
+    print(f"  changed: {stats.count('changed')}, unchanged: {stats.count('unchanged')}, "
+          f"failed: {stats.count('failed')}")
+    for file_path in stats.changed_files:
+        print(f"  - {file_path}")
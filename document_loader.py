@@ -14,6 +14,7 @@ from langchain_community.document_loaders import (
 )
 
 from config import CHUNK_SIZE, CHUNK_OVERLAP
+from metadata_index import assign_sections
 
 
 def load_document(file_path: str) -> List:
@@ -47,13 +48,21 @@ def load_document(file_path: str) -> List:
     # Load the document
     documents = loader.load()
 
-    # Split the document into chunks
+    # Split the document into chunks, keeping where each starts
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True,
     )
 
-    return text_splitter.split_documents(documents)
+    # Each chunk belongs to the section its start falls in, which may continue from an earlier page
+    chunks = []
+    section = ""
+    for document in documents:
+        document_chunks = text_splitter.split_documents([document])
+        section = assign_sections(document_chunks, document.page_content, section)
+        chunks.extend(document_chunks)
+    return chunks
 
 
 def load_documents_from_directory(directory_path: str, file_extensions: Optional[List[str]] = None) -> List:
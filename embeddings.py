@@ -1,14 +1,17 @@
 """
 Embedding models for vectorizing text.
 """
+import functools
+
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
 from config import GEMINI_API_KEY, EMBEDDING_MODEL
 
 
+@functools.lru_cache(maxsize=None)
 def get_embedding_model():
     """
-    Get the embedding model.
+    Get the embedding model, shared by every index in the process.
     
     Returns:
         The embedding model.
@@ -20,9 +23,10 @@ def get_embedding_model():
     )
 
 
+@functools.lru_cache(maxsize=None)
 def get_document_embedding_model():
     """
-    Get the embedding model for documents.
+    Get the embedding model for documents, shared by every index in the process.
     
     Returns:
         The embedding model for documents.
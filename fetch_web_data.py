@@ -2,6 +2,7 @@
 Script to fetch data from specific websites and save it as documents.
 """
 import os
+import argparse
 import requests
 from bs4 import BeautifulSoup
 import time
@@ -14,6 +15,41 @@ load_dotenv()
 data_dir = os.path.join(os.path.dirname(__file__), "data")
 os.makedirs(data_dir, exist_ok=True)
 
+# Add a user agent to avoid being blocked
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+def html_to_text(html_content):
+    """
+    Extract readable text from HTML content.
+
+    Args:
+        html_content: The HTML content.
+
+    Returns:
+        Extracted text.
+    """
+    # Parse the HTML content
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.extract()
+
+    # Get text
+    text = soup.get_text()
+
+    # Break into lines and remove leading and trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+
+    # Break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+
+    # Drop blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
 
 def fetch_and_save_website(url, filename):
     """
@@ -26,33 +62,11 @@ def fetch_and_save_website(url, filename):
     try:
         print(f"Fetching data from {url}...")
         
-        # Add a user agent to avoid being blocked
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        
         # Fetch the website
-        response = requests.get(url, headers=headers, timeout=10)
+        response = requests.get(url, headers=DEFAULT_HEADERS, timeout=10)
         response.raise_for_status()  # Raise an exception for HTTP errors
         
-        # Parse the HTML content
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.extract()
-        
-        # Get text
-        text = soup.get_text()
-        
-        # Break into lines and remove leading and trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        
-        # Drop blank lines
-        text = '\n'.join(chunk for chunk in chunks if chunk)
+        text = html_to_text(response.text)
         
         # Save the content to a file
         file_path = os.path.join(data_dir, filename)
@@ -148,9 +162,9 @@ For professional inquiries, Badar can be reached through Lunar AI Studio's offic
     return True
 
 
-def main():
+def fetch_default_websites():
     """
-    Main function to fetch data from websites and create random document.
+    Fetch data from the default websites and create the random document.
     """
     # Websites to fetch
     websites = [
@@ -171,5 +185,61 @@ def main():
     print("Data fetching and document creation completed.")
 
 
+def crawl(args):
+    """
+    Crawl a URL list and/or sitemap concurrently, writing only changed pages.
+
+    Args:
+        args: Parsed command line arguments.
+    """
+    from crawler import Crawler, read_url_list, read_sitemap, print_crawl_stats
+
+    urls = []
+    if args.urls:
+        urls.extend(read_url_list(args.urls))
+    if args.sitemap:
+        urls.extend(read_sitemap(args.sitemap))
+
+    if not urls:
+        print("No URLs to crawl.")
+        return
+
+    crawler = Crawler(
+        output_dir=args.output_dir,
+        max_workers=args.workers,
+        max_per_domain=args.per_domain,
+        min_delay=args.delay,
+    )
+    stats = crawler.crawl(urls)
+    print_crawl_stats(stats)
+
+    # Hand the delta to the indexer, e.g. `python main.py --add-file ...` per line
+    if args.changed_list:
+        with open(args.changed_list, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(stats.changed_files))
+        print(f"Wrote {len(stats.changed_files)} changed files to {args.changed_list}")
+
+
+def main():
+    """
+    Main function to fetch data from websites and create random document.
+    """
+    parser = argparse.ArgumentParser(description="Fetch source pages into the data directory")
+    parser.add_argument("--urls", help="File with one URL per line to crawl")
+    parser.add_argument("--sitemap", help="Sitemap URL or file to crawl")
+    parser.add_argument("--output-dir", dest="output_dir", default=data_dir, help="Directory to write documents to")
+    parser.add_argument("--workers", type=int, default=16, help="Total number of concurrent fetches")
+    parser.add_argument("--per-domain", dest="per_domain", type=int, default=2, help="Maximum concurrent fetches per domain")
+    parser.add_argument("--delay", type=float, default=1.0, help="Minimum seconds between requests to the same domain")
+    parser.add_argument("--changed-list", dest="changed_list", help="Write the paths of changed documents to this file")
+
+    args = parser.parse_args()
+
+    if args.urls or args.sitemap:
+        crawl(args)
+    else:
+        fetch_default_websites()
+
+
 if __name__ == "__main__":
     main()
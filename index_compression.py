@@ -0,0 +1,234 @@
+"""
+Compressed storage for the vector index.
+
+The flat index keeps every embedding as float32. In a compressed mode the
+searchable index holds smaller codes instead: float16 (half the size), int8
+scalar quantization (a quarter) or product quantization (one byte per
+PQ subvector, typically 1/32). The full-precision vectors are kept next to
+it in a raw float32 file, which is memory-mapped rather than loaded: a
+query searches the compressed index for a few times more candidates than
+it needs, then re-scores just those candidates exactly, so only their rows
+of the file are ever read.
+
+The mode is chosen when an index is built (VECTOR_INDEX_COMPRESSION) and
+recorded in compression.json next to it.
+"""
+from typing import Dict, List, Sequence, Tuple
+import json
+import os
+import random
+import time
+
+import numpy as np
+import faiss
+
+from config import VECTOR_PQ_SUBQUANTIZERS, VECTOR_RESCORE_FACTOR
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+COMPRESSION_MODES = ("none", "float16", "int8", "pq")
+SETTINGS_FILE = "compression.json"
+VECTORS_FILE = "vectors.f32"
+
+# Product quantization trains 256 centroids per subquantizer, and FAISS wants 39 training vectors per centroid;
+# with fewer vectors int8 is used instead
+PQ_MIN_TRAINING_VECTORS = 39 * 256
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    # The dimension must split evenly into subvectors
+    return max(m for m in range(1, min(VECTOR_PQ_SUBQUANTIZERS, dimension) + 1) if dimension % m == 0)
+
+
+def build_index(vectors: np.ndarray, mode: str) -> Tuple[faiss.Index, str]:
+    """
+    Build a compressed L2 index over vectors.
+
+    Returns:
+        The index, and the mode actually used (pq falls back to int8 on small corpora).
+    """
+    count, dimension = vectors.shape
+    if mode == "pq" and count < PQ_MIN_TRAINING_VECTORS:
+        logger.warning("Too few vectors to train product quantization; using int8", extra={"fields": {"vectors": count}})
+        mode = "int8"
+    if mode == "float16":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif mode == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif mode == "pq":
+        index = faiss.IndexPQ(dimension, _pq_subquantizers(dimension), 8, faiss.METRIC_L2)
+    else:
+        raise ValueError(f"Unknown compression mode {mode!r}; expected one of {COMPRESSION_MODES}")
+    index.train(vectors)
+    index.add(vectors)
+    return index, mode
+
+
+def index_bytes(index: faiss.Index) -> int:
+    """
+    Memory held by an index's vector codes.
+    """
+    return index.ntotal * getattr(index, "code_size", index.d * 4)
+
+
+def read_mode(persist_directory: str) -> str:
+    """
+    The compression mode an index on disk was built with.
+    """
+    try:
+        with open(os.path.join(persist_directory, SETTINGS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["mode"]
+    except FileNotFoundError:
+        return "none"
+
+
+def write_mode(persist_directory: str, mode: str) -> None:
+    """
+    Record the compression mode of an index.
+    """
+    with open(os.path.join(persist_directory, SETTINGS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"mode": mode}, f)
+
+
+class ExactVectors:
+    """
+    Full-precision vectors in a memory-mapped float32 file, in index order.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        """
+        Open the file. Rows are paged in from disk only when read.
+
+        Args:
+            path: The raw float32 file.
+            dimension: Length of each vector.
+        """
+        self.path = path
+        self.dimension = dimension
+        self._open()
+
+    def _open(self) -> None:
+        rows = os.path.getsize(self.path) // (4 * self.dimension) if os.path.exists(self.path) else 0
+        self._rows = np.memmap(self.path, dtype=np.float32, mode="r", shape=(rows, self.dimension)) if rows else None
+
+    def __len__(self) -> int:
+        return 0 if self._rows is None else self._rows.shape[0]
+
+    @classmethod
+    def write(cls, path: str, vectors: np.ndarray) -> "ExactVectors":
+        """
+        Replace the file with vectors.
+        """
+        np.ascontiguousarray(vectors, dtype=np.float32).tofile(path)
+        return cls(path, vectors.shape[1])
+
+    def append(self, vectors: np.ndarray) -> None:
+        """
+        Append vectors, which must follow the existing ones in index order.
+        """
+        with open(self.path, "ab") as f:
+            np.ascontiguousarray(vectors, dtype=np.float32).tofile(f)
+        self._open()
+
+    def get(self, ids: Sequence[int]) -> np.ndarray:
+        """
+        The vectors with the given positions.
+        """
+        if self._rows is None:
+            raise ValueError(f"No full-precision vectors in {self.path}")
+        return np.asarray(self._rows[np.asarray(ids, dtype=np.int64)])
+
+    def all(self) -> np.ndarray:
+        """
+        Every vector, read into memory.
+        """
+        return np.array(self._rows) if self._rows is not None else np.zeros((0, self.dimension), dtype=np.float32)
+
+
+class _InMemoryVectors(ExactVectors):
+    # ExactVectors over an array already in memory, for the report
+    def __init__(self, vectors: np.ndarray):
+        self.path = None
+        self.dimension = vectors.shape[1]
+        self._rows = vectors
+
+
+def rescore(query: np.ndarray, ids: Sequence[int], exact: ExactVectors, k: int) -> List[Tuple[int, float]]:
+    """
+    Re-rank candidates by exact squared L2 distance, the metric of the flat index.
+
+    Returns:
+        Up to k (position, distance) pairs, nearest first.
+    """
+    ids = [i for i in ids if i >= 0]
+    if not ids:
+        return []
+    distances = ((exact.get(ids) - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return [(ids[i], float(distances[i])) for i in order]
+
+
+def compression_report(
+    vectors: np.ndarray,
+    modes: Sequence[str] = ("float16", "int8", "pq"),
+    k: int = 10,
+    queries: int = 200,
+    rescore_factor: int = VECTOR_RESCORE_FACTOR,
+    seed: int = 7,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Measure memory saved and recall@k of each compression mode against exact search.
+
+    Queries are a sample of the indexed vectors; each query's own vector is
+    left out of both its exact and approximate results.
+
+    Args:
+        vectors: The full-precision vectors of an index.
+        modes: The modes to compare.
+        k: Results per query.
+        queries: Number of sampled queries.
+        rescore_factor: Candidates fetched per result before exact re-scoring.
+        seed: Seed of the query sample.
+
+    Returns:
+        Per mode: bytes, share of memory saved, build time, and recall@k with and without re-scoring.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    sample = random.Random(seed).sample(range(count), min(queries, count))
+    query_vectors = vectors[sample]
+
+    exact_index = faiss.IndexFlatL2(dimension)
+    exact_index.add(vectors)
+    _, truth = exact_index.search(query_vectors, k + 1)
+    truth_sets = [set([i for i in row if i != own][:k]) for row, own in zip(truth.tolist(), sample)]
+
+    flat_bytes = index_bytes(exact_index)
+    report: Dict[str, Dict[str, float]] = {"none": {"bytes": flat_bytes, "saved": 0.0, "recall": 1.0, "recall_rescored": 1.0}}
+
+    exact = _InMemoryVectors(vectors)
+    for mode in modes:
+        start = time.perf_counter()
+        index, used = build_index(vectors, mode)
+        build_seconds = time.perf_counter() - start
+
+        _, approximate = index.search(query_vectors, k + 1)
+        _, candidates = index.search(query_vectors, (k + 1) * rescore_factor)
+        recall = rescored_recall = 0.0
+        for q, (row, wide, own, expected) in enumerate(zip(approximate.tolist(), candidates.tolist(), sample, truth_sets)):
+            found = [i for i in row if i != own][:k]
+            rescored = [i for i, _ in rescore(query_vectors[q], wide, exact, k + 1) if i != own][:k]
+            recall += len(expected & set(found)) / max(1, len(expected))
+            rescored_recall += len(expected & set(rescored)) / max(1, len(expected))
+
+        report[mode] = {
+            "mode_used": used,
+            "bytes": index_bytes(index),
+            "saved": round(1 - index_bytes(index) / flat_bytes, 4),
+            "build_seconds": round(build_seconds, 3),
+            "recall": round(recall / len(sample), 4),
+            "recall_rescored": round(rescored_recall / len(sample), 4),
+        }
+    return report
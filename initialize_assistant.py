@@ -1,18 +1,23 @@
 """
 Initialize Badar Abbas's personal assistant.
 """
+from typing import Optional
 import os
 import sys
 import glob
 
 from document_loader import load_document, load_documents_from_directory
-from vector_store import VectorStore
+from vector_store import open_vector_store
 from config import GEMINI_API_KEY
 
 
-def initialize_assistant():
+def initialize_assistant(data_dir: Optional[str] = None, persist_directory: Optional[str] = None):
     """
     Initialize the assistant by loading personal information into the vector store.
+
+    Args:
+        data_dir: Directory of documents to index. If None, uses the bundled data directory.
+        persist_directory: Directory of the index. If None, uses the default.
     """
     # Check if API key is set
     if not GEMINI_API_KEY:
@@ -21,16 +26,18 @@ def initialize_assistant():
         return False
 
     # Create data directory if it doesn't exist
-    data_dir = os.path.join(os.path.dirname(__file__), "data")
+    data_dir = data_dir or os.path.join(os.path.dirname(__file__), "data")
     os.makedirs(data_dir, exist_ok=True)
 
     try:
         # Initialize the vector store
-        vector_store = VectorStore()
+        vector_store = open_vector_store(persist_directory=persist_directory)
 
         # Clear existing vector store to ensure fresh data
         print("Clearing existing vector store...")
         vector_store.clear_vector_store()
+        # Reopened, so a rebuilt index takes the configured shard layout
+        vector_store = open_vector_store(persist_directory=persist_directory)
 
         # Load all documents from the data directory
         print("Loading documents from data directory...")
@@ -52,7 +59,7 @@ def initialize_assistant():
             print(f"  - {os.path.basename(file_path)}")
 
         # Verify that the vector store was created successfully
-        new_vector_store = VectorStore()
+        new_vector_store = open_vector_store(persist_directory=persist_directory)
         if new_vector_store.vector_store is None:
             print("Error: Vector store was not created successfully.")
             return False
@@ -1,10 +1,54 @@
 """
 Gemini LLM API integration.
+
+Calls go through a cascade of model tiers: a fast, cheap tier rewrites
+queries and answers simple questions that are well grounded in the
+retrieved context, and a stronger tier is used only when retrieval is weak
+or the fast tier says it is unsure.
 """
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from contextlib import contextmanager
+import re
+import threading
+import time
+
 from langchain_google_genai import ChatGoogleGenerativeAI
 import google.generativeai as genai
 
-from config import GEMINI_API_KEY
+from config import (
+    GEMINI_API_KEY,
+    LLM_FAST_MODEL,
+    LLM_STRONG_MODEL,
+    LLM_CASCADE_ENABLED,
+    LLM_ESCALATE_RELEVANCE,
+    LLM_TIER_PRICES,
+)
+from resilience import DeadlineExceeded, should_fall_back
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+tier_calls = registry.counter("llm_tier_calls_total", "LLM calls per model tier", labels=("tier", "purpose"))
+tier_latency = registry.histogram("llm_tier_latency_seconds", "LLM call latency per model tier", labels=("tier", "purpose"))
+tier_cost = registry.counter("llm_tier_cost_usd_total", "Estimated LLM spend per model tier", labels=("tier",))
+escalations = registry.counter("llm_escalations_total", "Answers escalated to a stronger tier", labels=("reason",))
+fallbacks = registry.counter("llm_fallbacks_total", "Answers served by another tier after a failure", labels=("failed_tier",))
+
+# Tiers from cheapest to strongest
+FAST_TIER = "fast"
+STRONG_TIER = "strong"
+
+# Phrases with which a model acknowledges it cannot answer (guideline 7 of the RAG prompt asks for this)
+UNCERTAINTY_PATTERN = re.compile(
+    r"\b(i'?m not sure|i am not sure|i'?m not certain|i don'?t know|i do not know|"
+    r"(don'?t|do not) have (enough|sufficient|any|specific) information|"
+    r"(not|no) (enough|sufficient) (information|context)|"
+    r"(context|information) (provided )?(does not|doesn'?t) (contain|mention|include|say)|"
+    r"unable to (find|determine|answer)|cannot (find|determine|answer))\b",
+    re.IGNORECASE,
+)
 
 
 def initialize_gemini():
@@ -14,7 +58,7 @@ def initialize_gemini():
     genai.configure(api_key=GEMINI_API_KEY)
 
 
-def get_llm(model_name: str = "gemini-1.5-flash", temperature: float = 0.2):
+def get_llm(model_name: str = LLM_FAST_MODEL, temperature: float = 0.2):
     """
     Get the LLM model.
 
@@ -34,4 +78,171 @@ def get_llm(model_name: str = "gemini-1.5-flash", temperature: float = 0.2):
         temperature=temperature,
         google_api_key=GEMINI_API_KEY,
         convert_system_message_to_human=True,
+        max_retries=1,  # Retries are made by resilience.ResilientCaller, within the request deadline
     )
+
+
+def is_uncertain(answer: str) -> bool:
+    """
+    Whether an answer admits that the model does not know.
+    """
+    return bool(UNCERTAINTY_PATTERN.search(answer))
+
+
+def estimate_cost(tier: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimate the cost of one call in USD from the tier's per-million-token prices.
+    """
+    input_price, output_price = LLM_TIER_PRICES.get(tier, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelCascade:
+    """
+    LLMs ordered from cheapest to strongest, with the policy for choosing between them.
+    """
+
+    def __init__(self, tiers: Dict[str, object], escalate_relevance: float = LLM_ESCALATE_RELEVANCE):
+        """
+        Initialize the cascade.
+
+        Args:
+            tiers: LLMs keyed by tier name, cheapest first.
+            escalate_relevance: Top retrieval relevance below which answers go straight to the strongest tier.
+        """
+        self.tiers = tiers
+        self.order = list(tiers)
+        self.escalate_relevance = escalate_relevance
+        # Estimated spend of this cascade per tier, in USD
+        self.spend: Dict[str, float] = {tier: 0.0 for tier in tiers}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "ModelCascade":
+        """
+        Build the configured cascade, or a single fast tier when the cascade is disabled.
+        """
+        if not LLM_CASCADE_ENABLED or LLM_STRONG_MODEL == LLM_FAST_MODEL:
+            return cls({FAST_TIER: get_llm(model_name=LLM_FAST_MODEL)})
+        return cls({
+            FAST_TIER: get_llm(model_name=LLM_FAST_MODEL),
+            STRONG_TIER: get_llm(model_name=LLM_STRONG_MODEL),
+        })
+
+    @classmethod
+    def single(cls, llm) -> "ModelCascade":
+        """
+        Wrap one LLM, which then handles every call.
+        """
+        return cls({FAST_TIER: llm})
+
+    @property
+    def fastest(self) -> str:
+        return self.order[0]
+
+    @property
+    def strongest(self) -> str:
+        return self.order[-1]
+
+    def llm(self, tier: str):
+        """
+        Get the LLM of a tier.
+        """
+        return self.tiers[tier]
+
+    def model_name(self, tier: str) -> str:
+        """
+        Get the model name of a tier.
+        """
+        name = getattr(self.tiers[tier], "model", tier)
+        return name[len("models/"):] if name.startswith("models/") else name
+
+    @contextmanager
+    def measure(self, tier: str, purpose: str) -> Iterator[Dict[str, int]]:
+        """
+        Time a call to a tier and record its latency and estimated cost.
+
+        Yields:
+            A dict in which the caller sets "prompt_tokens" and "completion_tokens".
+        """
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        start = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            tier_calls.inc(1, tier, purpose)
+            tier_latency.observe(time.perf_counter() - start, tier, purpose)
+            cost = estimate_cost(tier, usage["prompt_tokens"], usage["completion_tokens"])
+            tier_cost.inc(cost, tier)
+            with self._lock:
+                self.spend[tier] += cost
+
+    def select(self, top_relevance: Optional[float], simple: bool = True) -> Tuple[str, Optional[str]]:
+        """
+        Pick the tier to answer with first.
+
+        Returns:
+            The tier, and the reason for skipping the fast tier (None if it is used).
+        """
+        if len(self.order) == 1:
+            return self.fastest, None
+        if top_relevance is None or top_relevance < self.escalate_relevance:
+            return self.strongest, "low_relevance"
+        if not simple:
+            return self.strongest, "complex_question"
+        return self.fastest, None
+
+    def generate(self, call: Callable[[str], str], top_relevance: Optional[float], simple: bool = True) -> Tuple[str, str, Optional[str]]:
+        """
+        Answer with the cheapest suitable tier, escalating when it is unsure,
+        and falling back to another tier when the chosen one is unavailable.
+
+        Args:
+            call: Generates the answer with the given tier.
+            top_relevance: Relevance of the best retrieved document, if any.
+            simple: Whether the question is short and self-contained.
+
+        Returns:
+            The answer, the tier that produced it, and the escalation or fallback reason (None if neither happened).
+        """
+        tier, reason = self.select(top_relevance, simple)
+        try:
+            answer = call(tier)
+        except Exception as e:
+            fallback = self.strongest if tier != self.strongest else self.fastest
+            if fallback == tier or not should_fall_back(e):
+                raise
+            fallbacks.inc(1, tier)
+            logger.warning("Model tier failed; falling back", extra={"fields": {
+                "tier": tier, "fallback": fallback, "error": type(e).__name__,
+            }})
+            # Whichever tier answers now is the last resort, so it is not escalated again
+            return call(fallback), fallback, "fallback"
+        if tier != self.strongest and is_uncertain(answer):
+            try:
+                answer, tier, reason = call(self.strongest), self.strongest, "uncertain"
+            except Exception as e:
+                if not (should_fall_back(e) or isinstance(e, DeadlineExceeded)):
+                    raise
+                # The unsure answer is still better than none
+                logger.warning("Could not escalate answer", extra={"fields": {"error": type(e).__name__}})
+        if reason is not None:
+            escalations.inc(1, reason)
+            logger.info("Escalated answer", extra={"fields": {"tier": tier, "reason": reason}})
+        return answer, tier, reason
+
+
+_cascade: Optional[ModelCascade] = None
+_cascade_lock = threading.Lock()
+
+
+def get_model_cascade() -> ModelCascade:
+    """
+    Get the process-wide model cascade, shared by every persona's graph.
+    """
+    global _cascade
+    if _cascade is None:
+        with _cascade_lock:
+            if _cascade is None:
+                _cascade = ModelCascade.from_config()
+    return _cascade
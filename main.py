@@ -2,25 +2,30 @@
 Ali Haider's personal AI assistant using RAG technology.
 """
 import os
+import sys
+import json
 import argparse
+import uuid
 from typing import List, Optional
 
-from document_loader import load_document, load_documents_from_directory
-from vector_store import VectorStore
+from vector_store import open_vector_store
 from rag_graph import run_rag_graph
+from namespaces import DEFAULT_PERSONA, load_persona
 from config import GEMINI_API_KEY
-from initialize_assistant import initialize_assistant
 
 
-def add_documents(file_paths: List[str] = None, directory_path: Optional[str] = None) -> None:
+def add_documents(file_paths: List[str] = None, directory_path: Optional[str] = None, persona: Optional[str] = None) -> None:
     """
     Add documents to the vector store.
 
     Args:
         file_paths: List of file paths to add.
         directory_path: Directory path to add documents from.
+        persona: The persona whose index to add to. If None, uses the default persona.
     """
-    vector_store = VectorStore()
+    from document_loader import load_document, load_documents_from_directory
+
+    vector_store = open_vector_store(persist_directory=load_persona(persona or DEFAULT_PERSONA).index_dir)
 
     if file_paths:
         for file_path in file_paths:
@@ -36,23 +41,118 @@ def add_documents(file_paths: List[str] = None, directory_path: Optional[str] =
         print(f"Added {len(documents)} document chunks from {directory_path}")
 
 
-def ask_question(question: str, web_search: bool = True) -> str:
+def rebuild_shard(shard: int, persona: Optional[str] = None) -> None:
+    """
+    Re-index one shard of a sharded vector store from the data directory, leaving the other shards as they are.
+
+    Args:
+        shard: The shard to rebuild.
+        persona: The persona whose index to rebuild. If None, uses the default persona.
+    """
+    from document_loader import load_documents_from_directory
+    from sharded_vector_store import ShardedVectorStore
+
+    settings = load_persona(persona or DEFAULT_PERSONA)
+    vector_store = open_vector_store(persist_directory=settings.index_dir)
+    if not isinstance(vector_store, ShardedVectorStore):
+        print("The vector store is not sharded; use --init to rebuild it.")
+        return
+    if not 0 <= shard < vector_store.num_shards:
+        print(f"No shard {shard}; the vector store has {vector_store.num_shards}.")
+        return
+
+    documents = [
+        document for document in load_documents_from_directory(settings.data_dir)
+        if vector_store.shard_for(document) == shard
+    ]
+    vector_store.rebuild_shard(shard, documents)
+    print(f"Rebuilt shard {shard} with {len(documents)} document chunks")
+
+
+def compression_report(k: int = 10, persona: Optional[str] = None) -> None:
+    """
+    Print the memory saved and recall@k of each compressed index mode on the current index.
+
+    Args:
+        k: Results per query for the recall measurement.
+        persona: The persona whose index to measure. If None, uses the default persona.
+    """
+    from index_compression import compression_report as measure
+
+    vector_store = open_vector_store(persist_directory=load_persona(persona or DEFAULT_PERSONA).index_dir)
+    if vector_store.vector_store is None:
+        print("The vector store is empty; use --init to build it.")
+        return
+    print(json.dumps(measure(vector_store.full_vectors(), k=k), indent=2))
+
+
+def ask_question(question: str, web_search: bool = True, session_id: Optional[str] = None, persona: Optional[str] = None) -> str:
     """
     Ask a question and get an answer.
 
     Args:
         question: The question to ask.
         web_search: Whether to enable web search.
+        session_id: The conversation the question belongs to. If None, the question stands alone.
+        persona: The assistant to answer as. If None, uses the default persona.
 
     Returns:
         The answer.
     """
-    return run_rag_graph(question, web_search_enabled=web_search)
+    return run_rag_graph(question, web_search_enabled=web_search, session_id=session_id, persona=persona)
+
 
+def ask_batch(input_path: str, output_path: Optional[str] = None, web_search: bool = True, persona: Optional[str] = None) -> None:
+    """
+    Answer every question in a JSONL file, writing results as JSONL as each one finishes.
 
-def interactive_mode() -> None:
+    Args:
+        input_path: JSONL file with one {"question": ..., "id": ..., "web_search": ...} object per line.
+            Lines that are not such an object get an {"id": <line number>, "error": ...} result.
+        output_path: File to write results to. If None, writes to stdout.
+        web_search: Default for items without a "web_search" flag.
+        persona: The assistant to answer as. If None, uses the default persona.
+    """
+    from batch import BatchRunner
+
+    items, invalid = [], []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            # A malformed line is reported in the results; the other questions are still answered
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                invalid.append({"id": line_number, "error": f"Invalid JSON: {e}"})
+                continue
+            if not isinstance(item, dict) or not isinstance(item.get("question"), str) or not item["question"].strip():
+                invalid.append({"id": line_number, "error": 'Expected an object with a non-empty "question" string'})
+                continue
+            item.setdefault("id", line_number)
+            item.setdefault("web_search", web_search)
+            items.append(item)
+
+    output = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        for result in invalid:
+            output.write(json.dumps(result) + "\n")
+        output.flush()
+        results = BatchRunner(persona=persona).run(items) if items else []
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output_path:
+            output.close()
+
+
+def interactive_mode(persona: Optional[str] = None) -> None:
     """
     Run the application in interactive mode.
+
+    Args:
+        persona: The assistant to talk to. If None, uses the default persona.
     """
     print("=" * 50)
     print("Welcome to Ali Haider's Personal AI Assistant")
@@ -65,9 +165,11 @@ def interactive_mode() -> None:
     print("  'add file <file_path>' - Add a document to my knowledge base")
     print("  'add dir <directory_path>' - Add documents from a directory")
     print("  'web on/off' - Enable/disable web search")
+    print("  'new' - Start a new conversation")
     print("=" * 50)
 
     web_search = True
+    session_id = uuid.uuid4().hex
 
     while True:
         user_input = input("\nHow can I assist you today? ")
@@ -77,12 +179,12 @@ def interactive_mode() -> None:
 
         if user_input.lower().startswith('add file '):
             file_path = user_input[9:].strip()
-            add_documents(file_paths=[file_path])
+            add_documents(file_paths=[file_path], persona=persona)
             continue
 
         if user_input.lower().startswith('add dir '):
             directory_path = user_input[8:].strip()
-            add_documents(directory_path=directory_path)
+            add_documents(directory_path=directory_path, persona=persona)
             continue
 
         if user_input.lower() == 'web on':
@@ -95,9 +197,14 @@ def interactive_mode() -> None:
             print("Web search disabled")
             continue
 
+        if user_input.lower() == 'new':
+            session_id = uuid.uuid4().hex
+            print("Started a new conversation")
+            continue
+
         # Process the question
         print("\nProcessing your question...")
-        answer = ask_question(user_input, web_search=web_search)
+        answer = ask_question(user_input, web_search=web_search, session_id=session_id, persona=persona)
         print("\nAnswer:")
         print(answer)
 
@@ -110,6 +217,8 @@ def test_rag_system():
     print("Testing Ali Haider's Personal AI Assistant")
     print("=" * 70)
 
+    from initialize_assistant import initialize_assistant
+
     # Initialize the assistant
     print("Initializing the assistant...")
     success = initialize_assistant()
@@ -158,6 +267,12 @@ def main():
     parser.add_argument("--no-web", dest="no_web", action="store_true", help="Disable web search")
     parser.add_argument("--init", dest="initialize", action="store_true", help="Initialize Ali Haider's personal assistant")
     parser.add_argument("--test", dest="test", action="store_true", help="Test the RAG system with predefined questions")
+    parser.add_argument("--batch", dest="batch", help="Answer every question in a JSONL file")
+    parser.add_argument("--persona", help="Persona to use (a directory under PERSONAS_DIR); default: the built-in one")
+    parser.add_argument("--rebuild-shard", dest="rebuild_shard", type=int, help="Re-index one shard of a sharded vector store")
+    parser.add_argument("--compression-report", dest="compression_report", action="store_true",
+                        help="Report memory saved and recall@k of each compressed index mode on the current index")
+    parser.add_argument("--batch-output", dest="batch_output", help="Write batch results to this JSONL file instead of stdout")
 
     args = parser.parse_args()
 
@@ -167,20 +282,35 @@ def main():
         return
 
     if args.initialize:
-        success = initialize_assistant()
+        from initialize_assistant import initialize_assistant
+        if args.persona:
+            persona = load_persona(args.persona)
+            success = initialize_assistant(data_dir=persona.data_dir, persist_directory=persona.index_dir)
+        else:
+            success = initialize_assistant()
         if not success:
             return
 
     if args.add_files or args.add_dir:
-        add_documents(file_paths=args.add_files, directory_path=args.add_dir)
+        add_documents(file_paths=args.add_files, directory_path=args.add_dir, persona=args.persona)
+
+    if args.compression_report:
+        compression_report(persona=args.persona)
+        return
+
+    if args.rebuild_shard is not None:
+        rebuild_shard(args.rebuild_shard, persona=args.persona)
+        return
 
-    if args.question:
-        answer = ask_question(args.question, web_search=not args.no_web)
+    if args.batch:
+        ask_batch(args.batch, output_path=args.batch_output, web_search=not args.no_web, persona=args.persona)
+    elif args.question:
+        answer = ask_question(args.question, web_search=not args.no_web, persona=args.persona)
         print("\nAnswer:")
         print(answer)
     elif not args.initialize and not args.add_files and not args.add_dir and not args.test:
         # If no specific action is requested, run in interactive mode
-        interactive_mode()
+        interactive_mode(persona=args.persona)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+Metadata of indexed chunks, for filtered search.
+
+Chunks are annotated at ingest time with their source file, file type,
+ingestion time, section heading and origin (local documents or the web).
+For an index, these are kept as compact columns in index order: each text
+field as small integer codes into a per-column vocabulary, the ingestion
+time as floats. A filter is evaluated over the columns into a bitmap of
+matching positions, which FAISS applies inside the search, so the top k are
+all matches and k does not have to be inflated to survive filtering.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+from dataclasses import asdict, dataclass
+import bisect
+import os
+import re
+import time
+
+import numpy as np
+
+from langchain.schema.document import Document
+
+
+ORIGINS = ("local", "web")
+
+# Text columns, filtered by membership in a list of allowed values
+TEXT_COLUMNS = ("source_name", "file_type", "section", "origin")
+
+# Markdown heading, or a short title-like line ending in a colon
+HEADING_PATTERN = re.compile(r"^(?:#{1,6}\s+(.+?)\s*#*|([A-Z][^\n.!?]{0,60}):)\s*$", re.MULTILINE)
+
+
+def assign_sections(chunks: Sequence[Document], text: str, current: str = "") -> str:
+    """
+    Label chunks with the section they start in: the last heading of the
+    source text at or before their "start_index".
+
+    Args:
+        chunks: Chunks split from text with add_start_index=True.
+        text: The source text.
+        current: The section open before text starts, e.g. from the previous page of a PDF.
+
+    Returns:
+        The section still open at the end of text.
+    """
+    offsets: List[int] = []
+    titles: List[str] = []
+    for match in HEADING_PATTERN.finditer(text):
+        offsets.append(match.start())
+        titles.append((match.group(1) or match.group(2)).strip())
+    for chunk in chunks:
+        start = chunk.metadata.get("start_index")
+        if start is None or start < 0:
+            continue
+        position = bisect.bisect_right(offsets, start)
+        chunk.metadata["section"] = titles[position - 1] if position else current
+    return titles[-1] if titles else current
+
+
+def annotate(documents: Sequence[Document], origin: str = "local") -> None:
+    """
+    Add the filterable metadata fields to chunks that do not have them yet.
+
+    Sections are assigned when documents are split (see assign_sections);
+    chunks without one, such as web results, get an empty section.
+    """
+    now = time.time()
+    for document in documents:
+        metadata = document.metadata
+        source = metadata.get("source") or ""
+        metadata.setdefault("source_name", os.path.basename(source) if origin == "local" else source)
+        metadata.setdefault("file_type", os.path.splitext(source)[1].lstrip(".").lower() if origin == "local" else "html")
+        metadata.setdefault("ingested_at", now)
+        metadata.setdefault("origin", origin)
+        metadata.setdefault("section", "")
+
+
+def _field(metadata: Dict[str, Any], column: str) -> str:
+    # Chunks indexed before annotation was added still have a source path
+    value = metadata.get(column)
+    if value is not None:
+        return str(value)
+    source = metadata.get("source") or ""
+    if column == "source_name":
+        return os.path.basename(source)
+    if column == "file_type":
+        return os.path.splitext(source)[1].lstrip(".").lower()
+    if column == "origin":
+        return "local"
+    return ""
+
+
+@dataclass
+class MetadataFilter:
+    """
+    Conditions on chunk metadata; a chunk must meet all that are set.
+    """
+    sources: Optional[List[str]] = None
+    file_types: Optional[List[str]] = None
+    sections: Optional[List[str]] = None
+    origin: Optional[str] = None
+    ingested_after: Optional[float] = None
+    ingested_before: Optional[float] = None
+
+    def __post_init__(self):
+        if self.origin is not None and self.origin not in ORIGINS:
+            raise ValueError(f"Unknown origin {self.origin!r}; expected one of {ORIGINS}")
+        if self.file_types is not None:
+            self.file_types = [file_type.lower().lstrip(".") for file_type in self.file_types]
+
+    @classmethod
+    def from_dict(cls, filters: Optional[Dict[str, Any]]) -> Optional["MetadataFilter"]:
+        """
+        Build a filter from request fields, or None if no condition is set.
+
+        Raises:
+            ValueError: If a field is unknown or invalid.
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown filter fields: {', '.join(sorted(unknown))}")
+        metadata_filter = cls(**filters)
+        return metadata_filter if any(value is not None for value in asdict(metadata_filter).values()) else None
+
+    def allowed(self) -> Dict[str, List[str]]:
+        """
+        Allowed values of each restricted text column.
+        """
+        allowed = {
+            "source_name": self.sources,
+            "file_type": self.file_types,
+            "section": self.sections,
+            "origin": [self.origin] if self.origin else None,
+        }
+        return {column: values for column, values in allowed.items() if values is not None}
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        """
+        Whether one chunk's metadata meets the filter, for chunks outside the index (e.g. from the web).
+        """
+        for column, values in self.allowed().items():
+            if _field(metadata, column) not in values:
+                return False
+        ingested_at = float(metadata.get("ingested_at") or 0.0)
+        if self.ingested_after is not None and ingested_at < self.ingested_after:
+            return False
+        if self.ingested_before is not None and ingested_at >= self.ingested_before:
+            return False
+        return True
+
+
+class MetadataIndex:
+    """
+    Chunk metadata as columns in index order.
+    """
+
+    def __init__(self, metadatas: Sequence[Dict[str, Any]]):
+        """
+        Build the columns.
+
+        Args:
+            metadatas: Metadata of each indexed chunk, in index order.
+        """
+        self.size = len(metadatas)
+        self.vocabularies: Dict[str, Dict[str, int]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for column in TEXT_COLUMNS:
+            vocabulary: Dict[str, int] = {}
+            codes = np.fromiter(
+                (vocabulary.setdefault(_field(metadata, column), len(vocabulary)) for metadata in metadatas),
+                dtype=np.int32, count=self.size,
+            )
+            self.vocabularies[column] = vocabulary
+            self.codes[column] = codes
+        self.ingested_at = np.fromiter(
+            (float(metadata.get("ingested_at") or 0.0) for metadata in metadatas), dtype=np.float64, count=self.size
+        )
+
+    def mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        """
+        Boolean array of the positions that meet the filter.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for column, values in metadata_filter.allowed().items():
+            vocabulary = self.vocabularies[column]
+            allowed = [vocabulary[value] for value in values if value in vocabulary]
+            mask &= np.isin(self.codes[column], allowed)
+        if metadata_filter.ingested_after is not None:
+            mask &= self.ingested_at >= metadata_filter.ingested_after
+        if metadata_filter.ingested_before is not None:
+            mask &= self.ingested_at < metadata_filter.ingested_before
+        return mask
+
+
+class BitmapSelector:
+    """
+    A FAISS ID selector over a boolean mask, keeping the packed bitmap alive while it is in use.
+    """
+
+    def __init__(self, mask: np.ndarray):
+        import faiss
+
+        # FAISS reads bit (id & 7) of byte (id >> 3)
+        self.bitmap = np.packbits(mask, bitorder="little")
+        self.selector = faiss.IDSelectorBitmap(len(self.bitmap), faiss.swig_ptr(self.bitmap))
+
+    def search_parameters(self):
+        """
+        Search parameters that restrict a FAISS search to the selected positions.
+        """
+        import faiss
+        return faiss.SearchParameters(sel=self.selector)
@@ -0,0 +1,234 @@
+"""
+Persona namespaces: several assistants served from one process.
+
+The default persona is the one configured in personal_info and
+prompt_templates, with its index at VECTOR_STORE_PATH. Other personas
+live in PERSONAS_DIR/<name>/:
+
+    persona.json    {"prompt_prefix": "...", "description": "..."} and optionally
+                    "query_prompt" (a full rewrite prompt with a {question} placeholder)
+    data/           the persona's documents, and optionally sources.json (see source_registry)
+    vector_store/   its index, built from data/ on first use if missing
+
+Persona indexes and graphs are loaded on first use and unloaded least
+recently used first when their estimated memory exceeds
+PERSONA_INDEX_MEMORY_BYTES. The default persona is loaded at warm-up and
+never unloaded. Embedding models, LLM clients and the web retriever are
+shared by every persona.
+"""
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+import json
+import os
+import re
+import threading
+import time
+
+from config import PERSONAS_DIR, PERSONA_INDEX_MEMORY_BYTES, VECTOR_STORE_PATH
+from prompt_templates import RAG_PREFIX, PERSONA_QUERY_TRANSFORMATION_PROMPT, get_query_transformation_prompt
+from vector_store import VectorStore, open_vector_store
+from source_registry import get_source_registry
+from rag_graph import create_rag_graph
+from warmup import file_lock
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+loaded_gauge = registry.gauge("persona_indexes_loaded", "Persona indexes held in memory")
+memory_gauge = registry.gauge("persona_index_memory_bytes", "Estimated memory of loaded persona indexes")
+evictions = registry.counter("persona_index_evictions_total", "Persona indexes unloaded to stay within the memory budget")
+load_time = registry.histogram("persona_index_load_seconds", "Time to load (or build) a persona index")
+
+DEFAULT_PERSONA = "default"
+
+PERSONA_NAME_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+class UnknownPersona(KeyError):
+    """
+    Raised for a persona that is not configured.
+    """
+
+
+@dataclass
+class Persona:
+    """
+    Where a persona's documents and index are, and its prompts.
+    """
+    name: str
+    data_dir: str
+    index_dir: str
+    prompt_prefix: str
+    query_prompt: Optional[str] = None
+
+
+def load_persona(name: str) -> Persona:
+    """
+    Read a persona's configuration.
+
+    Raises:
+        UnknownPersona: If the name is invalid or the persona is not configured.
+    """
+    if name == DEFAULT_PERSONA:
+        return Persona(
+            name=name,
+            data_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+            index_dir=VECTOR_STORE_PATH,
+            prompt_prefix=RAG_PREFIX,
+        )
+    if not PERSONA_NAME_PATTERN.match(name):
+        raise UnknownPersona(name)
+    root = os.path.join(PERSONAS_DIR, name)
+    try:
+        with open(os.path.join(root, "persona.json"), "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        raise UnknownPersona(name)
+
+    query_prompt = settings.get("query_prompt")
+    if query_prompt is None and settings.get("description"):
+        # Braces in the description are literal text, not variables of the resulting prompt template
+        description = settings["description"].replace("{", "{{").replace("}", "}}")
+        query_prompt = PERSONA_QUERY_TRANSFORMATION_PROMPT.format(description=description)
+    return Persona(
+        name=name,
+        data_dir=os.path.join(root, "data"),
+        index_dir=os.path.join(root, "vector_store"),
+        prompt_prefix=settings["prompt_prefix"],
+        query_prompt=query_prompt,
+    )
+
+
+def list_personas() -> List[str]:
+    """
+    Names of every configured persona, the default first.
+    """
+    names = []
+    if os.path.isdir(PERSONAS_DIR):
+        names = sorted(
+            name for name in os.listdir(PERSONAS_DIR)
+            if PERSONA_NAME_PATTERN.match(name) and os.path.isfile(os.path.join(PERSONAS_DIR, name, "persona.json"))
+        )
+    return [DEFAULT_PERSONA] + names
+
+
+@dataclass
+class Namespace:
+    """
+    A loaded persona: its index and the graph answering from it.
+    """
+    persona: Persona
+    vector_store: VectorStore
+    graph: Any
+    memory_bytes: int
+
+
+class NamespaceRegistry:
+    """
+    Persona namespaces loaded on demand, unloaded least recently used first.
+    """
+
+    def __init__(self, memory_budget: int = PERSONA_INDEX_MEMORY_BYTES):
+        """
+        Initialize the registry.
+
+        Args:
+            memory_budget: Estimated bytes of persona indexes to keep loaded.
+        """
+        self.memory_budget = memory_budget
+        self._loaded: "OrderedDict[str, Namespace]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Namespace:
+        """
+        Get a persona's namespace, loading (or building) its index on first use.
+
+        Raises:
+            UnknownPersona: If the persona is not configured.
+        """
+        with self._lock:
+            namespace = self._loaded.get(name)
+            if namespace is not None:
+                self._loaded.move_to_end(name)
+                return namespace
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # One thread loads a persona while the others asking for it wait
+        with loading:
+            with self._lock:
+                namespace = self._loaded.get(name)
+                if namespace is not None:
+                    self._loaded.move_to_end(name)
+                    return namespace
+            namespace = self._load(load_persona(name))
+            with self._lock:
+                self._loaded[name] = namespace
+                self._evict()
+            return namespace
+
+    def _load(self, persona: Persona) -> Namespace:
+        start = time.perf_counter()
+        vector_store = open_vector_store(persist_directory=persona.index_dir)
+        if vector_store.vector_store is None:
+            with file_lock(persona.index_dir.rstrip(os.sep) + ".lock"):
+                # Another process may have built it while we waited for the lock
+                vector_store.reload()
+                if vector_store.vector_store is None:
+                    logger.info("Building persona index", extra={"fields": {"persona": persona.name}})
+                    from initialize_assistant import initialize_assistant
+                    if not initialize_assistant(data_dir=persona.data_dir, persist_directory=persona.index_dir):
+                        raise RuntimeError(f"Failed to build the index of persona {persona.name}")
+                    vector_store.reload()
+
+        query_prompt = get_query_transformation_prompt(persona.query_prompt) if persona.query_prompt else None
+        graph = create_rag_graph(
+            vector_store=vector_store,
+            prompt_prefix=persona.prompt_prefix,
+            query_transformation_prompt=query_prompt,
+            source_registry=get_source_registry(os.path.join(persona.data_dir, "sources.json")),
+        )
+        namespace = Namespace(persona, vector_store, graph, vector_store.memory_bytes())
+        seconds = time.perf_counter() - start
+        load_time.observe(seconds)
+        logger.info("Loaded persona", extra={"fields": {
+            "persona": persona.name, "memory_bytes": namespace.memory_bytes, "load_ms": round(seconds * 1000),
+        }})
+        return namespace
+
+    def _evict(self) -> None:
+        # Requests already using an evicted namespace keep it alive until they finish
+        total = sum(namespace.memory_bytes for namespace in self._loaded.values())
+        while total > self.memory_budget and len(self._loaded) > 1:
+            name, namespace = self._loaded.popitem(last=False)
+            total -= namespace.memory_bytes
+            evictions.inc()
+            logger.info("Unloaded persona", extra={"fields": {"persona": name, "memory_bytes": namespace.memory_bytes}})
+        loaded_gauge.set(len(self._loaded))
+        memory_gauge.set(total)
+
+    def status(self) -> Dict[str, int]:
+        """
+        Loaded personas and their estimated memory, most recently used last.
+        """
+        with self._lock:
+            return {name: namespace.memory_bytes for name, namespace in self._loaded.items()}
+
+
+_registry: Optional[NamespaceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_namespaces() -> NamespaceRegistry:
+    """
+    Get the process-wide persona registry.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = NamespaceRegistry()
+    return _registry
@@ -0,0 +1,157 @@
+"""
+Provider-side caching of the static RAG prompt prefix.
+
+With Gemini context caching, the persona and guidelines are uploaded once
+as cached content, and each request sends only the per-request suffix.
+Caching is used only when the installed google-generativeai exposes the
+caching API and the prefix is at least as large as the provider's minimum
+cacheable size. Otherwise callers fall back to sending the whole prompt.
+"""
+from typing import Dict, Optional, Tuple
+import datetime
+import threading
+import time
+
+from config import GEMINI_API_KEY, PROMPT_CACHE_TTL, PROMPT_CACHE_MIN_TOKENS
+from resilience import is_transient
+from telemetry import registry, estimate_tokens
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+prompt_tokens = registry.counter(
+    "llm_prompt_tokens_total", "Estimated prompt tokens sent to the LLM", labels=("segment", "cached")
+)
+
+# google.api_core errors meaning caching cannot work for this model or key (unsupported, forbidden, prefix too small)
+UNSUPPORTED_ERROR_NAMES = {"InvalidArgument", "FailedPrecondition", "NotFound", "PermissionDenied", "Unauthenticated"}
+
+
+class ContextCache:
+    """
+    A cached prompt prefix and the model bound to it, refreshed before it expires.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        prefix: str,
+        ttl: int = PROMPT_CACHE_TTL,
+        min_tokens: int = PROMPT_CACHE_MIN_TOKENS,
+    ):
+        """
+        Initialize the cache. Nothing is uploaded until the first request.
+
+        Args:
+            model_name: The Gemini model the cached content is created for.
+            prefix: The static prompt prefix.
+            ttl: Lifetime of the cached content in seconds.
+            min_tokens: Smallest prefix the provider accepts for caching.
+        """
+        self.model_name = model_name
+        self.prefix = prefix
+        self.prefix_tokens = estimate_tokens(prefix)
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.supported = self._supported()
+        self.disabled = False
+        self._model = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether requests can use the cached prefix.
+        """
+        return not self.disabled and self.supported and self.prefix_tokens >= self.min_tokens
+
+    def _supported(self) -> bool:
+        # Resolved once, in __init__
+        try:
+            from google.generativeai import caching  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _create(self):
+        """
+        Upload the prefix and return a model that prepends it to every request.
+        """
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        genai.configure(api_key=GEMINI_API_KEY)
+        cached_content = caching.CachedContent.create(
+            model=f"models/{self.model_name}",
+            system_instruction=self.prefix,
+            ttl=datetime.timedelta(seconds=self.ttl),
+        )
+        logger.info("Created cached prompt prefix", extra={"fields": {
+            "model": self.model_name, "prefix_tokens_est": self.prefix_tokens, "ttl_s": self.ttl,
+        }})
+        return genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+
+    def _get_model(self):
+        with self._lock:
+            # Recreate shortly before expiry so no request races the provider's deletion
+            if self._model is None or time.monotonic() >= self._expires_at:
+                self._model = self._create()
+                self._expires_at = time.monotonic() + self.ttl * 0.9
+            return self._model
+
+    def generate(self, suffix: str) -> Optional[str]:
+        """
+        Generate a completion of the cached prefix followed by suffix.
+
+        Returns:
+            The completion, or None if the cache is unavailable or failed and
+            callers should send the whole prompt. If the provider rejects
+            caching for this model, the cache is disabled for good.
+
+        Raises:
+            Exception: Transient provider errors, for the caller to retry.
+        """
+        if not self.available:
+            return None
+        try:
+            response = self._get_model().generate_content(suffix)
+        except Exception as e:
+            if is_transient(e):
+                raise
+            if type(e).__name__ in UNSUPPORTED_ERROR_NAMES or getattr(e, "code", None) in (400, 403, 404):
+                logger.warning("Cached prompt prefix rejected; sending the full prompt from now on", extra={"fields": {
+                    "model": self.model_name, "error": type(e).__name__,
+                }})
+                self.disabled = True
+            else:
+                logger.exception("Cached prompt prefix failed; sending the full prompt")
+            return None
+
+        prompt_tokens.inc(self.prefix_tokens, "prefix", "true")
+        prompt_tokens.inc(estimate_tokens(suffix), "suffix", "false")
+        return response.text
+
+
+_context_caches: Dict[Tuple[str, str], ContextCache] = {}
+_context_caches_lock = threading.Lock()
+
+
+def get_context_cache(model_name: str, prefix: str) -> ContextCache:
+    """
+    Get the process-wide cache of a prefix for a model, so every caller shares one upload.
+    """
+    with _context_caches_lock:
+        key = (model_name, prefix)
+        if key not in _context_caches:
+            _context_caches[key] = ContextCache(model_name, prefix)
+        return _context_caches[key]
+
+
+def record_uncached_prompt(prefix: str, suffix: str) -> None:
+    """
+    Count the tokens of a prompt sent without provider caching.
+    """
+    prompt_tokens.inc(estimate_tokens(prefix), "prefix", "false")
+    prompt_tokens.inc(estimate_tokens(suffix), "suffix", "false")
@@ -1,13 +1,17 @@
 """
 High-quality prompt templates for the RAG application.
 """
+from typing import List
+import functools
+
 from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain.schema.messages import BaseMessage, HumanMessage, SystemMessage
 
 from personal_info import PERSONAL_INFO, ASSISTANT_INFO, PERSONAL_BIO
 
 
-# Combined prompt for RAG
-RAG_PROMPT = """You are Ali, the personal AI assistant for Ali Haider. You provide accurate, helpful, and concise responses based on the provided context and your knowledge about Ali Haider.
+# Static persona and guidelines, identical on every request so it can be cached
+RAG_PREFIX = """You are Ali, the personal AI assistant for Ali Haider. You provide accurate, helpful, and concise responses based on the provided context and your knowledge about Ali Haider.
 
 Your primary role is to represent Ali Haider and assist users by answering questions about him and his work. When asked about personal information, always respond as if you are Ali Haider's assistant, not Ali himself.
 
@@ -27,16 +31,21 @@ Guidelines:
 5. If the question is not related to Ali Haider or his work, use your general knowledge to provide a helpful response.
 6. Always maintain a professional and friendly tone.
 7. If you're unsure about something, acknowledge the uncertainty rather than making assumptions.
-8. Keep responses concise and to the point while being informative.
+8. Keep responses concise and to the point while being informative."""
 
-Context:
+# Per-request part of the RAG prompt
+RAG_SUFFIX = """Context:
 {context}
 
 Question: {question}
 
 Answer:"""
 
+# Combined prompt for RAG
+RAG_PROMPT = RAG_PREFIX + "\n\n" + RAG_SUFFIX
+
 
+@functools.lru_cache(maxsize=None)
 def get_rag_prompt_template():
     """
     Get the RAG prompt template.
@@ -49,6 +58,45 @@ def get_rag_prompt_template():
     ])
 
 
+@functools.lru_cache(maxsize=None)
+def get_rag_prefix_message(prefix: str = RAG_PREFIX) -> SystemMessage:
+    """
+    Get the static part of the RAG prompt, rendered once per persona.
+
+    Args:
+        prefix: The persona and guidelines.
+
+    Returns:
+        The prefix as a system message.
+    """
+    return SystemMessage(content=prefix)
+
+
+def render_rag_messages(context: str, question: str, history: str = "", prefix: str = RAG_PREFIX) -> List[BaseMessage]:
+    """
+    Render the RAG prompt, formatting only the per-request suffix.
+
+    Gemini receives the system message merged into the first user message,
+    so the model gets the same instructions as with get_rag_prompt_template().
+
+    Args:
+        context: The formatted context.
+        question: The user's question.
+        history: Earlier turns of the conversation relevant to the question, if any.
+        prefix: The persona and guidelines.
+
+    Returns:
+        The prompt messages.
+    """
+    suffix = RAG_SUFFIX.format(context=context, question=question)
+    if history:
+        suffix = f"Conversation so far:\n{history}\n\n{suffix}"
+    return [
+        get_rag_prefix_message(prefix),
+        HumanMessage(content=suffix),
+    ]
+
+
 # Combined prompt for query transformation
 QUERY_TRANSFORMATION_PROMPT = """You are an expert at transforming user questions into effective search queries for Ali Haider's personal AI assistant.
 
@@ -67,13 +115,34 @@ Original Question: {question}
 Transformed Query:"""
 
 
-def get_query_transformation_prompt():
+# Query transformation prompt for other personas; {description} says who the assistant represents
+PERSONA_QUERY_TRANSFORMATION_PROMPT = """You are an expert at transforming user questions into effective search queries for a personal AI assistant.
+
+{description}
+
+Guidelines for query transformation:
+1. If the question is about the person or organization the assistant represents, focus the query on retrieving relevant information about them.
+2. For general questions, transform the query to be more specific and focused.
+3. Remove any unnecessary words or phrases that might dilute the search results.
+4. Maintain the core meaning and intent of the original question.
+5. If the question is unclear, add context to make it more specific.
+
+Original Question: {{question}}
+
+Transformed Query:"""
+
+
+@functools.lru_cache(maxsize=None)
+def get_query_transformation_prompt(template: str = QUERY_TRANSFORMATION_PROMPT):
     """
     Get the query transformation prompt template.
 
+    Args:
+        template: The prompt, with a {question} placeholder.
+
     Returns:
         The query transformation prompt template.
     """
     return ChatPromptTemplate.from_messages([
-        HumanMessagePromptTemplate.from_template(QUERY_TRANSFORMATION_PROMPT),
+        HumanMessagePromptTemplate.from_template(template),
     ])
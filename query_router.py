@@ -0,0 +1,139 @@
+"""
+Cheap local routing for the RAG graph.
+
+Decides, without an LLM call, whether a question needs to be rewritten
+into a search query, and whether the vector store's results are
+confident enough to skip web search. Decisions use the question's length,
+pronouns that need context to resolve, and its overlap with the
+vocabulary and named entities of the indexed documents.
+"""
+from typing import Dict, Iterable, List, Optional, Set
+from dataclasses import dataclass
+import re
+import threading
+
+from langchain.schema.document import Document
+
+from config import ROUTER_MAX_QUERY_WORDS, ROUTER_MIN_RELEVANCE, ROUTER_MIN_COVERAGE
+from telemetry import registry
+
+
+route_count = registry.counter("rag_route_total", "Questions per route", labels=("route",))
+route_saved = registry.counter(
+    "rag_route_saved_seconds_total", "Estimated latency saved by skipped stages", labels=("route",)
+)
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9'+#.-]*[A-Za-z0-9+#]|[A-Za-z0-9]")
+
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "could", "did", "do", "does",
+    "for", "from", "give", "has", "have", "how", "i", "in", "is", "me", "my", "of", "on", "or",
+    "please", "tell", "the", "to", "was", "were", "what", "when", "where", "which", "who", "whom",
+    "why", "will", "with", "would", "you", "your",
+}
+
+# Words whose meaning depends on earlier conversation, which a rewrite resolves
+ANAPHORA = {"he", "she", "it", "they", "him", "her", "them", "his", "hers", "its", "their", "this", "that", "these", "those"}
+
+
+def content_words(text: str) -> List[str]:
+    """
+    Lowercased words of text, without stopwords.
+    """
+    return [word for word in (w.lower() for w in WORD_PATTERN.findall(text)) if word not in STOPWORDS]
+
+
+@dataclass
+class RouteDecision:
+    """
+    How to process one question.
+    """
+    rewrite: bool
+    in_domain: bool
+    reason: str
+
+
+class QueryRouter:
+    """
+    Local router built from the indexed documents.
+    """
+
+    def __init__(self, vocabulary: Set[str], entities: Set[str]):
+        """
+        Initialize the router.
+
+        Args:
+            vocabulary: Lowercased words that occur in the indexed documents.
+            entities: Lowercased capitalized words (names, companies, products) in the indexed documents.
+        """
+        self.vocabulary = vocabulary
+        self.entities = entities
+        # Moving averages of the stages a route can skip, for the savings estimate
+        self._stage_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "QueryRouter":
+        """
+        Build a router from the documents in the index.
+        """
+        vocabulary: Set[str] = set()
+        entities: Set[str] = set()
+        for document in documents:
+            for word in WORD_PATTERN.findall(document.page_content):
+                lowered = word.lower()
+                if lowered in STOPWORDS:
+                    continue
+                vocabulary.add(lowered)
+                if word[0].isupper():
+                    entities.add(lowered)
+        return cls(vocabulary, entities)
+
+    def decide(self, question: str) -> RouteDecision:
+        """
+        Decide whether to rewrite a question and whether it is about the indexed documents.
+        """
+        words = content_words(question)
+        known = [word for word in words if word in self.vocabulary]
+        coverage = len(known) / len(words) if words else 0.0
+        in_domain = any(word in self.entities for word in words) and coverage >= ROUTER_MIN_COVERAGE
+
+        all_words = {w.lower() for w in WORD_PATTERN.findall(question)}
+        if all_words & ANAPHORA:
+            return RouteDecision(rewrite=True, in_domain=in_domain, reason="anaphora")
+        if not words:
+            return RouteDecision(rewrite=True, in_domain=in_domain, reason="no_keywords")
+        if len(words) > ROUTER_MAX_QUERY_WORDS:
+            return RouteDecision(rewrite=True, in_domain=in_domain, reason="long")
+        if in_domain:
+            return RouteDecision(rewrite=False, in_domain=True, reason="matches_index")
+        if coverage >= ROUTER_MIN_COVERAGE:
+            return RouteDecision(rewrite=False, in_domain=False, reason="keyword_query")
+        return RouteDecision(rewrite=True, in_domain=False, reason="unfamiliar_terms")
+
+    def skip_web(self, decision: RouteDecision, top_relevance: Optional[float]) -> bool:
+        """
+        Whether the vector store alone answers an in-domain question confidently.
+        """
+        return decision.in_domain and top_relevance is not None and top_relevance >= ROUTER_MIN_RELEVANCE
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        """
+        Record how long a skippable stage took when it did run.
+        """
+        with self._lock:
+            previous = self._stage_seconds.get(stage)
+            self._stage_seconds[stage] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def record_route(self, route: str, skipped: Iterable[str]) -> float:
+        """
+        Count a route and estimate the latency its skipped stages saved.
+
+        Returns:
+            The estimated seconds saved.
+        """
+        with self._lock:
+            saved = sum(self._stage_seconds.get(stage, 0.0) for stage in skipped)
+        route_count.inc(1, route)
+        route_saved.inc(saved, route)
+        return saved
@@ -1,18 +1,62 @@
 """
 LangGraph workflow for the RAG application.
 """
-from typing import Dict, List, Annotated, TypedDict, Sequence
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Annotated, TypedDict, Sequence
 from typing_extensions import TypedDict
+import threading
+import time
 
 from langchain.schema.document import Document
 from langchain.schema.runnable import RunnableConfig
 from langchain.schema.messages import HumanMessage
 from langgraph.graph import StateGraph, END
 
-from llm import get_llm
-from vector_store import VectorStore
-from web_retriever import WebRetriever
-from prompt_templates import get_rag_prompt_template, get_query_transformation_prompt
+from llm import ModelCascade, get_model_cascade
+from vector_store import VectorStore, chunk_key, get_shared_vector_store
+from prompt_templates import RAG_PREFIX, get_query_transformation_prompt, render_rag_messages
+from prompt_cache import get_context_cache, record_uncached_prompt
+from query_router import QueryRouter, RouteDecision
+from source_registry import SourceRegistry, get_source_registry
+from metadata_index import MetadataFilter, annotate
+from sessions import get_session_store, session_turns
+from resilience import DeadlineExceeded, get_caller, should_fall_back, stage_budget
+from config import ROUTER_ENABLED, ROUTER_MAX_QUERY_WORDS, PROMPT_CACHE_ENABLED, REQUEST_DEADLINE
+from telemetry import span, traced_node, estimate_tokens
+from structured_logging import get_logger, get_request_id
+
+if TYPE_CHECKING:
+    from web_retriever import WebRetriever
+
+
+logger = get_logger(__name__)
+
+
+def format_context(documents: List[Document]) -> str:
+    """
+    Format retrieved documents as the context block of the RAG prompt.
+
+    Args:
+        documents: The retrieved documents.
+
+    Returns:
+        The context text.
+    """
+    return "\n\n".join([doc.page_content for doc in documents])
+
+
+def merge_context(vector_store_context: List[Document], web_context: List[Document]) -> List[Document]:
+    """
+    Combine retrieved and web context, without the indexed chunks that local sources served again.
+
+    Args:
+        vector_store_context: Documents retrieved from the vector store.
+        web_context: Documents from web and local sources.
+
+    Returns:
+        The retrieved documents, followed by the web documents not already among them.
+    """
+    retrieved = {chunk_key(document) for document in vector_store_context}
+    return vector_store_context + [document for document in web_context if chunk_key(document) not in retrieved]
 
 
 # Define the state
@@ -24,27 +68,119 @@ class GraphState(TypedDict):
     search_query: str
     context: List[Document]
     answer: str
+    web_context: List[Document]
     web_search_enabled: bool
+    route_rewrite: bool
+    route_in_domain: bool
+    route_reason: str
+    top_relevance: Optional[float]
+    answer_tier: str
+    escalation_reason: Optional[str]
+    deadline: Optional[float]
+    history: str
+    context_reused: bool
+    filters: Optional[MetadataFilter]
+    trace_id: str
+    request_id: str
+
+
+_web_retriever: Optional["WebRetriever"] = None
+_web_retriever_lock = threading.Lock()
 
 
-def create_rag_graph():
+def get_shared_web_retriever() -> "WebRetriever":
+    """
+    Get the process-wide web retriever, shared by every persona's graph.
+    """
+    global _web_retriever
+    if _web_retriever is None:
+        with _web_retriever_lock:
+            if _web_retriever is None:
+                # Imported on first use, so text-only traffic never loads the web scraping stack
+                from web_retriever import WebRetriever
+                _web_retriever = WebRetriever()
+    return _web_retriever
+
+
+def create_rag_graph(
+    llm=None,
+    vector_store: Optional[VectorStore] = None,
+    web_retriever: Optional["WebRetriever"] = None,
+    cascade: Optional[ModelCascade] = None,
+    prompt_prefix: str = RAG_PREFIX,
+    query_transformation_prompt=None,
+    source_registry: Optional[SourceRegistry] = None,
+):
     """
     Create the RAG graph.
 
+    Args:
+        llm: A single LLM for every call. If None, uses the configured model cascade.
+        vector_store: The vector store to retrieve from. If None, uses the process-wide one.
+        web_retriever: The web retriever to use. If None, the process-wide one is used on the first web search.
+        cascade: The model tiers to use, if llm is not given. If None, the process-wide cascade is used.
+        prompt_prefix: The persona and guidelines of the answer prompt.
+        query_transformation_prompt: The query rewrite prompt template. If None, uses the default.
+        source_registry: Subjects and URLs served from the index instead of the web. If None, uses SOURCE_REGISTRY_PATH.
+
     Returns:
         The RAG graph.
     """
     # Initialize components
-    llm = get_llm(model_name="gemini-1.5-flash")  # Explicitly use Gemini Flash 1.5
-    print(f"RAG Graph using LLM model: {llm.model}")
+    use_gemini = llm is None and cascade is None
+    if llm is not None:
+        cascade = ModelCascade.single(llm)
+    cascade = cascade or get_model_cascade()
+    logger.debug("RAG Graph using LLM models: %s", {tier: cascade.model_name(tier) for tier in cascade.order})
+
+    # Provider-side caching of the static prompt prefix, only for the real Gemini models
+    context_caches = {
+        tier: get_context_cache(cascade.model_name(tier), prompt_prefix) for tier in cascade.order
+    } if use_gemini and PROMPT_CACHE_ENABLED else {}
+
+    vector_store = vector_store or get_shared_vector_store()
+    source_registry = source_registry or get_source_registry()
+
+    def get_web_retriever() -> "WebRetriever":
+        return web_retriever or get_shared_web_retriever()
 
-    vector_store = VectorStore()
-    web_retriever = WebRetriever()
-    rag_prompt = get_rag_prompt_template()
-    query_transformation_prompt = get_query_transformation_prompt()
+    routers: List[QueryRouter] = []
+
+    def get_router() -> QueryRouter:
+        # Built from the index on first use, since the index may still be loading when the graph is created
+        if not routers:
+            routers.append(QueryRouter.from_documents(vector_store.documents()))
+        return routers[0]
+
+    query_transformation_prompt = query_transformation_prompt or get_query_transformation_prompt()
 
     # Define the nodes
 
+    @traced_node("route")
+    def route(state: GraphState) -> GraphState:
+        """
+        Decide locally whether the question needs an LLM rewrite before retrieval.
+        """
+        question = state["question"]
+        if state.get("context_reused"):
+            # A follow-up in a session, answered from the previous turn's context
+            return {"route_rewrite": False, "route_in_domain": True, "route_reason": "follow_up", "search_query": question}
+        if not ROUTER_ENABLED:
+            decision = RouteDecision(rewrite=True, in_domain=False, reason="router_disabled")
+        else:
+            decision = get_router().decide(question)
+
+        update = {
+            "route_rewrite": decision.rewrite,
+            "route_in_domain": decision.in_domain,
+            "route_reason": decision.reason,
+        }
+        if not decision.rewrite:
+            # The question is already a good search query
+            update["search_query"] = question
+        return update
+
+    @traced_node("transform_query")
     def transform_query(state: GraphState) -> GraphState:
         """
         Transform the user question into an optimized search query.
@@ -53,13 +189,38 @@ def create_rag_graph():
         question = state["question"]
 
         # Transform the question into a search query
-        chain = query_transformation_prompt | llm
-        response = chain.invoke({"question": question})
-        search_query = response.content
+        start = time.perf_counter()
+        tier = cascade.fastest
+        chain = query_transformation_prompt | cascade.llm(tier)
+        caller = get_caller(f"llm.{cascade.model_name(tier)}")
+        try:
+            # In a session, the relevant history lets the rewrite resolve references like "he" or "that project"
+            history = state.get("history")
+            rewrite_input = f"{question}\n\n(Conversation so far:\n{history})" if history else question
+            with span("llm.invoke", purpose="transform_query", tier=tier) as llm_span, \
+                    cascade.measure(tier, "transform_query") as usage:
+                response = caller.call(
+                    lambda: chain.invoke({"question": rewrite_input}),
+                    timeout=stage_budget(state.get("deadline"), "transform_query"),
+                )
+                search_query = response.content
+                usage["prompt_tokens"] = estimate_tokens(rewrite_input)
+                usage["completion_tokens"] = estimate_tokens(search_query)
+                llm_span.set_attribute("prompt_tokens_est", usage["prompt_tokens"])
+                llm_span.set_attribute("completion_tokens_est", usage["completion_tokens"])
+        except Exception as e:
+            if not (should_fall_back(e) or isinstance(e, DeadlineExceeded)):
+                raise
+            # Retrieval still works with the question itself, and the rest of the budget is kept for the answer
+            logger.warning("Query rewrite failed; searching with the question", extra={"fields": {"error": type(e).__name__}})
+            return {"search_query": question}
+        if ROUTER_ENABLED:
+            get_router().record_stage("transform_query", time.perf_counter() - start)
 
         # Update the state
         return {"search_query": search_query}
 
+    @traced_node("retrieve_from_vector_store")
     def retrieve_from_vector_store(state: GraphState) -> GraphState:
         """
         Retrieve relevant documents from the vector store.
@@ -67,29 +228,53 @@ def create_rag_graph():
         # Get the search query
         search_query = state["search_query"]
 
-        # Retrieve documents from the vector store
-        documents = vector_store.similarity_search(search_query)
+        # Retrieve documents from the vector store, with scores for the web search decision
+        results = vector_store.similarity_search_with_relevance(search_query, filters=state.get("filters"))
+        documents = [document for document, _ in results]
+        top_relevance = max((score for _, score in results), default=None)
 
         # Update the state
-        return {"context": documents}
+        return {"context": documents, "top_relevance": top_relevance}
 
+    @traced_node("retrieve_from_web")
     def retrieve_from_web(state: GraphState) -> GraphState:
         """
         Retrieve relevant documents from the web.
         """
         # Check if web search is enabled
         if not state.get("web_search_enabled", False):
-            return {"context": []}
+            return {"web_context": []}
+        metadata_filter = state.get("filters")
+        if metadata_filter is not None and metadata_filter.origin == "local":
+            return {"web_context": []}
 
         # Get the search query
         search_query = state["search_query"]
 
-        # Retrieve documents from the web
-        documents = web_retriever.retrieve_from_web(search_query)
+        # Retrieve documents from the web, giving up on them rather than delaying the answer
+        start = time.perf_counter()
+        caller = get_caller("web", max_attempts=1, hedge=False)
+        try:
+            documents = caller.call(
+                lambda: get_web_retriever().retrieve_from_web(search_query, vector_store=vector_store, sources=source_registry),
+                timeout=stage_budget(state.get("deadline"), "retrieve_from_web"),
+            )
+        except Exception as e:
+            if not (should_fall_back(e) or isinstance(e, DeadlineExceeded)):
+                raise
+            logger.warning("Web search failed; answering from the index", extra={"fields": {"error": type(e).__name__}})
+            return {"web_context": []}
+        if ROUTER_ENABLED:
+            get_router().record_stage("retrieve_from_web", time.perf_counter() - start)
+        if metadata_filter is not None:
+            # Indexed chunks served for local sources keep their own metadata
+            annotate([document for document in documents if not vector_store.contains(document)], origin="web")
+            documents = [document for document in documents if metadata_filter.matches(document.metadata)]
 
         # Update the state
-        return {"context": documents}
+        return {"web_context": documents}
 
+    @traced_node("combine_context")
     def combine_context(state: GraphState) -> GraphState:
         """
         Combine context from different sources.
@@ -98,12 +283,13 @@ def create_rag_graph():
         vector_store_context = state.get("context", [])
         web_context = state.get("web_context", [])
 
-        # Combine the context
-        combined_context = vector_store_context + web_context
+        # Combine the context, without the indexed chunks that local sources served again
+        combined_context = merge_context(vector_store_context, web_context)
 
         # Update the state
         return {"context": combined_context}
 
+    @traced_node("generate_answer")
     def generate_answer(state: GraphState) -> GraphState:
         """
         Generate an answer based on the context.
@@ -113,29 +299,91 @@ def create_rag_graph():
         context = state.get("context", [])
 
         # Format the context
-        context_text = "\n\n".join([doc.page_content for doc in context])
-
-        # Generate the answer
-        chain = rag_prompt | llm
-        response = chain.invoke({
-            "context": context_text,
-            "question": question,
-        })
-        answer = response.content
+        context_text = format_context(context)
+
+        # The static prefix is pre-rendered, and cached by the provider when possible
+        messages = render_rag_messages(context_text, question, state.get("history", ""), prompt_prefix)
+        suffix = messages[-1].content
+
+        def generate_with(tier: str) -> str:
+            with span("llm.invoke", purpose="generate_answer", tier=tier) as llm_span, \
+                    cascade.measure(tier, "generate_answer") as usage:
+                cache = context_caches.get(tier)
+                prefix_cached = []
+
+                def invoke() -> str:
+                    answer = cache.generate(suffix) if cache is not None else None
+                    if answer is not None:
+                        prefix_cached.append(True)
+                        return answer
+                    record_uncached_prompt(prompt_prefix, suffix)
+                    return cascade.llm(tier).invoke(messages).content
+
+                answer = get_caller(f"llm.{cascade.model_name(tier)}").call(
+                    invoke, timeout=stage_budget(state.get("deadline"), "generate_answer")
+                )
+                llm_span.set_attribute("prefix_cached", bool(prefix_cached))
+                usage["prompt_tokens"] = estimate_tokens(prompt_prefix) + estimate_tokens(suffix)
+                usage["completion_tokens"] = estimate_tokens(answer)
+                llm_span.set_attribute("context_chunks", len(context))
+                llm_span.set_attribute("prompt_chars", len(context_text) + len(question))
+                llm_span.set_attribute("prompt_tokens_est", estimate_tokens(context_text) + estimate_tokens(question))
+                llm_span.set_attribute("completion_tokens_est", usage["completion_tokens"])
+            return answer
+
+        # Start with the fast tier for short questions with well-matched context, escalating if it is unsure
+        simple = state.get("route_reason") != "long" and len(question.split()) <= ROUTER_MAX_QUERY_WORDS
+        answer, tier, escalation_reason = cascade.generate(generate_with, state.get("top_relevance"), simple)
 
         # Update the state
-        return {"answer": answer}
+        return {"answer": answer, "answer_tier": tier, "escalation_reason": escalation_reason}
+
+    def should_rewrite(state: GraphState) -> str:
+        """
+        Follow the router's rewrite decision.
+        """
+        if state.get("context_reused"):
+            return "reuse_context"
+        return "rewrite" if state.get("route_rewrite", True) else "skip_rewrite"
 
     def should_search_web(state: GraphState) -> str:
         """
-        Determine if web search should be performed.
+        Determine if web search should be performed, and record the route taken.
+
+        Web search is skipped when it is disabled, or when the question is
+        about the indexed documents and the vector store is confident.
         """
-        return "search_web" if state.get("web_search_enabled", False) else "skip_web_search"
+        requested = state.get("web_search_enabled", False)
+        confident = ROUTER_ENABLED and get_router().skip_web(
+            RouteDecision(
+                rewrite=state.get("route_rewrite", True),
+                in_domain=state.get("route_in_domain", False),
+                reason=state.get("route_reason", ""),
+            ),
+            state.get("top_relevance"),
+        )
+        search_web = requested and not confident
+
+        if ROUTER_ENABLED:
+            rewrite = state.get("route_rewrite", True)
+            skipped = ([] if rewrite else ["transform_query"]) + (["retrieve_from_web"] if requested and confident else [])
+            route_name = f"{'rewrite' if rewrite else 'direct'}+{'web' if search_web else 'index'}"
+            saved = get_router().record_route(route_name, skipped)
+            logger.info("Routed question", extra={"fields": {
+                "route": route_name,
+                "reason": state.get("route_reason"),
+                "top_relevance": round(state["top_relevance"], 3) if state.get("top_relevance") is not None else None,
+                "skipped": skipped,
+                "saved_ms": round(saved * 1000, 1),
+            }})
+
+        return "search_web" if search_web else "skip_web_search"
 
     # Create the graph
     workflow = StateGraph(GraphState)
 
     # Add nodes
+    workflow.add_node("route", route)
     workflow.add_node("transform_query", transform_query)
     workflow.add_node("retrieve_from_vector_store", retrieve_from_vector_store)
     workflow.add_node("retrieve_from_web", retrieve_from_web)
@@ -143,6 +391,15 @@ def create_rag_graph():
     workflow.add_node("generate_answer", generate_answer)
 
     # Add edges
+    workflow.add_conditional_edges(
+        "route",
+        should_rewrite,
+        {
+            "rewrite": "transform_query",
+            "skip_rewrite": "retrieve_from_vector_store",
+            "reuse_context": "generate_answer",
+        }
+    )
     workflow.add_edge("transform_query", "retrieve_from_vector_store")
     workflow.add_conditional_edges(
         "retrieve_from_vector_store",
@@ -157,30 +414,105 @@ def create_rag_graph():
     workflow.add_edge("generate_answer", END)
 
     # Set the entry point
-    workflow.set_entry_point("transform_query")
+    workflow.set_entry_point("route")
 
     # Compile the graph
     return workflow.compile()
 
 
-def run_rag_graph(question: str, web_search_enabled: bool = True) -> str:
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_rag_graph():
+    """
+    Get the process-wide compiled RAG graph, creating it on first use.
+
+    The graph holds no per-request state, so one instance (with its LLM
+    client, vector store and web retriever) serves every request.
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = create_rag_graph()
+    return _graph
+
+
+def run_rag_graph(
+    question: str,
+    web_search_enabled: bool = True,
+    timeout: Optional[float] = REQUEST_DEADLINE,
+    session_id: Optional[str] = None,
+    persona: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> str:
     """
     Run the RAG graph.
 
     Args:
         question: The user's question.
         web_search_enabled: Whether to enable web search.
+        timeout: Seconds to answer in, split across the graph stages. None means no limit.
+        session_id: The conversation the question belongs to. If None, the question stands alone.
+        persona: The assistant to answer as. If None, uses the default persona.
+        filters: Conditions on the metadata of the context to use (see metadata_index.MetadataFilter).
 
     Returns:
         The answer.
+
+    Raises:
+        ValueError: If the filters are invalid.
+        UnknownPersona: If the persona is not configured.
+        DeadlineExceeded: If no answer could be generated in time.
+        CircuitOpenError: If the language model is unavailable.
     """
-    # Create the graph
-    graph = create_rag_graph()
+    metadata_filter = MetadataFilter.from_dict(filters)
+    if persona is None or persona == "default":
+        graph, vector_store = get_rag_graph(), get_shared_vector_store()
+    else:
+        from namespaces import get_namespaces
+        namespace = get_namespaces().get(persona)
+        graph, vector_store = namespace.graph, namespace.vector_store
+        # Sessions are per persona, so one ID cannot carry history or context across assistants
+        if session_id is not None:
+            session_id = f"{persona}/{session_id}"
 
     # Run the graph
-    result = graph.invoke({
-        "question": question,
-        "web_search_enabled": web_search_enabled,
-    })
+    with span("rag_graph.run", web_search_enabled=web_search_enabled, session=session_id is not None, persona=persona or "default") as root_span:
+        state = {
+            "question": question,
+            "web_search_enabled": web_search_enabled,
+            "deadline": time.monotonic() + timeout if timeout is not None else None,
+            "trace_id": root_span.trace_id,
+            "request_id": get_request_id(),
+            "filters": metadata_filter,
+        }
+
+        session = None
+        if session_id is not None:
+            store = get_session_store()
+            session = store.get(session_id)
+            state["history"] = session.relevant_history(question)
+            # The previous turn's context was retrieved without this question's filters
+            reused_context, top_relevance = session.reusable_context(question, vector_store) if metadata_filter is None else ([], None)
+            if reused_context:
+                state.update(context=reused_context, top_relevance=top_relevance, context_reused=True)
+            root_span.set_attribute("context_reused", bool(reused_context))
+
+        result = graph.invoke(state)
+
+        if session is not None:
+            # Recorded on the latest version of the session, which concurrent requests may have changed
+            store.update(session_id, lambda latest: latest.add_turn(
+                question,
+                result["answer"],
+                result.get("search_query") or question,
+                result.get("context", []),
+                result.get("top_relevance"),
+                vector_store,
+                reused=bool(reused_context),
+            ))
+            session_turns.inc(1, "reused" if reused_context else "retrieved")
 
     return result["answer"]
@@ -0,0 +1,344 @@
+"""
+Deadline-aware, resilient calls to upstream services.
+
+Every question gets a deadline, which is split across the graph stages
+that call out (query rewrite, web search, answer generation) so an early
+stage cannot use up the whole budget. Calls are retried on transient errors
+with jittered exponential backoff, and can be hedged: if a call is still
+running after the p95 latency of recent calls, a duplicate is started and
+whichever finishes first wins. A circuit breaker per upstream fails calls
+fast while the upstream is unhealthy, instead of letting requests pile up.
+
+Calls run on a shared thread pool. A hedged loser that has not started is
+cancelled; one already running cannot be interrupted, so its result is
+discarded when it finishes.
+"""
+from typing import Callable, Dict, Optional, TypeVar
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import contextvars
+import random
+import threading
+import time
+
+from config import (
+    LLM_MAX_ATTEMPTS,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_CALL_WORKERS,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+)
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+call_attempts = registry.counter("upstream_attempts_total", "Upstream call attempts", labels=("upstream", "outcome"))
+hedged_calls = registry.counter("upstream_hedges_total", "Hedged duplicate calls, by which copy won", labels=("upstream", "winner"))
+circuit_state = registry.gauge("upstream_circuit_open", "Whether an upstream's circuit breaker is open (1) or closed (0)", labels=("upstream",))
+
+# Relative share of the remaining deadline for each stage that calls out, in pipeline order
+STAGE_WEIGHTS = {
+    "transform_query": 1.0,
+    "retrieve_from_web": 2.0,
+    "generate_answer": 4.0,
+}
+
+# Upstream exceptions (google.api_core and requests) that are worth retrying
+TRANSIENT_ERROR_NAMES = {
+    "Aborted",
+    "DeadlineExceeded",
+    "GatewayTimeout",
+    "InternalServerError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "TooManyRequests",
+    "ConnectTimeout",
+    "ReadTimeout",
+}
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+# requests' connection errors and timeouts, with their subclasses (which do not derive from the builtin ones)
+TRANSIENT_ERROR_BASES = {
+    "requests.exceptions.ConnectionError",
+    "requests.exceptions.Timeout",
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request's time budget runs out.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling the upstream while its circuit breaker is open.
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable; retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether an error is likely to go away on retry.
+    """
+    # Our own DeadlineExceeded shares its name with google.api_core's, but the budget is spent, so retrying cannot help
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if type(error).__name__ in TRANSIENT_ERROR_NAMES:
+        return True
+    if any(f"{cls.__module__}.{cls.__qualname__}" in TRANSIENT_ERROR_BASES for cls in type(error).__mro__):
+        return True
+    return getattr(error, "code", None) in TRANSIENT_STATUS_CODES
+
+
+def should_fall_back(error: BaseException) -> bool:
+    """
+    Whether a failed call may be served another way (another model, or without the call).
+    """
+    return isinstance(error, CircuitOpenError) or is_transient(error)
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """
+    Seconds left until a time.monotonic() deadline, or None if there is none.
+    """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def stage_budget(deadline: Optional[float], stage: str) -> Optional[float]:
+    """
+    Time budget for a stage: its share of the remaining deadline, weighed
+    against the stages still to come.
+    """
+    left = remaining(deadline)
+    if left is None:
+        return None
+    stages = list(STAGE_WEIGHTS)
+    later = stages[stages.index(stage):]
+    return left * STAGE_WEIGHTS[stage] / sum(STAGE_WEIGHTS[name] for name in later)
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive failures, then lets one probe call through once the reset timeout has passed.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: If calls are currently failing fast.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout or self._probing:
+                raise CircuitOpenError(self.name, max(1.0, self.reset_timeout - waited))
+            # Half open: this call probes whether the upstream has recovered
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Circuit closed", extra={"fields": {"upstream": self.name}})
+                circuit_state.set(0, self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    logger.warning("Circuit opened", extra={"fields": {"upstream": self.name, "failures": self.failures}})
+                    circuit_state.set(1, self.name)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyWindow:
+    """
+    Latencies of recent successful calls, for the hedging delay.
+    """
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES) -> Optional[float]:
+        """
+        The q-quantile of recent latencies, or None until enough calls have been seen.
+        """
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_CALL_WORKERS, thread_name_prefix="upstream-call")
+    return _executor
+
+
+class ResilientCaller:
+    """
+    Calls one upstream with a deadline, retries, hedging and a circuit breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        hedge: bool = LLM_HEDGE_ENABLED,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """
+        Initialize the caller.
+
+        Args:
+            name: Name of the upstream, for metrics and logs.
+            max_attempts: Attempts per call, including the first.
+            hedge: Whether to start a duplicate call after the p95 latency. Only for idempotent calls.
+            breaker: The circuit breaker to use. If None, the upstream gets its own.
+        """
+        self.name = name
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latencies = LatencyWindow()
+
+    def _submit(self, fn: Callable[[], T]) -> Future:
+        # Each copy runs in the caller's context, so spans and log records stay attached to the request
+        return _get_executor().submit(contextvars.copy_context().run, fn)
+
+    def _attempt(self, fn: Callable[[], T], deadline: Optional[float]) -> T:
+        start = time.monotonic()
+        primary = self._submit(fn)
+        pending = {primary}
+
+        hedge_delay = self.latencies.percentile(0.95) if self.hedge else None
+        left = remaining(deadline)
+        if hedge_delay is not None and (left is None or hedge_delay < left):
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done:
+                pending.add(self._submit(fn))
+
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise DeadlineExceeded(f"{self.name} did not respond within the request deadline")
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is not primary or pending:
+                        hedged_calls.inc(1, self.name, "primary" if future is primary else "hedge")
+                    self.latencies.record(time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Call fn, retrying transient errors within the time budget.
+
+        Args:
+            fn: The call to make. It may run more than once, concurrently when hedged.
+            timeout: Seconds the call may take in total, including retries. None means no limit.
+
+        Raises:
+            DeadlineExceeded: If the budget ran out.
+            CircuitOpenError: If the upstream's circuit breaker is open.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.allow()
+            try:
+                result = self._attempt(fn, deadline)
+            except DeadlineExceeded:
+                call_attempts.inc(1, self.name, "timeout")
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    # The upstream answered, so it is healthy even though the call failed
+                    call_attempts.inc(1, self.name, "error")
+                    self.breaker.record_success()
+                    raise
+                call_attempts.inc(1, self.name, "transient_error")
+                self.breaker.record_failure()
+
+                # Full jitter, so clients retrying after a shared failure spread out
+                delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                left = remaining(deadline)
+                if attempt >= self.max_attempts or (left is not None and delay >= left):
+                    raise
+                logger.warning("Retrying upstream call", extra={"fields": {
+                    "upstream": self.name, "attempt": attempt, "delay_ms": round(delay * 1000), "error": type(e).__name__,
+                }})
+                time.sleep(delay)
+                continue
+
+            call_attempts.inc(1, self.name, "success")
+            self.breaker.record_success()
+            return result
+
+
+_callers: Dict[str, ResilientCaller] = {}
+_callers_lock = threading.Lock()
+
+
+def get_caller(name: str, **options) -> ResilientCaller:
+    """
+    Get the process-wide caller for an upstream, so its breaker and latency history are shared.
+
+    Args:
+        name: Name of the upstream.
+        options: ResilientCaller arguments, used when the caller is first created.
+    """
+    with _callers_lock:
+        if name not in _callers:
+            _callers[name] = ResilientCaller(name, **options)
+        return _callers[name]
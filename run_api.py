@@ -1,7 +1,10 @@
 """
-Script to run the FastAPI server for Badar Abbas's personal assistant.
+Script to run the FastAPI server for Ali Haider's personal assistant.
+
+Checks the environment, then starts the production launcher (serve.py) and
+accepts the same options, e.g. --workers. For development with automatic
+reloading, run `uvicorn api:app --reload` instead.
 """
-import uvicorn
 import os
 import sys
 from dotenv import load_dotenv
@@ -19,23 +22,11 @@ def check_environment():
         print("Please set it in a .env file or as an environment variable.")
         return False
 
-    # Check the LLM configuration
-    try:
-        from llm import get_llm
-        llm = get_llm()
-        print(f"Using LLM model: {llm.model}")
-
-        # Verify that we're using Gemini Flash 1.5
-        if "flash" not in llm.model:
-            print(f"Warning: You are using {llm.model}, but Gemini Flash 1.5 is recommended.")
-            print("Updating LLM configuration to use Gemini Flash 1.5...")
-
-            # Update the llm.py file to use Gemini Flash 1.5
-            from llm import get_llm
-            llm = get_llm(model_name="gemini-1.5-flash")
-            print(f"Updated LLM model to: {llm.model}")
-    except Exception as e:
-        print(f"Warning: Could not check LLM configuration: {e}")
+    # Report the configured model tiers; clients are created when the server starts
+    from config import LLM_FAST_MODEL, LLM_STRONG_MODEL, LLM_CASCADE_ENABLED
+    print(f"Using LLM model: {LLM_FAST_MODEL}")
+    if LLM_CASCADE_ENABLED and LLM_STRONG_MODEL != LLM_FAST_MODEL:
+        print(f"Escalating uncertain or poorly grounded answers to: {LLM_STRONG_MODEL}")
 
     # Check if the data directory exists
     data_dir = os.path.join(os.path.dirname(__file__), "data")
@@ -60,17 +51,10 @@ if __name__ == "__main__":
         sys.exit(1)
 
     print("=" * 70)
-    print("Starting Badar Abbas's Personal Assistant...")
-    print("=" * 70)
-    print("Web Interface: http://localhost:8000/")
-    print("API Documentation: http://localhost:8000/docs")
+    print("Starting Ali Haider's Personal Assistant...")
     print("=" * 70)
+    print("Web interface: / (API documentation: /docs)")
     print("Press Ctrl+C to stop the server")
 
-    try:
-        uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
-    except Exception as e:
-        import traceback
-        print(f"Error starting server: {e}")
-        print(traceback.format_exc())
-        sys.exit(1)
+    from serve import main
+    sys.exit(main())
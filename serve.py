@@ -0,0 +1,246 @@
+"""
+Production server: pre-forked uvicorn workers sharing one listening socket.
+
+The application, the vector index and the LLM clients are loaded once in
+this (master) process before forking, so every worker shares those pages
+copy-on-write instead of loading its own copy. No network connection is
+opened before the fork: if the index has to be built first, a short-lived
+subprocess builds it, so the master never calls the embeddings API. Each worker then warms its own text-to-speech
+engines and reports ready on /ready.
+
+Usage:
+    python serve.py --workers 4
+"""
+from typing import Dict
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+from config import (
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    SERVER_KEEP_ALIVE,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_BACKLOG,
+)
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def build_index() -> None:
+    """
+    Build the vector index in a short-lived subprocess if no process has yet.
+
+    Building embeds every chunk through the embeddings API; its clients and
+    connections then end with the subprocess instead of being inherited by
+    the workers.
+
+    Raises:
+        RuntimeError: If the index could not be built.
+    """
+    from vector_store import get_shared_vector_store
+    from warmup import warm_up, file_lock
+
+    vector_store = get_shared_vector_store()
+    if vector_store.vector_store is not None:
+        return
+
+    with file_lock(warm_up.lock_path):
+        # Another process may have built the index while we waited for the lock
+        vector_store.reload()
+        if vector_store.vector_store is not None:
+            return
+        logger.info("Building the vector index in a subprocess")
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "initialize_assistant.py")
+        if subprocess.run([sys.executable, script]).returncode != 0:
+            raise RuntimeError("Failed to build the vector index")
+        vector_store.reload()
+
+
+def preload():
+    """
+    Import the application and load the state the workers will share.
+
+    Returns:
+        The ASGI application.
+    """
+    start = time.perf_counter()
+
+    from api import app
+    from warmup import warm_up
+
+    # Build the index once for all workers if needed, then load it and build the graph
+    build_index()
+    warm_up.prepare_index()
+
+    logger.info("Preloaded application", extra={"fields": {
+        "index_size": warm_up.index_size,
+        "elapsed_s": round(time.perf_counter() - start, 3),
+    }})
+    return app
+
+
+class Supervisor:
+    """
+    Fork the workers, restart any that die, and stop them gracefully.
+    """
+
+    def __init__(self, config: uvicorn.Config, workers: int, graceful_timeout: int):
+        """
+        Initialize the supervisor.
+
+        Args:
+            config: uvicorn configuration shared by the workers.
+            workers: Number of worker processes.
+            graceful_timeout: Seconds workers get to finish in-flight requests on shutdown.
+        """
+        self.config = config
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children: Dict[int, int] = {}  # pid -> worker index
+        self.should_exit = False
+        self.socket = None
+
+    def _spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Worker: uvicorn installs its own SIGINT/SIGTERM handlers for graceful shutdown.
+            # Leave the terminal's process group so Ctrl+C reaches only the supervisor,
+            # which then stops each worker exactly once.
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                uvicorn.Server(self.config).run(sockets=[self.socket])
+            except BaseException:
+                logger.exception("Worker crashed", extra={"fields": {"worker": index}})
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.children[pid] = index
+        logger.info("Started worker", extra={"fields": {"worker": index, "pid": pid}})
+
+    def _handle_exit(self, signum, frame) -> None:
+        self.should_exit = True
+
+    def run(self) -> None:
+        """
+        Serve until SIGINT or SIGTERM.
+        """
+        self.socket = self.config.bind_socket()
+        signal.signal(signal.SIGINT, self._handle_exit)
+        signal.signal(signal.SIGTERM, self._handle_exit)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self.should_exit:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = 0, 0
+            if pid and pid in self.children and not self.should_exit:
+                index = self.children.pop(pid)
+                logger.warning("Worker exited; restarting", extra={"fields": {
+                    "worker": index, "pid": pid, "status": status,
+                }})
+                time.sleep(1)  # Avoid a tight restart loop if workers crash on startup
+                self._spawn(index)
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """
+        Ask every worker to finish in-flight requests, then kill any that do not.
+        """
+        logger.info("Shutting down workers", extra={"fields": {"workers": len(self.children)}})
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in self.children:
+            logger.warning("Killing worker that did not stop in time", extra={"fields": {"pid": pid}})
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.children.clear()
+        self.socket.close()
+
+
+def serve(
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    workers: int = SERVER_WORKERS,
+    keep_alive: int = SERVER_KEEP_ALIVE,
+    graceful_timeout: int = SERVER_GRACEFUL_TIMEOUT,
+) -> None:
+    """
+    Preload the application and serve it with forked workers.
+
+    Args:
+        host: Interface to bind.
+        port: Port to bind.
+        workers: Number of worker processes.
+        keep_alive: Seconds to keep idle HTTP connections open.
+        graceful_timeout: Seconds workers get to finish in-flight requests on shutdown.
+    """
+    app = preload()
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=keep_alive,
+        timeout_graceful_shutdown=graceful_timeout,
+        proxy_headers=True,
+        access_log=False,
+    )
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        uvicorn.Server(config).run()
+        return
+
+    logger.info("Starting server", extra={"fields": {"host": host, "port": port, "workers": workers}})
+    Supervisor(config, workers, graceful_timeout).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the assistant API with multiple worker processes")
+    parser.add_argument("--host", default=SERVER_HOST, help="Interface to bind")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to bind")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Number of worker processes")
+    parser.add_argument("--keep-alive", type=int, default=SERVER_KEEP_ALIVE, help="Idle HTTP keep-alive timeout in seconds")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_TIMEOUT,
+                        help="Seconds to finish in-flight requests on shutdown")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.keep_alive, args.graceful_timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Conversation sessions.
+
+A session keeps a bounded chat history: the most recent turns verbatim
+and older turns folded into a short extractive summary (no LLM call). For
+each new question only the history relevant to it is put in the prompt,
+within a token budget. When a follow-up stays on the previous turn's topic,
+the chunks retrieved for that turn are reused, and the rewrite and
+retrieval are skipped.
+
+Sessions are stored compressed in SQLite and expire after a period of
+inactivity. The database file is shared by every worker process, so a
+conversation can continue on any worker. Each row carries a version, and a
+turn is recorded with compare-and-swap on it, so concurrent requests in
+one session (on any workers) do not overwrite each other's turns.
+"""
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from langchain.schema.document import Document
+
+from config import (
+    SESSION_STORE_PATH,
+    SESSION_TTL,
+    SESSION_MAX_TURNS,
+    SESSION_SUMMARY_TOKENS,
+    SESSION_HISTORY_TOKENS,
+    SESSION_TOPIC_OVERLAP,
+    SESSION_MAX_WEB_CHUNKS,
+)
+from query_router import ANAPHORA, WORD_PATTERN, content_words
+from vector_store import VectorStore, chunk_key
+from telemetry import registry, estimate_tokens
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+session_turns = registry.counter("session_turns_total", "Questions asked within a session", labels=("context",))
+history_tokens = registry.histogram(
+    "session_history_tokens", "Estimated tokens of history included in the prompt",
+    buckets=(0, 50, 100, 200, 400, 800, 1600),
+)
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+# Longest answer kept in a session
+MAX_ANSWER_CHARS = 2000
+
+# Attempts at recording a turn while other requests keep updating the same session
+MAX_UPDATE_ATTEMPTS = 5
+
+
+def valid_session_id(session_id: str) -> bool:
+    """
+    Whether a client-chosen session ID is acceptable (16-64 URL-safe characters, e.g. a UUID).
+    """
+    return bool(SESSION_ID_PATTERN.match(session_id))
+
+
+def _first_sentence(text: str, max_chars: int = 200) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+@dataclass
+class Turn:
+    """
+    One question and its answer.
+    """
+    question: str
+    answer: str
+
+
+@dataclass
+class Session:
+    """
+    The state of one conversation.
+    """
+    turns: List[Turn] = field(default_factory=list)
+    summary: List[str] = field(default_factory=list)
+    # The previous turn's topic and retrieved context, for follow-ups
+    topic_words: List[str] = field(default_factory=list)
+    chunk_keys: List[str] = field(default_factory=list)
+    web_chunks: List[Dict[str, Any]] = field(default_factory=list)
+    top_relevance: Optional[float] = None
+    # Version of the stored row this session was read from; not stored in the data itself
+    version: int = 0
+
+    def is_follow_up(self, question: str) -> bool:
+        """
+        Whether a question stays on the previous turn's topic.
+        """
+        if not self.topic_words or not (self.chunk_keys or self.web_chunks):
+            return False
+        topic = set(self.topic_words)
+        words = [word for word in content_words(question) if word not in ANAPHORA]
+        new = [word for word in words if word not in topic]
+        if words and len(words) - len(new) >= SESSION_TOPIC_OVERLAP * len(words):
+            return True
+        # "What else has he built?": refers back, and brings in no new names
+        refers_back = bool({word.lower() for word in WORD_PATTERN.findall(question)} & ANAPHORA)
+        introduces_names = any(word[0].isupper() and word.lower() in new for word in WORD_PATTERN.findall(question)[1:])
+        return refers_back and not introduces_names and len(new) <= 2
+
+    def reusable_context(self, question: str, vector_store: VectorStore) -> Tuple[List[Document], Optional[float]]:
+        """
+        The previous turn's context and its top relevance, if the question is a follow-up to it.
+        """
+        if not self.is_follow_up(question):
+            return [], None
+        documents = vector_store.get_chunks(self.chunk_keys)
+        documents += [Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in self.web_chunks]
+        return documents, self.top_relevance
+
+    def relevant_history(self, question: str, budget: int = SESSION_HISTORY_TOKENS) -> str:
+        """
+        The history worth including in the prompt for a question, within a token budget.
+
+        The latest turn comes first (it is what a follow-up most likely refers
+        to), then earlier turns that share words with the question, then the
+        summary of older turns. The result is in chronological order.
+        """
+        if not self.turns and not self.summary:
+            return ""
+        words = set(content_words(question))
+        latest = len(self.turns) - 1
+
+        def score(index: int) -> float:
+            turn = self.turns[index]
+            overlap = len(words & set(content_words(turn.question + " " + turn.answer)))
+            return (float("inf") if index == latest else overlap, index)
+
+        chosen: Set[int] = set()
+        used = 0
+        for index in sorted(range(len(self.turns)), key=score, reverse=True):
+            if index != latest and score(index)[0] == 0:
+                break
+            turn = self.turns[index]
+            tokens = estimate_tokens(turn.question) + estimate_tokens(turn.answer) + 4
+            if used + tokens > budget:
+                continue
+            chosen.add(index)
+            used += tokens
+
+        summary: List[str] = []
+        for line in reversed(self.summary):
+            tokens = estimate_tokens(line) + 1
+            if used + tokens > budget:
+                break
+            summary.insert(0, line)
+            used += tokens
+
+        lines = [f"Earlier: {line}" for line in summary]
+        for index in sorted(chosen):
+            lines.append(f"User: {self.turns[index].question}")
+            lines.append(f"Assistant: {self.turns[index].answer}")
+        history_tokens.observe(used)
+        return "\n".join(lines)
+
+    def add_turn(
+        self,
+        question: str,
+        answer: str,
+        search_query: str,
+        context: List[Document],
+        top_relevance: Optional[float],
+        vector_store: VectorStore,
+        reused: bool,
+    ) -> None:
+        """
+        Record a turn, folding the oldest turns into the summary to stay bounded.
+        """
+        self.turns.append(Turn(question=question, answer=answer[:MAX_ANSWER_CHARS]))
+        while len(self.turns) > SESSION_MAX_TURNS:
+            oldest = self.turns.pop(0)
+            self.summary.append(f"Asked \"{_first_sentence(oldest.question)}\"; answered: {_first_sentence(oldest.answer)}")
+        while self.summary and sum(estimate_tokens(line) for line in self.summary) > SESSION_SUMMARY_TOKENS:
+            self.summary.pop(0)
+
+        if reused:
+            # Same topic and context; widen the topic with the new question's words
+            self.topic_words = sorted(set(self.topic_words) | set(content_words(question)))
+            return
+        topic = set(content_words(question + " " + search_query))
+        topic |= {word.lower() for word in WORD_PATTERN.findall(answer) if word[0].isupper()}
+        self.topic_words = sorted(topic - ANAPHORA)
+        # Indexed chunks are kept by key; web chunks are not in the index, so their text is kept
+        self.chunk_keys = [chunk_key(document) for document in context if vector_store.contains(document)]
+        self.web_chunks = [
+            {"text": document.page_content, "metadata": document.metadata}
+            for document in context if not vector_store.contains(document)
+        ][:SESSION_MAX_WEB_CHUNKS]
+        self.top_relevance = top_relevance
+
+    def to_bytes(self) -> bytes:
+        fields = asdict(self)
+        del fields["version"]
+        return zlib.compress(json.dumps(fields, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, version: int = 0) -> "Session":
+        fields = json.loads(zlib.decompress(data).decode("utf-8"))
+        fields["turns"] = [Turn(**turn) for turn in fields.get("turns", [])]
+        fields["version"] = version
+        return cls(**fields)
+
+
+class SessionConflict(Exception):
+    """
+    Raised when a session changed since it was read.
+    """
+
+
+class SessionStore:
+    """
+    Compressed sessions in SQLite, expiring after a period of inactivity.
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl: int = SESSION_TTL):
+        """
+        Initialize the store. The database is opened on first use, in each process.
+
+        Args:
+            path: The SQLite database file.
+            ttl: Seconds of inactivity after which a session expires.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not be shared with forked children, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data BLOB NOT NULL, version INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(sessions)")}
+            if "version" not in columns:
+                # A database from before versioning; another process may be adding the column too
+                try:
+                    connection.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError:
+                    pass
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, session_id: str) -> Session:
+        """
+        Get a session, or a new empty one if it does not exist or has expired.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data, version, expires_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return Session()
+        data, version, expires_at = row
+        if expires_at <= time.time():
+            # Replaces the expired row when saved
+            return Session(version=version)
+        try:
+            return Session.from_bytes(data, version)
+        except (ValueError, TypeError, zlib.error):
+            logger.warning("Discarding unreadable session")
+            return Session(version=version)
+
+    def save(self, session_id: str, session: Session) -> None:
+        """
+        Store a session, extending its expiry, if it is unchanged since it was read.
+
+        Raises:
+            SessionConflict: If another request saved the session in the meantime.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            if session.version == 0:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO sessions (id, expires_at, data, version) VALUES (?, ?, ?, 1)",
+                    (session_id, now + self.ttl, session.to_bytes()),
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE sessions SET expires_at = ?, data = ?, version = version + 1 WHERE id = ? AND version = ?",
+                    (now + self.ttl, session.to_bytes(), session_id, session.version),
+                )
+            if cursor.rowcount == 0:
+                raise SessionConflict(session_id)
+            session.version += 1
+            self._writes += 1
+            if self._writes % 100 == 0:
+                connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def update(self, session_id: str, change: Callable[[Session], None], attempts: int = MAX_UPDATE_ATTEMPTS) -> bool:
+        """
+        Apply a change to the latest version of a session and save it,
+        re-reading and re-applying it if another request saved in the meantime.
+
+        Args:
+            session_id: The session.
+            change: Modifies a session in place. It may be called more than once.
+            attempts: Attempts before giving up.
+
+        Returns:
+            Whether the change was saved.
+        """
+        for _ in range(attempts):
+            session = self.get(session_id)
+            change(session)
+            try:
+                self.save(session_id, session)
+                return True
+            except SessionConflict:
+                continue
+        logger.warning("Session kept changing; turn not recorded", extra={"fields": {"attempts": attempts}})
+        return False
+
+    def delete(self, session_id: str) -> None:
+        """
+        Forget a session.
+        """
+        with self._lock:
+            self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """
+    Get the process-wide session store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
@@ -0,0 +1,367 @@
+"""
+Vector index split across several FAISS shards.
+
+Chunks are assigned to shards by a hash of their content, or by their source
+file so each file lives in a single shard and can be re-indexed by
+rebuilding just that shard. A query is embedded once and searched on every
+shard in parallel threads (FAISS releases the GIL while searching); each
+shard returns its own top k, best first, and the lists are merged with a
+heap into the overall top k.
+
+Each shard is a plain index in its own subdirectory, so shards load, grow
+and are rebuilt independently. shards.json records the layout; changing the
+number of shards or the strategy means rebuilding the whole index.
+"""
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import shutil
+import threading
+
+from langchain.schema.document import Document
+
+from vector_store import VectorStore, chunk_key
+from config import (
+    VECTOR_STORE_PATH,
+    VECTOR_STORE_SHARDS,
+    VECTOR_STORE_SHARD_BY,
+    VECTOR_SEARCH_WORKERS,
+    VECTOR_INDEX_COMPRESSION,
+    TOP_K_RESULTS,
+)
+from telemetry import span
+from structured_logging import get_logger
+
+
+if TYPE_CHECKING:
+    from metadata_index import MetadataFilter
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+MANIFEST_FILE = "shards.json"
+SHARD_STRATEGIES = ("hash", "source")
+
+
+def is_sharded(persist_directory: str) -> bool:
+    """
+    Whether the index in a directory was built sharded.
+    """
+    return os.path.isfile(os.path.join(persist_directory, MANIFEST_FILE))
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=VECTOR_SEARCH_WORKERS, thread_name_prefix="vector-shard")
+    return _executor
+
+
+def _reset_executor_after_fork() -> None:
+    """
+    Threads do not survive fork: a forked worker starts its own shard executor.
+    """
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    A VectorStore whose chunks are partitioned across several FAISS indexes.
+    """
+
+    def __init__(
+        self,
+        persist_directory: Optional[str] = None,
+        num_shards: int = VECTOR_STORE_SHARDS,
+        shard_by: str = VECTOR_STORE_SHARD_BY,
+        compression: str = VECTOR_INDEX_COMPRESSION,
+    ):
+        """
+        Initialize the store, loading the shards that exist on disk.
+
+        Args:
+            persist_directory: Directory of the index. If None, uses the default.
+            num_shards: Number of shards, for a new index. An existing index keeps its own.
+            shard_by: "hash" or "source", for a new index. An existing index keeps its own.
+            compression: Storage of new shards (see VectorStore). Existing shards keep their own.
+        """
+        self.persist_directory = persist_directory or VECTOR_STORE_PATH
+        manifest_path = os.path.join(self.persist_directory, MANIFEST_FILE)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            num_shards, shard_by = manifest["shards"], manifest["shard_by"]
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy {shard_by!r}; expected one of {SHARD_STRATEGIES}")
+        self.num_shards = max(1, num_shards)
+        self.shard_by = shard_by
+        self.compression = compression
+        self._chunks_by_key: Optional[Dict[str, Document]] = None
+        self._chunks_by_file: Optional[Dict[str, List[Document]]] = None
+        self.shards = [
+            VectorStore(persist_directory=self._shard_directory(i), compression=compression) for i in range(self.num_shards)
+        ]
+        self.embedding_model = self.shards[0].embedding_model
+        self.query_embedding_model = self.shards[0].query_embedding_model
+
+    def _shard_directory(self, shard: int) -> str:
+        return os.path.join(self.persist_directory, f"shard-{shard:03d}")
+
+    def _write_manifest(self) -> None:
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(os.path.join(self.persist_directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"shards": self.num_shards, "shard_by": self.shard_by}, f)
+
+    def _map(self, fn: Callable[[Any], T], items: Optional[List[Any]] = None) -> List[T]:
+        # Runs fn on each item (by default, each shard) in parallel, in the caller's context so spans stay attached
+        items = self.shards if items is None else items
+        if len(items) == 1:
+            return [fn(items[0])]
+        futures = [_get_executor().submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    @property
+    def vector_store(self):
+        """
+        The loaded shard indexes, or None if no shard has an index yet.
+        """
+        loaded = [shard.vector_store for shard in self.shards if shard.vector_store is not None]
+        return loaded or None
+
+    def shard_for(self, document: Document) -> int:
+        """
+        The shard a chunk belongs to.
+        """
+        if self.shard_by == "source":
+            key = os.path.basename(document.metadata.get("source") or "")
+        else:
+            key = chunk_key(document)
+        return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % self.num_shards
+
+    def _partition(self, documents: List[Document]) -> Dict[int, List[Document]]:
+        partitions: Dict[int, List[Document]] = {}
+        for document in documents:
+            partitions.setdefault(self.shard_for(document), []).append(document)
+        return partitions
+
+    def add_documents(self, documents: List[Document]) -> None:
+        """
+        Add documents, each to its shard. Shards embed and persist their documents in parallel.
+
+        Args:
+            documents: List of documents to add.
+        """
+        if not documents:
+            logger.warning("No documents provided to add_documents.")
+            return
+
+        partitions = self._partition(documents)
+        self._write_manifest()
+        with span("vector_store.add_documents", shards=len(partitions), chunks=len(documents)):
+            self._map(lambda item: self.shards[item[0]].add_documents(item[1]), sorted(partitions.items()))
+        self._chunks_by_key = None
+        self._chunks_by_file = None
+
+    def rebuild_shard(self, shard: int, documents: List[Document]) -> None:
+        """
+        Replace the contents of one shard, leaving the others untouched.
+
+        Args:
+            shard: The shard to rebuild.
+            documents: Documents for the shard. Those that belong to other shards are skipped.
+        """
+        own = [document for document in documents if self.shard_for(document) == shard]
+        if len(own) < len(documents):
+            logger.warning("Skipping documents of other shards", extra={"fields": {
+                "shard": shard, "skipped": len(documents) - len(own),
+            }})
+        store = self.shards[shard]
+        store.clear_vector_store()
+        os.makedirs(store.persist_directory, exist_ok=True)
+        self._write_manifest()
+        store.add_documents(own)
+        self._chunks_by_key = None
+        self._chunks_by_file = None
+
+    def similarity_search_with_relevance_by_vector(
+        self,
+        embedding: List[float],
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Search every shard in parallel and merge their results into the overall top k.
+
+        Args:
+            embedding: The query embedding.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            (document, relevance) pairs, most relevant first.
+        """
+        k = k or TOP_K_RESULTS
+        loaded = [shard for shard in self.shards if shard.vector_store is not None]
+        if not loaded:
+            return []
+        with span("vector_store.sharded_search", k=k, shards=len(loaded)) as search_span:
+            per_shard = self._map(lambda shard: shard.similarity_search_with_relevance_by_vector(embedding, k=k, filters=filters), loaded)
+            # Each list is already sorted, so a k-way heap merge only looks at what it returns
+            results = list(itertools.islice(heapq.merge(*per_shard, key=lambda result: -result[1]), k))
+            search_span.set_attribute("chunks", len(results))
+        return results
+
+    def similarity_search_with_relevance(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Perform a similarity search, also returning relevance scores.
+
+        Args:
+            query: The query string.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            (document, relevance) pairs, relevance in [0, 1] with 1 the most relevant.
+        """
+        if self.vector_store is None:
+            return []
+        # Embedded once for every shard, with the model the shards' own searches use
+        return self.similarity_search_with_relevance_by_vector(self.embedding_model.embed_query(query), k=k, filters=filters)
+
+    def similarity_search(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Document]:
+        """
+        Perform a similarity search.
+
+        Args:
+            query: The query string.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            List of similar documents.
+        """
+        return [document for document, _ in self.similarity_search_with_relevance(query, k=k, filters=filters)]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Document]:
+        """
+        Perform a similarity search with a precomputed query embedding.
+
+        Args:
+            embedding: The query embedding.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            List of similar documents.
+        """
+        return [document for document, _ in self.similarity_search_with_relevance_by_vector(embedding, k=k, filters=filters)]
+
+    def size(self) -> int:
+        """
+        Number of chunks in the index, across shards.
+        """
+        return sum(shard.size() for shard in self.shards)
+
+    def shard_sizes(self) -> List[int]:
+        """
+        Number of chunks in each shard.
+        """
+        return [shard.size() for shard in self.shards]
+
+    def documents(self) -> List[Document]:
+        """
+        All documents in the index, shard by shard.
+        """
+        return [document for shard in self.shards for document in shard.documents()]
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated memory held by the loaded shards.
+        """
+        return sum(shard.memory_bytes() for shard in self.shards)
+
+    def index_bytes(self) -> int:
+        """
+        Memory held by the shards' vectors (or their compressed codes).
+        """
+        return sum(shard.index_bytes() for shard in self.shards)
+
+    def full_vectors(self):
+        """
+        Every indexed vector at full precision, shard by shard, as a numpy array.
+        """
+        import numpy as np
+        return np.concatenate([shard.full_vectors() for shard in self.shards if shard.vector_store is not None])
+
+    def persist_vector_store(self) -> None:
+        """
+        Persist every shard to disk.
+        """
+        self._write_manifest()
+        for shard in self.shards:
+            shard.persist_vector_store()
+
+    def load_vector_store(self):
+        """
+        Load every shard from disk.
+
+        Returns:
+            The loaded shard indexes, or None if there are none.
+        """
+        self.reload()
+        return self.vector_store
+
+    def reload(self) -> None:
+        """
+        Reload the shards from disk, e.g. after the index was rebuilt by another instance.
+        """
+        self._map(lambda shard: shard.reload())
+        self._chunks_by_key = None
+        self._chunks_by_file = None
+
+    def clear_vector_store(self) -> None:
+        """
+        Clear every shard and the layout.
+        """
+        for shard in self.shards:
+            shard.clear_vector_store()
+        try:
+            if os.path.exists(self.persist_directory):
+                shutil.rmtree(self.persist_directory)
+        except Exception:
+            logger.exception("Error clearing vector store")
+        self._chunks_by_key = None
+        self._chunks_by_file = None
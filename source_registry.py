@@ -0,0 +1,187 @@
+"""
+Registry of sources the assistant already has locally.
+
+Some of the subjects the assistant is asked about (its owner, their
+company) are covered by documents in data/, which are already chunked and
+embedded in the index. The registry, read from a JSON file, maps the names
+of those subjects and the URLs of their pages to the local documents, so a
+web search about them, or a search result linking to them, is served from
+the index instead of the network.
+
+Names and URL patterns are compiled once into Aho-Corasick automata, so
+matching a query or URL costs one pass over it however many patterns there
+are. The file is a list of sources:
+
+    [{"name": "...", "entities": ["..."], "urls": ["example.com/page"], "files": ["page.txt"]}]
+"""
+from typing import Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+from collections import deque
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+
+from langchain.schema.document import Document
+
+from config import SOURCE_REGISTRY_PATH
+from vector_store import VectorStore
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class AhoCorasick(Generic[T]):
+    """
+    Finds every occurrence of a set of patterns in a text in one pass.
+    """
+
+    def __init__(self, patterns: Dict[str, T]):
+        """
+        Compile the automaton.
+
+        Args:
+            patterns: Values keyed by pattern. Patterns are matched case-insensitively.
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state, the (pattern length, value) of every pattern ending there
+        self._output: List[List[Tuple[int, T]]] = [[]]
+
+        for pattern, value in patterns.items():
+            pattern = pattern.lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), value))
+
+        # Breadth first, so a state's failure link is final before its children's are set
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child].extend(self._output[self._fail[child]])
+
+    def __len__(self) -> int:
+        return len(self._goto) - 1
+
+    def find(self, text: str) -> Iterator[Tuple[int, int, T]]:
+        """
+        Yield (start, end, value) for every pattern occurrence in text, in order of end position.
+        """
+        state = 0
+        for end, char in enumerate(text.lower(), 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._output[state]:
+                yield end - length, end, value
+
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not after.isalnum()
+
+
+@dataclass
+class LocalSource:
+    """
+    A subject covered by local documents.
+    """
+    name: str
+    files: List[str]
+    entities: List[str] = field(default_factory=list)
+    urls: List[str] = field(default_factory=list)
+
+
+class SourceRegistry:
+    """
+    Matches queries and URLs to local sources, and serves their chunks from the index.
+    """
+
+    def __init__(self, sources: List[LocalSource]):
+        """
+        Initialize the registry and compile its matchers.
+
+        Args:
+            sources: The local sources.
+        """
+        self.sources = sources
+        self._entities: AhoCorasick[LocalSource] = AhoCorasick(
+            {entity: source for source in sources for entity in source.entities}
+        )
+        self._urls: AhoCorasick[LocalSource] = AhoCorasick(
+            {pattern: source for source in sources for pattern in source.urls}
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "SourceRegistry":
+        """
+        Load a registry from a JSON file. A missing file gives an empty registry.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return cls([])
+        sources = [LocalSource(**entry) for entry in entries]
+        logger.info("Loaded local sources", extra={"fields": {"path": path, "sources": len(sources)}})
+        return cls(sources)
+
+    def match_query(self, query: str) -> List[LocalSource]:
+        """
+        Sources whose names occur as whole words in a query, in order of first mention.
+        """
+        query = query.lower()
+        matched: List[LocalSource] = []
+        for start, end, source in self._entities.find(query):
+            if source not in matched and _is_word_boundary(query, start, end):
+                matched.append(source)
+        return matched
+
+    def match_url(self, url: str) -> Optional[LocalSource]:
+        """
+        The source whose URL pattern occurs in a URL, if any.
+        """
+        for _, _, source in self._urls.find(url):
+            return source
+        return None
+
+    def documents(self, sources: List[LocalSource], vector_store: VectorStore) -> List[Document]:
+        """
+        The indexed chunks of the given sources' files.
+        """
+        files = [name for source in sources for name in source.files]
+        return vector_store.get_chunks_from_files(files)
+
+
+_registries: Dict[str, SourceRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_source_registry(path: str = SOURCE_REGISTRY_PATH) -> SourceRegistry:
+    """
+    Get the registry loaded from a file, compiling it once per process.
+    """
+    path = os.path.abspath(path)
+    with _registries_lock:
+        if path not in _registries:
+            _registries[path] = SourceRegistry.from_file(path)
+        return _registries[path]
@@ -0,0 +1,418 @@
+"""
+Lightweight tracing and metrics for the RAG pipeline.
+
+Spans are recorded around graph nodes and external calls, aggregated into
+Prometheus-style metrics served at /metrics, and optionally exported as
+JSON lines to a file or as OpenTelemetry spans to a collector. When
+telemetry is disabled every entry point is a cheap no-op.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from config import TELEMETRY_ENABLED, TRACE_EXPORT_PATH, OTEL_EXPORTER_ENDPOINT
+from structured_logging import get_logger, request_context
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge with labels whose value can go up and down.
+    """
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with labels.
+    """
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            # Per-bucket counts followed by the running sum and count
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.labels, values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registry of all metrics exposed at /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, description: str, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, description, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, description: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, description, labels=labels)
+
+    def gauge(self, name: str, description: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, description, labels=labels)
+
+    def histogram(self, name: str, description: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, description, labels=labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+span_duration = registry.histogram(
+    "rag_span_duration_seconds", "Duration of graph nodes and external calls", labels=("span",)
+)
+span_errors = registry.counter(
+    "rag_span_errors_total", "Spans that ended with an exception", labels=("span",)
+)
+span_attributes = registry.counter(
+    "rag_span_attribute_total", "Sum of numeric span attributes (tokens, chunks, prompt sizes)", labels=("span", "attribute")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests", labels=("method", "path", "status")
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about four characters per token) that avoids a round trip to the API.
+    """
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class Span:
+    """
+    A timed operation within a trace.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    otel_span: Any = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    """
+    Span returned when telemetry is disabled.
+    """
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _FileExporter:
+    """
+    Append finished spans as JSON lines from a background thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start()
+
+    def start(self) -> None:
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            pass  # Drop spans rather than block the request path
+
+    def _run(self) -> None:
+        while True:
+            records = [self._queue.get()]
+            while not self._queue.empty() and len(records) < 500:
+                records.append(self._queue.get_nowait())
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+_file_exporter: Optional[_FileExporter] = _FileExporter(TRACE_EXPORT_PATH) if TELEMETRY_ENABLED and TRACE_EXPORT_PATH else None
+
+if _file_exporter is not None and hasattr(os, "register_at_fork"):
+    # The export thread does not survive fork; forked server workers start their own
+    os.register_at_fork(after_in_child=_file_exporter.start)
+
+_otel_tracer = None
+_otel_initialized = False
+
+
+def _get_otel_tracer():
+    """
+    Lazily configure an OpenTelemetry tracer if a collector endpoint is set
+    and the optional opentelemetry packages are installed.
+    """
+    global _otel_tracer, _otel_initialized
+    if _otel_initialized:
+        return _otel_tracer
+    _otel_initialized = True
+
+    if not OTEL_EXPORTER_ENDPOINT:
+        return None
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("OpenTelemetry export requested but opentelemetry-sdk/opentelemetry-exporter-otlp are not installed.")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "ali-haider-ai-assistant"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=OTEL_EXPORTER_ENDPOINT)))
+    _otel_tracer = provider.get_tracer(__name__)
+    return _otel_tracer
+
+
+class _SpanContext:
+    """
+    Context manager that records a span and its metrics.
+    """
+    __slots__ = ("span", "token")
+
+    def __init__(self, name: str, trace_id: Optional[str], attributes: Dict[str, Any]):
+        parent = _current_span.get()
+        self.span = Span(
+            name=name,
+            trace_id=trace_id or (parent.trace_id if parent else uuid.uuid4().hex),
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start=time.time(),
+            attributes=attributes,
+        )
+
+        tracer = _get_otel_tracer()
+        if tracer is not None:
+            from opentelemetry import trace
+            context = trace.set_span_in_context(parent.otel_span) if parent and parent.otel_span else None
+            self.span.otel_span = tracer.start_span(name, context=context)
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.end = time.time()
+        _current_span.reset(self.token)
+
+        span_duration.observe(span.end - span.start, span.name)
+        if exc is not None:
+            span.error = repr(exc)
+            span_errors.inc(1, span.name)
+        for key, value in span.attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                span_attributes.inc(value, span.name, key)
+
+        if span.otel_span is not None:
+            for key, value in span.attributes.items():
+                span.otel_span.set_attribute(key, value)
+            span.otel_span.end()
+        if _file_exporter is not None:
+            _file_exporter.export(span)
+        return False
+
+
+def span(name: str, trace_id: Optional[str] = None, **attributes: Any):
+    """
+    Record a span around a block of code.
+
+    Args:
+        name: Name of the span.
+        trace_id: Trace to attach the span to. If None, inherits from the current span.
+        **attributes: Initial span attributes.
+
+    Returns:
+        A context manager yielding the span.
+    """
+    if not TELEMETRY_ENABLED:
+        return _NULL_SPAN
+    return _SpanContext(name, trace_id, attributes)
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    Get the trace ID of the current span, if any.
+    """
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+
+def traced_node(name: str) -> Callable:
+    """
+    Decorator that records a span around a graph node. The trace and request
+    IDs are taken from the graph state so spans and log records are linked
+    even when LangGraph runs nodes on worker threads.
+
+    Args:
+        name: Name of the node.
+    """
+
+    def decorator(node: Callable) -> Callable:
+        @functools.wraps(node)
+        def wrapper(state):
+            with request_context(state.get("request_id")):
+                if not TELEMETRY_ENABLED:
+                    return node(state)
+                with span(f"node.{name}", trace_id=state.get("trace_id")):
+                    return node(state)
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format.
+    """
+    return registry.render()
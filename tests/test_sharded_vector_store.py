@@ -0,0 +1,59 @@
+"""
+Tests for the sharded vector store's shard executor across fork.
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langchain")
+pytest.importorskip("faiss")
+
+import sharded_vector_store  # noqa: E402
+from sharded_vector_store import ShardedVectorStore  # noqa: E402
+
+
+class CountingShard:
+    def __init__(self):
+        self.reloads = 0
+
+    def reload(self):
+        # Long enough that the parent's reload starts a thread per shard
+        time.sleep(0.05)
+        self.reloads += 1
+
+
+def make_store(num_shards):
+    store = ShardedVectorStore.__new__(ShardedVectorStore)
+    store.shards = [CountingShard() for _ in range(num_shards)]
+    store.num_shards = num_shards
+    store._chunks_by_key = None
+    store._chunks_by_file = None
+    return store
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+@pytest.mark.parametrize("num_shards", [2, 8])
+def test_reload_in_forked_child_after_reload_in_parent(num_shards):
+    # The master reloads before forking, as serve.preload does, so the executor already has threads
+    store = make_store(num_shards)
+    store.reload()
+    assert sharded_vector_store._executor is not None
+
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            import signal
+            signal.alarm(10)
+            store.reload()
+            code = 0 if all(shard.reloads == 2 for shard in store.shards) else 1
+        finally:
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status), "forked child did not finish its sharded reload"
+    assert os.WEXITSTATUS(status) == 0
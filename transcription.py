@@ -0,0 +1,405 @@
+"""
+Pluggable speech recognition backends with chunked, parallel transcription.
+
+Long audio is split on silence into segments that are transcribed in
+parallel (threads for the remote backend, processes for local CPU
+backends) and stitched back together in order. Local backends always run
+in the worker processes, even for a single segment, so their models are
+only ever loaded there.
+"""
+from typing import Dict, List, Optional, Tuple, Type
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import audioop
+import json
+import multiprocessing
+import threading
+import time
+
+import speech_recognition as sr
+
+from config import (
+    STT_BACKEND,
+    STT_WHISPER_MODEL,
+    STT_SEGMENT_SECONDS,
+    STT_MIN_SILENCE_MS,
+    STT_PROCESS_WORKERS,
+    STT_WORKERS,
+    STT_ENDPOINT_SILENCE_MS,
+    STT_MAX_SAMPLE_RATE,
+)
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+real_time_factor = registry.histogram(
+    "stt_real_time_factor", "Transcription time divided by audio duration", labels=("backend",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0),
+)
+
+
+class RecognizerBackend(ABC):
+    """
+    Base class for speech recognition backends.
+    """
+    name = "base"
+    is_local = False
+
+    def __init__(self):
+        self.recognizer = sr.Recognizer()
+
+    @abstractmethod
+    def transcribe(self, audio: sr.AudioData) -> str:
+        """
+        Transcribe a single clip.
+
+        Raises:
+            sr.UnknownValueError: If no speech was recognized.
+            sr.RequestError: If the recognizer failed.
+        """
+
+
+class GoogleBackend(RecognizerBackend):
+    """
+    Google Web Speech API (remote).
+    """
+    name = "google"
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        return self.recognizer.recognize_google(audio)
+
+
+class VoskBackend(RecognizerBackend):
+    """
+    Vosk offline recognizer (local CPU). Expects a Vosk model in ./model.
+    """
+    name = "vosk"
+    is_local = True
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        result = json.loads(self.recognizer.recognize_vosk(audio))
+        text = result.get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class WhisperBackend(RecognizerBackend):
+    """
+    OpenAI Whisper running locally (local CPU). The model is loaded once per process.
+    """
+    name = "whisper"
+    is_local = True
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        text = self.recognizer.recognize_whisper(audio, model=STT_WHISPER_MODEL).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+BACKENDS: Dict[str, Type[RecognizerBackend]] = {
+    backend.name: backend for backend in (GoogleBackend, VoskBackend, WhisperBackend)
+}
+
+
+def get_backend(name: Optional[str] = None) -> RecognizerBackend:
+    """
+    Create a recognizer backend by name.
+
+    Args:
+        name: Backend name. If None, uses STT_BACKEND.
+    """
+    name = name or STT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown speech recognition backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+@dataclass
+class TranscriptionResult:
+    """
+    Transcribed text and how long it took relative to the audio length.
+    """
+    text: str
+    backend: str
+    duration: float
+    elapsed: float
+    segments: int
+
+    @property
+    def real_time_factor(self) -> float:
+        return self.elapsed / self.duration if self.duration > 0 else 0.0
+
+
+def audio_duration(audio: sr.AudioData) -> float:
+    return len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+
+
+def split_on_silence(
+    audio: sr.AudioData,
+    max_segment_seconds: float = STT_SEGMENT_SECONDS,
+    min_silence_ms: int = STT_MIN_SILENCE_MS,
+    frame_ms: int = 30,
+) -> List[sr.AudioData]:
+    """
+    Split audio into segments of at most max_segment_seconds, cutting in the
+    middle of pauses where possible.
+
+    Args:
+        audio: The audio to split.
+        max_segment_seconds: Maximum segment length.
+        min_silence_ms: Shortest pause treated as a boundary.
+        frame_ms: Analysis frame length.
+
+    Returns:
+        The segments, in order.
+    """
+    width = audio.sample_width
+    data = audio.frame_data
+    frame_bytes = max(width, int(audio.sample_rate * frame_ms / 1000) * width)
+    frame_count = len(data) // frame_bytes
+    max_frames = max(1, int(max_segment_seconds * 1000 / frame_ms))
+    if frame_count <= max_frames:
+        return [audio]
+
+    # Frames quieter than a fraction of the loud frames count as silence
+    energies = [audioop.rms(data[i * frame_bytes:(i + 1) * frame_bytes], width) for i in range(frame_count)]
+    loud = sorted(energies)[int(len(energies) * 0.9)]
+    threshold = max(1, loud * 0.1)
+    min_silent_frames = max(1, min_silence_ms // frame_ms)
+
+    # Candidate cut points: the middle of every sufficiently long pause
+    cuts: List[int] = []
+    run_start = None
+    for i, energy in enumerate(energies + [threshold + 1]):
+        if energy < threshold:
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            if i - run_start >= min_silent_frames:
+                cuts.append((run_start + i) // 2)
+            run_start = None
+
+    # Greedily take the last pause before each segment would exceed the limit
+    boundaries = [0]
+    for cut in cuts + [frame_count]:
+        while cut - boundaries[-1] > max_frames:
+            candidates = [c for c in cuts if boundaries[-1] < c <= boundaries[-1] + max_frames]
+            boundaries.append(candidates[-1] if candidates else boundaries[-1] + max_frames)
+    boundaries.append(frame_count)
+
+    segments = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        if end > start:
+            end_byte = len(data) if end == frame_count else end * frame_bytes
+            segments.append(sr.AudioData(data[start * frame_bytes:end_byte], audio.sample_rate, width))
+    return segments
+
+
+class StreamingSegmenter:
+    """
+    Cut a live stream of 16-bit mono PCM into segments at pauses, so each
+    segment can be transcribed while the speaker is still talking, and
+    detect the end of the utterance from a long trailing pause.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        max_segment_seconds: float = STT_SEGMENT_SECONDS,
+        min_silence_ms: int = STT_MIN_SILENCE_MS,
+        endpoint_silence_ms: int = STT_ENDPOINT_SILENCE_MS,
+        frame_ms: int = 30,
+    ):
+        """
+        Initialize the segmenter.
+
+        Args:
+            sample_rate: Sample rate of the incoming PCM.
+            max_segment_seconds: Segments are cut at this length even without a pause.
+            min_silence_ms: Pause that closes a segment.
+            endpoint_silence_ms: Pause that ends the utterance.
+            frame_ms: Analysis frame length.
+
+        Raises:
+            ValueError: If the sample rate is too low for a single frame.
+        """
+        self.input_rate = sample_rate
+        self.sample_rate = min(sample_rate, STT_MAX_SAMPLE_RATE)
+        self.sample_width = 2
+        self.frame_ms = frame_ms
+        self.frame_bytes = int(self.sample_rate * frame_ms / 1000) * self.sample_width
+        if self.frame_bytes <= 0:
+            # feed() consumes whole frames, so it would never finish
+            raise ValueError(f"Sample rate {sample_rate} is too low to segment")
+        self.max_segment_frames = int(max_segment_seconds * 1000 / frame_ms)
+        self.min_silent_frames = max(1, min_silence_ms // frame_ms)
+        self.endpoint_frames = max(1, endpoint_silence_ms // frame_ms)
+
+        self._resample_state = None
+        self._pending = bytearray()  # Not yet analysed
+        self._segment = bytearray()  # Current segment
+        self._segment_frames = 0
+        self._silent_frames = 0
+        self._segment_has_speech = False
+        self._heard_speech = False
+        self._loudest = 0
+
+    @property
+    def utterance_ended(self) -> bool:
+        """
+        Whether speech has been heard and followed by an endpointing pause.
+        """
+        return self._heard_speech and self._silent_frames >= self.endpoint_frames
+
+    def _cut(self) -> Optional[sr.AudioData]:
+        segment = None
+        if self._segment_has_speech:
+            segment = sr.AudioData(bytes(self._segment), self.sample_rate, self.sample_width)
+        self._segment = bytearray()
+        self._segment_frames = 0
+        self._segment_has_speech = False
+        return segment
+
+    def feed(self, pcm: bytes) -> List[sr.AudioData]:
+        """
+        Add audio and return any segments that were completed by it.
+        """
+        if self.input_rate != self.sample_rate:
+            pcm, self._resample_state = audioop.ratecv(
+                pcm, self.sample_width, 1, self.input_rate, self.sample_rate, self._resample_state
+            )
+        self._pending.extend(pcm)
+
+        completed = []
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[:self.frame_bytes])
+            del self._pending[:self.frame_bytes]
+
+            energy = audioop.rms(frame, self.sample_width)
+            self._loudest = max(self._loudest, energy)
+            is_speech = energy >= max(100, self._loudest * 0.1)
+
+            self._segment.extend(frame)
+            self._segment_frames += 1
+            if is_speech:
+                self._silent_frames = 0
+                self._segment_has_speech = True
+                self._heard_speech = True
+            else:
+                self._silent_frames += 1
+
+            pause = self._segment_has_speech and self._silent_frames == self.min_silent_frames
+            if pause or self._segment_frames >= self.max_segment_frames:
+                segment = self._cut()
+                if segment is not None:
+                    completed.append(segment)
+        return completed
+
+    def flush(self) -> Optional[sr.AudioData]:
+        """
+        Return the remaining audio as a final segment, if it contains speech.
+        """
+        self._segment.extend(self._pending)
+        self._pending = bytearray()
+        return self._cut()
+
+
+# Per-worker-process backend for local recognizers, loaded once
+_process_backend: Optional[RecognizerBackend] = None
+
+
+def _init_process_worker(backend_name: str) -> None:
+    global _process_backend
+    _process_backend = get_backend(backend_name)
+
+
+def _transcribe_in_process(segment: Tuple[bytes, int, int]) -> str:
+    try:
+        return _process_backend.transcribe(sr.AudioData(*segment))
+    except sr.UnknownValueError:
+        return ""
+
+
+_executors: Dict[str, Executor] = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(backend: RecognizerBackend) -> Executor:
+    with _executors_lock:
+        if backend.name not in _executors:
+            if backend.is_local:
+                # Local recognizers are CPU bound: one process (and model) per core
+                _executors[backend.name] = ProcessPoolExecutor(
+                    max_workers=STT_PROCESS_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_worker,
+                    initargs=(backend.name,),
+                )
+            else:
+                _executors[backend.name] = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt-segment")
+        return _executors[backend.name]
+
+
+def transcribe(audio: sr.AudioData, backend: Optional[RecognizerBackend] = None) -> TranscriptionResult:
+    """
+    Transcribe audio, splitting long clips on silence and transcribing the
+    segments in parallel.
+
+    Args:
+        audio: The audio to transcribe.
+        backend: The backend to use. If None, uses STT_BACKEND.
+
+    Returns:
+        The transcription result.
+
+    Raises:
+        sr.UnknownValueError: If no speech was recognized in any segment.
+        sr.RequestError: If the recognizer failed.
+    """
+    backend = backend or get_backend()
+    start = time.perf_counter()
+    segments = split_on_silence(audio)
+
+    if len(segments) == 1 and not backend.is_local:
+        text = backend.transcribe(audio)
+    else:
+        executor = _get_executor(backend)
+        if backend.is_local:
+            # Even a single segment, so the model is loaded in the worker processes only
+            texts = executor.map(
+                _transcribe_in_process,
+                [(segment.frame_data, segment.sample_rate, segment.sample_width) for segment in segments],
+            )
+        else:
+            def transcribe_segment(segment: sr.AudioData) -> str:
+                try:
+                    return backend.transcribe(segment)
+                except sr.UnknownValueError:
+                    return ""
+            texts = executor.map(transcribe_segment, segments)
+
+        # map() preserves input order, so the segments are stitched back in sequence
+        text = " ".join(part for part in texts if part)
+        if not text:
+            raise sr.UnknownValueError()
+
+    result = TranscriptionResult(
+        text=text,
+        backend=backend.name,
+        duration=audio_duration(audio),
+        elapsed=time.perf_counter() - start,
+        segments=len(segments),
+    )
+    real_time_factor.observe(result.real_time_factor, backend.name)
+    logger.info("Transcribed audio", extra={"fields": {
+        "backend": result.backend,
+        "duration_s": round(result.duration, 3),
+        "segments": result.segments,
+        "real_time_factor": round(result.real_time_factor, 3),
+    }})
+    return result
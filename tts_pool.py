@@ -0,0 +1,388 @@
+"""
+Pool of long-lived text-to-speech engines running in worker processes.
+
+pyttsx3 engines are neither thread-safe nor reentrant, and creating one
+enumerates every installed voice. Each worker process therefore owns a
+single engine, configured once at startup, and handles one synthesis at a
+time. A bounded number of pending requests provides backpressure.
+
+Engines write each sentence as a complete WAV file (the pyttsx3 drivers
+write RIFF/WAV whatever the file extension). Clips cannot simply be
+concatenated, so an HTTP response is one WAV stream: a header with a
+streaming length followed by the PCM of each clip in turn.
+"""
+from typing import AsyncIterable, AsyncIterator, Deque, Iterable, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import struct
+import tempfile
+import threading
+import wave
+
+from config import (
+    TTS_WORKERS,
+    TTS_MAX_PENDING,
+    TTS_TIMEOUT,
+    TTS_VOICE_PREFERENCE,
+    TTS_RATE,
+    TTS_VOLUME,
+    TTS_AUDIO_FORMAT,
+)
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class TTSBusyError(Exception):
+    """
+    Raised when the pool already has the maximum number of pending syntheses.
+    """
+
+
+# Data size of a WAV stream whose length is not known when the header is sent
+STREAMING_SIZE = 0xFFFFFFFF
+
+# Bytes of the canonical header written by wav_header
+WAV_HEADER_BYTES = 44
+
+# (channels, sample width in bytes, frame rate)
+WavFormat = Tuple[int, int, int]
+
+
+def read_wav(clip: bytes) -> Tuple[WavFormat, bytes]:
+    """
+    Split a WAV clip into its sample format and PCM frames.
+    """
+    with wave.open(io.BytesIO(clip), "rb") as reader:
+        audio_format = (reader.getnchannels(), reader.getsampwidth(), reader.getframerate())
+        return audio_format, reader.readframes(reader.getnframes())
+
+
+def wav_header(audio_format: WavFormat, data_bytes: Optional[int] = None) -> bytes:
+    """
+    A PCM WAV header, with a streaming length if the data size is not known.
+    """
+    channels, sample_width, frame_rate = audio_format
+    data_size = STREAMING_SIZE if data_bytes is None else data_bytes
+    riff_size = STREAMING_SIZE if data_bytes is None else data_bytes + WAV_HEADER_BYTES - 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, frame_rate, frame_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
+
+def join_wav(clips: Iterable[bytes]) -> bytes:
+    """
+    Join WAV clips of the same sample format into one WAV file.
+    """
+    audio_format = None
+    frames = []
+    for clip in clips:
+        clip_format, clip_frames = read_wav(clip)
+        if audio_format is not None and clip_format != audio_format:
+            raise ValueError(f"Clips have different sample formats: {audio_format} and {clip_format}")
+        audio_format = clip_format
+        frames.append(clip_frames)
+    if audio_format is None:
+        return b""
+    data = b"".join(frames)
+    return wav_header(audio_format, len(data)) + data
+
+
+def finalize_wav(audio: bytes) -> bytes:
+    """
+    Fill in the real sizes of a complete WAV stream written by wav_stream.
+    """
+    if len(audio) < WAV_HEADER_BYTES:
+        return audio
+    return (
+        audio[:4] + struct.pack("<I", len(audio) - 8)
+        + audio[8:40] + struct.pack("<I", len(audio) - WAV_HEADER_BYTES)
+        + audio[WAV_HEADER_BYTES:]
+    )
+
+
+async def wav_stream(clips: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Turn a sequence of WAV clips into one WAV stream: a header with a
+    streaming length, then the PCM frames of each clip as it arrives.
+    """
+    audio_format = None
+    async for clip in clips:
+        clip_format, frames = read_wav(clip)
+        if audio_format is None:
+            audio_format = clip_format
+            yield wav_header(audio_format) + frames
+            continue
+        if clip_format != audio_format:
+            raise ValueError(f"Clips have different sample formats: {audio_format} and {clip_format}")
+        yield frames
+
+
+# Per-worker-process state
+_engine = None
+_scratch_path = None
+
+
+def _init_worker(voice_preference: str, rate: int, volume: float, audio_format: str) -> None:
+    """
+    Create and configure the worker's engine. Runs once per worker process.
+    """
+    global _engine, _scratch_path
+    import pyttsx3
+
+    _engine = pyttsx3.init()
+
+    # Select the voice once instead of on every request
+    for voice in _engine.getProperty('voices'):
+        if voice_preference and voice_preference in voice.name.lower():
+            _engine.setProperty('voice', voice.id)
+            break
+
+    _engine.setProperty('rate', rate)
+    _engine.setProperty('volume', volume)
+
+    # pyttsx3 can only synthesize to a file; use a RAM-backed scratch file when available
+    scratch_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    _scratch_path = os.path.join(scratch_dir, f"tts-{os.getpid()}.{audio_format}")
+
+
+def _synthesize(text: str) -> bytes:
+    """
+    Synthesize text with the worker's engine.
+
+    Returns:
+        A complete WAV clip.
+    """
+    _engine.save_to_file(text, _scratch_path)
+    _engine.runAndWait()
+    with open(_scratch_path, 'rb') as audio_file:
+        return audio_file.read()
+
+
+class TTSPool:
+    """
+    Bounded pool of text-to-speech worker processes.
+    """
+
+    def __init__(
+        self,
+        workers: int = TTS_WORKERS,
+        max_pending: int = TTS_MAX_PENDING,
+        voice_preference: str = TTS_VOICE_PREFERENCE,
+        rate: int = TTS_RATE,
+        volume: float = TTS_VOLUME,
+        audio_format: str = TTS_AUDIO_FORMAT,
+    ):
+        """
+        Initialize the pool.
+
+        Args:
+            workers: Number of worker processes.
+            max_pending: Maximum queued and running syntheses before rejecting new ones.
+            voice_preference: Substring of the preferred voice name.
+            rate: Speed of speech.
+            volume: Volume (0.0 to 1.0).
+            audio_format: Extension of the engines' scratch files. The engines write WAV.
+        """
+        self.workers = workers
+        self.audio_format = audio_format
+        self._initargs = (voice_preference, rate, volume, audio_format)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Spawn rather than fork, since the server process runs threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a synthesis.
+
+        Args:
+            text: The text to convert to speech.
+
+        Returns:
+            A future resolving to the audio bytes.
+
+        Raises:
+            TTSBusyError: If the pool is saturated.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise TTSBusyError("Text-to-speech is busy, please retry shortly")
+
+        try:
+            with self._lock:
+                try:
+                    future = self._executor.submit(_synthesize, text)
+                except BrokenProcessPool:
+                    # A crashed engine takes its worker down; start a fresh pool
+                    logger.warning("Text-to-speech pool is broken, restarting it")
+                    self._executor.shutdown(wait=False)
+                    self._executor = self._create_executor()
+                    future = self._executor.submit(_synthesize, text)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def synthesize(self, text: str, timeout: Optional[float] = TTS_TIMEOUT) -> bytes:
+        """
+        Convert text to speech, blocking until done.
+        """
+        return self.submit(text).result(timeout=timeout)
+
+    async def synthesize_async(self, text: str, timeout: Optional[float] = TTS_TIMEOUT) -> bytes:
+        """
+        Convert text to speech without blocking the event loop.
+        """
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), timeout)
+
+    def warm_up(self) -> None:
+        """
+        Start every worker process so the first requests do not pay for engine creation.
+        """
+        futures = [self._executor.submit(_synthesize, "") for _ in range(self.workers)]
+        for future in futures:
+            future.result(timeout=TTS_TIMEOUT)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        self._executor.shutdown(wait=False)
+
+
+# Sentence boundaries: terminal punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Fragments shorter than this are merged into the next sentence to avoid choppy audio
+MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences for incremental synthesis.
+
+    Args:
+        text: The text to split.
+
+    Returns:
+        Non-empty sentences, with very short fragments merged forward.
+    """
+    sentences: List[str] = []
+    pending = ""
+    for fragment in SENTENCE_BOUNDARY.split(text):
+        fragment = fragment.strip()
+        if not fragment:
+            continue
+        pending = f"{pending} {fragment}" if pending else fragment
+        if len(pending) >= MIN_SENTENCE_CHARS:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+class SentenceSpeechStream:
+    """
+    Synthesize text sentence by sentence, several sentences at a time, and
+    yield each sentence's WAV clip in order as soon as it is ready. Use
+    wav_stream() to play the clips as one file.
+
+    The first sentence is queued in the constructor, so a saturated pool
+    raises TTSBusyError before any response has been started.
+    """
+
+    def __init__(self, text: str, pool: Optional[TTSPool] = None, lookahead: Optional[int] = None):
+        """
+        Initialize the stream.
+
+        Args:
+            text: The text to convert to speech.
+            pool: The pool to synthesize on. If None, uses the process-wide pool.
+            lookahead: Maximum sentences in flight. If None, uses the pool's worker count.
+        """
+        self.pool = pool or get_tts_pool()
+        self.lookahead = max(1, lookahead or self.pool.workers)
+        self._sentences: Deque[str] = deque(split_sentences(text))
+        self._in_flight: Deque[Future] = deque()
+        if self._sentences:
+            self._in_flight.append(self.pool.submit(self._sentences.popleft()))
+
+    def _fill(self) -> None:
+        while self._sentences and len(self._in_flight) < self.lookahead:
+            try:
+                self._in_flight.append(self.pool.submit(self._sentences[0]))
+            except TTSBusyError:
+                # Other requests hold the remaining slots; our own in-flight work frees them
+                if not self._in_flight:
+                    raise
+                return
+            self._sentences.popleft()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            while self._in_flight or self._sentences:
+                if not self._in_flight:
+                    # Saturated by other requests with nothing of ours pending; back off briefly
+                    await asyncio.sleep(0.05)
+                    try:
+                        self._fill()
+                    except TTSBusyError:
+                        continue
+                    continue
+                self._fill()
+                future = self._in_flight.popleft()
+                yield await asyncio.wait_for(asyncio.wrap_future(future), TTS_TIMEOUT)
+        finally:
+            for future in self._in_flight:
+                future.cancel()
+
+
+_pool: Optional[TTSPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_tts_pool() -> TTSPool:
+    """
+    Get the process-wide text-to-speech pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = TTSPool()
+    return _pool
+
+
+def shutdown_tts_pool() -> None:
+    """
+    Stop the process-wide pool if it was started.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
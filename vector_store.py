@@ -1,14 +1,31 @@
 """
 FAISS vector store functionality.
 """
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import hashlib
 import os
+import threading
 
 from langchain_community.vectorstores import FAISS
 from langchain.schema.document import Document
 
 from embeddings import get_embedding_model, get_document_embedding_model
-from config import VECTOR_STORE_PATH, TOP_K_RESULTS
+from config import VECTOR_STORE_PATH, VECTOR_STORE_SHARDS, VECTOR_INDEX_COMPRESSION, VECTOR_RESCORE_FACTOR, TOP_K_RESULTS
+from telemetry import span
+from structured_logging import get_logger
+
+
+if TYPE_CHECKING:
+    from metadata_index import MetadataFilter, MetadataIndex
+
+logger = get_logger(__name__)
+
+
+def chunk_key(document: Document) -> str:
+    """
+    Short, stable key of a chunk, derived from its content.
+    """
+    return hashlib.sha1(document.page_content.encode("utf-8")).hexdigest()[:16]
 
 
 class VectorStore:
@@ -16,14 +33,23 @@ class VectorStore:
     Class for managing the FAISS vector store.
     """
 
-    def __init__(self, persist_directory: Optional[str] = None):
+    def __init__(self, persist_directory: Optional[str] = None, compression: str = VECTOR_INDEX_COMPRESSION):
         """
         Initialize the vector store.
 
         Args:
             persist_directory: Directory to persist the vector store. If None, uses the default.
+            compression: Storage of a new index: "none", "float16", "int8" or "pq". An existing index keeps its own.
         """
         self.persist_directory = persist_directory or VECTOR_STORE_PATH
+        self.compression = compression
+        # Mode of the loaded index, and its full-precision vectors when compressed
+        self.index_compression = "none"
+        self.exact_vectors = None
+        # Indexed chunks by chunk_key and by source file name, built on first lookup
+        self._chunks_by_key: Optional[Dict[str, Document]] = None
+        self._chunks_by_file: Optional[Dict[str, List[Document]]] = None
+        self._metadata_index: Optional["MetadataIndex"] = None
         self.embedding_model = get_document_embedding_model()
         self.query_embedding_model = get_embedding_model()
 
@@ -35,9 +61,9 @@ class VectorStore:
             try:
                 self.vector_store = self.load_vector_store()
                 if self.vector_store is None:
-                    print(f"Failed to load vector store from {self.persist_directory}. Will create a new one when documents are added.")
+                    logger.warning("Failed to load vector store from %s. Will create a new one when documents are added.", self.persist_directory)
             except Exception as e:
-                print(f"Error loading vector store: {e}")
+                logger.error("Error loading vector store: %s", e)
                 self.vector_store = None
         else:
             self.vector_store = None
@@ -50,54 +76,329 @@ class VectorStore:
             documents: List of documents to add.
         """
         if not documents:
-            print("Warning: No documents provided to add_documents.")
+            logger.warning("No documents provided to add_documents.")
             return
 
+        from metadata_index import annotate
+        annotate(documents)
+
         try:
             if self.vector_store is None:
                 # Create a new vector store
-                print(f"Creating new vector store with {len(documents)} documents...")
+                logger.info("Creating new vector store with %d documents...", len(documents))
                 self.vector_store = FAISS.from_documents(
                     documents=documents,
                     embedding=self.embedding_model,
                 )
-                print("Vector store created successfully.")
+                if self.compression != "none":
+                    self._compress()
+                logger.info("Vector store created successfully.")
+            elif self.exact_vectors is not None:
+                # Compressed: embedded here, so the full-precision vectors can be kept as well
+                logger.info("Adding %d documents to existing vector store...", len(documents))
+                import numpy as np
+                texts = [document.page_content for document in documents]
+                embeddings = self.embedding_model.embed_documents(texts)
+                self.vector_store.add_embeddings(list(zip(texts, embeddings)), metadatas=[document.metadata for document in documents])
+                self.exact_vectors.append(np.asarray(embeddings, dtype=np.float32))
+                logger.info("Documents added successfully.")
             else:
                 # Add to existing vector store
-                print(f"Adding {len(documents)} documents to existing vector store...")
+                logger.info("Adding %d documents to existing vector store...", len(documents))
                 self.vector_store.add_documents(documents)
-                print("Documents added successfully.")
+                logger.info("Documents added successfully.")
+
+            self._chunks_by_key = None
+            self._chunks_by_file = None
+            self._metadata_index = None
 
             # Persist the vector store
-            print("Persisting vector store to disk...")
+            logger.info("Persisting vector store to disk...")
             self.persist_vector_store()
-            print(f"Vector store persisted to {self.persist_directory}")
-        except Exception as e:
-            import traceback
-            print(f"Error adding documents to vector store: {e}")
-            print(traceback.format_exc())
+            logger.info("Vector store persisted to %s", self.persist_directory)
+        except Exception:
+            logger.exception("Error adding documents to vector store")
+
+    def _compress(self) -> None:
+        # Swap the flat index just built for a compressed one, keeping its vectors in a file for re-scoring
+        from index_compression import VECTORS_FILE, ExactVectors, build_index
+
+        flat = self.vector_store.index
+        vectors = flat.reconstruct_n(0, flat.ntotal)
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self.exact_vectors = ExactVectors.write(os.path.join(self.persist_directory, VECTORS_FILE), vectors)
+        self.vector_store.index, self.index_compression = build_index(vectors, self.compression)
+        logger.info("Compressed vector index", extra={"fields": {
+            "mode": self.index_compression, "vectors": flat.ntotal, "bytes": self.index_bytes(),
+        }})
 
-    def similarity_search(self, query: str, k: Optional[int] = None) -> List[Document]:
+    def _search_index(
+        self,
+        embedding: List[float],
+        k: int,
+        metadata_filter: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        # Searches the FAISS index itself: with a bitmap of the chunks meeting the filter applied
+        # inside the search, and, when compressed, over-fetching and re-ranking by exact distance
+        import numpy as np
+        from index_compression import rescore
+
+        index = self.vector_store.index
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        fetch = k * VECTOR_RESCORE_FACTOR if self.exact_vectors is not None else k
+
+        if metadata_filter is None:
+            distances, ids = index.search(query, fetch)
+        else:
+            from metadata_index import BitmapSelector
+            mask = self.metadata_index().mask(metadata_filter)
+            matching = int(mask.sum())
+            if not matching:
+                return []
+            fetch = min(fetch, matching)
+            selector = BitmapSelector(mask)
+            try:
+                distances, ids = index.search(query, fetch, params=selector.search_parameters())
+            except RuntimeError:
+                # Index types that cannot apply a selector: filter a proportionally wider search instead
+                wide = min(index.ntotal, fetch * 2 * max(1, index.ntotal // matching))
+                distances, ids = index.search(query, wide)
+                keep = [j for j, position in enumerate(ids[0]) if position >= 0 and mask[position]][:fetch]
+                distances, ids = distances[:, keep], ids[:, keep]
+
+        if self.exact_vectors is not None:
+            ranked = rescore(query[0], ids[0].tolist(), self.exact_vectors, k)
+        else:
+            ranked = [(int(position), float(distance)) for position, distance in zip(ids[0], distances[0]) if position >= 0]
+        relevance = self.vector_store._select_relevance_score_fn()
+        docstore_ids = self.vector_store.index_to_docstore_id
+        return [
+            (self.vector_store.docstore.search(docstore_ids[position]), relevance(distance))
+            for position, distance in ranked
+        ]
+
+    def metadata_index(self) -> "MetadataIndex":
+        """
+        The chunks' filterable metadata as columns in index order, built on first use.
+        """
+        if self._metadata_index is None:
+            from metadata_index import MetadataIndex
+            docstore, docstore_ids = self.vector_store.docstore, self.vector_store.index_to_docstore_id
+            self._metadata_index = MetadataIndex(
+                [docstore.search(docstore_ids[position]).metadata for position in range(self.vector_store.index.ntotal)]
+            )
+        return self._metadata_index
+
+    def similarity_search(self, query: str, k: Optional[int] = None, filters: Optional["MetadataFilter"] = None) -> List[Document]:
         """
         Perform a similarity search.
 
         Args:
             query: The query string.
             k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
 
         Returns:
             List of similar documents.
         """
         if self.vector_store is None:
             return []
+        if self.exact_vectors is not None or filters is not None:
+            return [document for document, _ in self.similarity_search_with_relevance(query, k=k, filters=filters)]
 
         k = k or TOP_K_RESULTS
 
         # Use the query embedding model for search
-        return self.vector_store.similarity_search(
-            query=query,
-            k=k,
-        )
+        with span("vector_store.similarity_search", k=k) as search_span:
+            documents = self.vector_store.similarity_search(
+                query=query,
+                k=k,
+            )
+            search_span.set_attribute("chunks", len(documents))
+        return documents
+
+    def similarity_search_with_relevance(
+        self,
+        query: str,
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Perform a similarity search, also returning relevance scores.
+
+        Args:
+            query: The query string.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            (document, relevance) pairs, relevance in [0, 1] with 1 the most relevant.
+        """
+        if self.vector_store is None:
+            return []
+        if self.exact_vectors is not None or filters is not None:
+            return self.similarity_search_with_relevance_by_vector(self.embedding_model.embed_query(query), k=k, filters=filters)
+
+        k = k or TOP_K_RESULTS
+
+        with span("vector_store.similarity_search", k=k) as search_span:
+            results = self.vector_store.similarity_search_with_relevance_scores(query, k=k)
+            search_span.set_attribute("chunks", len(results))
+        return results
+
+    def similarity_search_with_relevance_by_vector(
+        self,
+        embedding: List[float],
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Perform a similarity search with a precomputed query embedding, also returning relevance scores.
+
+        Args:
+            embedding: The query embedding.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            (document, relevance) pairs, most relevant first, relevance in [0, 1].
+        """
+        if self.vector_store is None:
+            return []
+
+        k = k or TOP_K_RESULTS
+
+        if self.exact_vectors is not None or filters is not None:
+            with span(
+                "vector_store.similarity_search", k=k, compression=self.index_compression, filtered=filters is not None
+            ) as search_span:
+                results = self._search_index(embedding, k, filters)
+                search_span.set_attribute("chunks", len(results))
+            return results
+
+        relevance = self.vector_store._select_relevance_score_fn()
+        with span("vector_store.similarity_search", k=k) as search_span:
+            results = self.vector_store.similarity_search_with_score_by_vector(embedding, k=k)
+            search_span.set_attribute("chunks", len(results))
+        return [(document, relevance(score)) for document, score in results]
+
+    def size(self) -> int:
+        """
+        Number of chunks in the index.
+        """
+        return 0 if self.vector_store is None else self.vector_store.index.ntotal
+
+    def documents(self) -> List[Document]:
+        """
+        All documents in the index.
+        """
+        if self.vector_store is None:
+            return []
+        return list(self.vector_store.docstore._dict.values())
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated memory held by the loaded index: vectors plus chunk text.
+        """
+        if self.vector_store is None:
+            return 0
+        text = sum(len(document.page_content) + 200 for document in self.documents())
+        return self.index_bytes() + text
+
+    def index_bytes(self) -> int:
+        """
+        Memory held by the index's vectors (or their compressed codes).
+        """
+        if self.vector_store is None:
+            return 0
+        index = self.vector_store.index
+        return index.ntotal * getattr(index, "code_size", index.d * 4)
+
+    def full_vectors(self):
+        """
+        Every indexed vector at full precision, in index order, as a numpy array.
+        """
+        if self.exact_vectors is not None:
+            return self.exact_vectors.all()
+        index = self.vector_store.index
+        return index.reconstruct_n(0, index.ntotal)
+
+    def get_chunks(self, keys: List[str]) -> List[Document]:
+        """
+        Look up indexed chunks by chunk_key, skipping keys no longer in the index.
+        """
+        chunks = self._chunks_by_key
+        if chunks is None:
+            chunks = self._chunks_by_key = {chunk_key(document): document for document in self.documents()}
+        return [chunks[key] for key in keys if key in chunks]
+
+    def get_chunks_from_files(self, file_names: List[str]) -> List[Document]:
+        """
+        Indexed chunks loaded from the given files (by base name), in index order.
+        """
+        chunks = self._chunks_by_file
+        if chunks is None:
+            chunks = {}
+            for document in self.documents():
+                source = document.metadata.get("source")
+                if source:
+                    chunks.setdefault(os.path.basename(source), []).append(document)
+            self._chunks_by_file = chunks
+        return [document for name in file_names for document in chunks.get(name, [])]
+
+    def contains(self, document: Document) -> bool:
+        """
+        Whether a chunk is in the index (rather than, say, fetched from the web).
+        """
+        return bool(self.get_chunks([chunk_key(document)]))
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several queries in one batched call.
+
+        Uses the same model the index queries with, so the vectors are
+        interchangeable with those computed inside similarity_search.
+
+        Args:
+            queries: The query strings.
+
+        Returns:
+            One embedding per query.
+        """
+        if not queries:
+            return []
+        with span("vector_store.embed_queries", queries=len(queries)):
+            return self.embedding_model.embed_documents(queries)
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: Optional[int] = None,
+        filters: Optional["MetadataFilter"] = None,
+    ) -> List[Document]:
+        """
+        Perform a similarity search with a precomputed query embedding.
+
+        Args:
+            embedding: The query embedding.
+            k: Number of results to return. If None, uses the default.
+            filters: Only return chunks whose metadata meets these conditions.
+
+        Returns:
+            List of similar documents.
+        """
+        if self.vector_store is None:
+            return []
+
+        k = k or TOP_K_RESULTS
+
+        if self.exact_vectors is not None or filters is not None:
+            return [document for document, _ in self.similarity_search_with_relevance_by_vector(embedding, k=k, filters=filters)]
+
+        with span("vector_store.similarity_search", k=k) as search_span:
+            documents = self.vector_store.similarity_search_by_vector(embedding, k=k)
+            search_span.set_attribute("chunks", len(documents))
+        return documents
 
     def persist_vector_store(self) -> None:
         """
@@ -110,11 +411,12 @@ class VectorStore:
 
                 # Save the vector store
                 self.vector_store.save_local(self.persist_directory)
-                print(f"Vector store saved to {self.persist_directory}")
-            except Exception as e:
-                import traceback
-                print(f"Error persisting vector store: {e}")
-                print(traceback.format_exc())
+                if self.index_compression != "none":
+                    from index_compression import write_mode
+                    write_mode(self.persist_directory, self.index_compression)
+                logger.info("Vector store saved to %s", self.persist_directory)
+            except Exception:
+                logger.exception("Error persisting vector store")
 
     def load_vector_store(self) -> FAISS:
         """
@@ -124,14 +426,46 @@ class VectorStore:
             The loaded vector store.
         """
         try:
-            return FAISS.load_local(
+            vector_store = FAISS.load_local(
                 folder_path=self.persist_directory,
                 embeddings=self.embedding_model
             )
+            self._load_exact_vectors(vector_store)
+            return vector_store
         except Exception as e:
-            print(f"Error loading vector store: {e}")
+            logger.error("Error loading vector store: %s", e)
             return None
 
+    def _load_exact_vectors(self, vector_store: FAISS) -> None:
+        # A compressed index is searched with exact re-scoring from its memory-mapped vectors
+        from index_compression import VECTORS_FILE, ExactVectors, read_mode
+
+        self.index_compression = read_mode(self.persist_directory)
+        self.exact_vectors = None
+        if self.index_compression != "none":
+            exact_vectors = ExactVectors(os.path.join(self.persist_directory, VECTORS_FILE), vector_store.index.d)
+            # Without every full-precision vector, candidates could not be re-scored
+            if len(exact_vectors) != vector_store.index.ntotal:
+                raise ValueError(
+                    f"{VECTORS_FILE} has {len(exact_vectors)} vectors but the "
+                    f"{self.index_compression} index has {vector_store.index.ntotal}; rebuild the index"
+                )
+            self.exact_vectors = exact_vectors
+
+    def reload(self) -> None:
+        """
+        Reload the index from disk, e.g. after it was rebuilt by another instance.
+        """
+        if os.path.isdir(self.persist_directory) and os.listdir(self.persist_directory):
+            self.vector_store = self.load_vector_store()
+        else:
+            self.vector_store = None
+            self.index_compression = "none"
+            self.exact_vectors = None
+        self._chunks_by_key = None
+        self._chunks_by_file = None
+        self._metadata_index = None
+
     def clear_vector_store(self) -> None:
         """
         Clear the vector store.
@@ -139,14 +473,56 @@ class VectorStore:
         try:
             if os.path.exists(self.persist_directory):
                 import shutil
-                print(f"Removing vector store directory: {self.persist_directory}")
+                logger.info("Removing vector store directory: %s", self.persist_directory)
                 shutil.rmtree(self.persist_directory)
-                print("Vector store directory removed successfully.")
+                logger.info("Vector store directory removed successfully.")
             else:
-                print(f"Vector store directory does not exist: {self.persist_directory}")
+                logger.info("Vector store directory does not exist: %s", self.persist_directory)
 
             self.vector_store = None
-        except Exception as e:
-            import traceback
-            print(f"Error clearing vector store: {e}")
-            print(traceback.format_exc())
+            self.index_compression = "none"
+            self.exact_vectors = None
+            self._chunks_by_key = None
+            self._chunks_by_file = None
+            self._metadata_index = None
+        except Exception:
+            logger.exception("Error clearing vector store")
+
+
+def open_vector_store(persist_directory: Optional[str] = None) -> VectorStore:
+    """
+    Open the index in a directory, sharded if it was built sharded or
+    VECTOR_STORE_SHARDS asks for a new sharded index.
+
+    Args:
+        persist_directory: Directory of the index. If None, uses the default.
+    """
+    from sharded_vector_store import ShardedVectorStore, is_sharded
+
+    persist_directory = persist_directory or VECTOR_STORE_PATH
+    if is_sharded(persist_directory) or (VECTOR_STORE_SHARDS > 1 and not _has_flat_index(persist_directory)):
+        return ShardedVectorStore(persist_directory=persist_directory)
+    return VectorStore(persist_directory=persist_directory)
+
+
+def _has_flat_index(persist_directory: str) -> bool:
+    return os.path.isfile(os.path.join(persist_directory, "index.faiss"))
+
+
+_shared: Optional[VectorStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_vector_store() -> VectorStore:
+    """
+    Get the process-wide vector store, loading the index on first use.
+
+    The production server calls this before forking its workers, so they
+    share the loaded index copy-on-write.
+    """
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = open_vector_store()
+    return _shared
@@ -1,13 +1,21 @@
 """
 Voice capabilities for the RAG application.
 """
-import os
-import tempfile
+import asyncio
 import base64
+import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import speech_recognition as sr
-import pyttsx3
-from pydub import AudioSegment
-import io
+
+from tts_pool import get_tts_pool
+from audio_decode import decode_audio, AudioLimitError
+from transcription import get_backend, transcribe, TranscriptionResult
+from config import STT_WORKERS
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
 
 
 class VoiceProcessor:
@@ -24,54 +32,56 @@ class VoiceProcessor:
         self.recognizer.energy_threshold = 300
         # Adjust for faster recognition
         self.recognizer.dynamic_energy_threshold = True
+
+        # Speech recognition backend (remote Google or a local CPU engine)
+        self.backend = get_backend()
         
-        # Initialize the TTS engine
-        self.engine = pyttsx3.init()
-        
-        # Get available voices
-        voices = self.engine.getProperty('voices')
-        
-        # Set a female voice if available, otherwise use the default
-        for voice in voices:
-            if "female" in voice.name.lower():
-                self.engine.setProperty('voice', voice.id)
-                break
-        
-        # Adjust speech rate and volume for more natural sound
-        self.engine.setProperty('rate', 150)    # Speed of speech
-        self.engine.setProperty('volume', 0.9)  # Volume (0.0 to 1.0)
+        # Text-to-speech runs on the shared pool of long-lived engines
+        self.tts_pool = get_tts_pool()
     
-    def speech_to_text(self, audio_data):
+    def transcribe_audio(self, audio_data) -> TranscriptionResult:
         """
-        Convert speech to text.
+        Convert speech to text and report how long it took.
+
+        Errors are reported as the text of the result, like speech_to_text.
         
         Args:
-            audio_data: Audio data in bytes.
+            audio_data: Audio data in bytes (WAV, or any format ffmpeg can decode).
             
         Returns:
-            The recognized text.
+            The transcription result.
+
+        Raises:
+            AudioLimitError: If the audio is too large or too long.
         """
         try:
-            # Save the audio data to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_audio:
-                temp_audio.write(audio_data)
-                temp_audio_path = temp_audio.name
-            
-            # Use the recognizer to convert speech to text
-            with sr.AudioFile(temp_audio_path) as source:
-                audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio)
-            
-            # Clean up the temporary file
-            os.remove(temp_audio_path)
-            
-            return text
+            # Decode straight into PCM in memory and hand it to the recognizer backend
+            audio = decode_audio(audio_data)
+            return transcribe(audio, self.backend)
+        except AudioLimitError:
+            raise
         except sr.UnknownValueError:
-            return "Sorry, I could not understand the audio."
+            text = "Sorry, I could not understand the audio."
         except sr.RequestError as e:
-            return f"Sorry, there was an error with the speech recognition service: {e}"
+            text = f"Sorry, there was an error with the speech recognition service: {e}"
         except Exception as e:
-            return f"Error processing audio: {e}"
+            text = f"Error processing audio: {e}"
+        return TranscriptionResult(text=text, backend=self.backend.name, duration=0.0, elapsed=0.0, segments=0)
+
+    def speech_to_text(self, audio_data):
+        """
+        Convert speech to text.
+        
+        Args:
+            audio_data: Audio data in bytes (WAV, or any format ffmpeg can decode).
+            
+        Returns:
+            The recognized text.
+
+        Raises:
+            AudioLimitError: If the audio is too large or too long.
+        """
+        return self.transcribe_audio(audio_data).text
     
     def text_to_speech(self, text, lang='en'):
         """
@@ -85,24 +95,9 @@ class VoiceProcessor:
             The audio data in bytes.
         """
         try:
-            # Create a temporary file to store the audio
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                temp_path = temp_file.name
-            
-            # Save the speech to the temporary file
-            self.engine.save_to_file(text, temp_path)
-            self.engine.runAndWait()
-            
-            # Read the audio file
-            with open(temp_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-            
-            # Clean up the temporary file
-            os.remove(temp_path)
-            
-            return audio_data
-        except Exception as e:
-            print(f"Error converting text to speech: {e}")
+            return self.tts_pool.synthesize(text)
+        except Exception:
+            logger.exception("Error converting text to speech", extra={"fields": {"chars": len(text)}})
             return None
     
     def process_audio_file(self, file_path):
@@ -119,14 +114,14 @@ class VoiceProcessor:
             # Use the recognizer to convert speech to text
             with sr.AudioFile(file_path) as source:
                 audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio)
             
-            return text
+            return transcribe(audio, self.backend).text
         except sr.UnknownValueError:
             return "Sorry, I could not understand the audio."
         except sr.RequestError as e:
             return f"Sorry, there was an error with the speech recognition service: {e}"
         except Exception as e:
+            logger.exception("Error processing audio file")
             return f"Error processing audio file: {e}"
     
     def process_audio_base64(self, audio_base64):
@@ -156,25 +151,76 @@ class VoiceProcessor:
             try:
                 # Try to decode the base64 string
                 audio_data = base64.b64decode(audio_base64, validate=True)
-            except Exception as e:
+            except (binascii.Error, ValueError) as e:
                 return f"Error decoding base64 audio: {str(e)}"
             
             if not audio_data:
                 return "Error: Empty audio data received"
             
-            # Convert to WAV format if needed
-            try:
-                audio = AudioSegment.from_file(io.BytesIO(audio_data))
-                wav_data = io.BytesIO()
-                audio.export(wav_data, format="wav")
-                wav_data.seek(0)
-            except Exception as e:
-                return f"Error converting audio format: {str(e)}"
-            
-            # Process the audio data
-            text = self.speech_to_text(wav_data.read())
-            
-            return text
+            # Decoding to PCM happens in memory inside speech_to_text
+            return self.speech_to_text(audio_data)
+        except AudioLimitError:
+            raise
         except Exception as e:
-            print(f"Error processing base64 audio: {e}")
+            logger.exception("Error processing base64 audio")
             return f"Error processing audio: {e}"
+
+
+_stt_executor = None
+_stt_executor_lock = threading.Lock()
+_stt_local = threading.local()
+
+
+def _get_stt_executor() -> ThreadPoolExecutor:
+    global _stt_executor
+    if _stt_executor is None:
+        with _stt_executor_lock:
+            if _stt_executor is None:
+                _stt_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+    return _stt_executor
+
+
+def _transcribe(audio_data) -> TranscriptionResult:
+    # One processor per worker thread; the recognizer keeps per-instance state
+    processor = getattr(_stt_local, "processor", None)
+    if processor is None:
+        processor = _stt_local.processor = VoiceProcessor()
+    return processor.transcribe_audio(audio_data)
+
+
+async def transcribe_async(audio_data) -> TranscriptionResult:
+    """
+    Decode and transcribe audio on the speech-to-text worker pool without blocking the event loop.
+
+    Args:
+        audio_data: Audio data in bytes.
+
+    Returns:
+        The transcription result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_stt_executor(), _transcribe, audio_data)
+
+
+def _transcribe_segment(audio: sr.AudioData) -> str:
+    processor = getattr(_stt_local, "processor", None)
+    if processor is None:
+        processor = _stt_local.processor = VoiceProcessor()
+    try:
+        return transcribe(audio, processor.backend).text
+    except sr.UnknownValueError:
+        return ""
+
+
+async def transcribe_segment_async(audio: sr.AudioData) -> str:
+    """
+    Transcribe already-decoded PCM on the speech-to-text worker pool.
+
+    Args:
+        audio: The audio segment.
+
+    Returns:
+        The recognized text, or an empty string if no speech was recognized.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_stt_executor(), _transcribe_segment, audio)
@@ -0,0 +1,247 @@
+"""
+Voice conversations over a WebSocket: incremental speech-to-text, RAG and
+streamed text-to-speech on a single connection.
+
+Protocol (client -> server):
+    {"type": "start", "sample_rate": 16000, "web_search": true}   begin an utterance (8000-48000 Hz)
+    <binary frames>                                             16-bit little-endian mono PCM
+    {"type": "end"}                                             end the utterance (optional;
+                                                                a long pause also ends it)
+
+Protocol (server -> client):
+    {"type": "partial", "text": ...}           a segment was transcribed while audio was still arriving
+    {"type": "transcript", "text": ...}        the full utterance
+    {"type": "answer", "text": ...}            the assistant's answer
+    {"type": "audio", "index": n, "bytes": n}  followed by one binary frame: a WAV file
+    {"type": "done", "latencies_ms": {...}}    per-stage latencies for the turn
+    {"type": "error", "message": ...}
+"""
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+from config import STT_MAX_DURATION_SECONDS
+from rag_graph import run_rag_graph
+from admission import PRIORITY_HIGH, PRIORITY_NORMAL, AdmissionRejected, admit, client_id
+from resilience import CircuitOpenError, DeadlineExceeded
+from transcription import StreamingSegmenter
+from voice import transcribe_segment_async
+from tts_pool import SentenceSpeechStream, TTSBusyError, join_wav
+from audio_cache import get_audio_cache
+from telemetry import registry
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+stage_latency = registry.histogram(
+    "voice_stage_latency_seconds", "Latency of each stage of a WebSocket voice turn", labels=("stage",)
+)
+
+# Sample rates a client may stream at, in Hz
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+
+
+def _parse_message(text: str) -> Optional[Dict[str, Any]]:
+    # A JSON object, or None for anything else
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def _sample_rate(value: Any) -> Optional[int]:
+    # Floats and strings are rejected too: the rate sizes every frame of the segmenter
+    if isinstance(value, bool) or not isinstance(value, int) or not MIN_SAMPLE_RATE <= value <= MAX_SAMPLE_RATE:
+        return None
+    return value
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class VoiceConversation:
+    """
+    One WebSocket voice conversation, possibly spanning several turns.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # Turns on one connection form a conversation
+        self.session_id = uuid.uuid4().hex
+
+    async def run(self) -> None:
+        """
+        Serve turns until the client disconnects.
+        """
+        await self.websocket.accept()
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if not message.get("text"):
+                    # Audio the client sent after the server ended the utterance
+                    continue
+                message = _parse_message(message["text"])
+                if message is None or message.get("type") != "start":
+                    await self._send_error("Expected a 'start' message")
+                    continue
+                sample_rate = _sample_rate(message.get("sample_rate", 16000))
+                if sample_rate is None:
+                    await self._send_error(f"sample_rate must be an integer from {MIN_SAMPLE_RATE} to {MAX_SAMPLE_RATE}")
+                    continue
+                try:
+                    await self._turn(sample_rate, bool(message.get("web_search", True)))
+                except WebSocketDisconnect:
+                    raise
+                except Exception:
+                    # One failed turn must not end the conversation
+                    logger.exception("Voice turn failed")
+                    await self._send_error("Sorry, something went wrong. Please try again.")
+        except WebSocketDisconnect:
+            logger.debug("Voice WebSocket disconnected")
+
+    async def _send_error(self, message: str) -> None:
+        await self.websocket.send_json({"type": "error", "message": message})
+
+    async def _turn(self, sample_rate: int, web_search: bool) -> None:
+        segmenter = StreamingSegmenter(sample_rate)
+        transcriptions: List[asyncio.Task] = []
+        received_bytes = 0
+        max_bytes = STT_MAX_DURATION_SECONDS * sample_rate * 2
+
+        async def transcribe_segment(segment) -> str:
+            text = await transcribe_segment_async(segment)
+            if text:
+                await self.websocket.send_json({"type": "partial", "text": text})
+            return text
+
+        # Receive audio, transcribing each segment as soon as a pause closes it
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                received_bytes += len(message["bytes"])
+                if received_bytes > max_bytes:
+                    await self._send_error(f"Utterance is longer than {STT_MAX_DURATION_SECONDS} seconds")
+                    break
+                for segment in segmenter.feed(message["bytes"]):
+                    transcriptions.append(asyncio.create_task(transcribe_segment(segment)))
+                if segmenter.utterance_ended:
+                    break
+            elif message.get("text"):
+                control = _parse_message(message["text"])
+                if control is None:
+                    await self._send_error("Expected an 'end' message or audio")
+                elif control.get("type") == "end":
+                    break
+
+        utterance_end = time.perf_counter()
+        latencies: Dict[str, float] = {}
+
+        tail = segmenter.flush()
+        if tail is not None:
+            transcriptions.append(asyncio.create_task(transcribe_segment(tail)))
+        results = await asyncio.gather(*transcriptions, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures:
+            logger.warning("Speech recognition failed", extra={"fields": {
+                "segments": len(results), "failed": len(failures), "error": type(failures[0]).__name__,
+            }})
+            await self._send_error("Speech recognition failed. Please try again.")
+            return
+        transcript = " ".join(text for text in results if text)
+        latencies["stt"] = time.perf_counter() - utterance_end
+
+        await self.websocket.send_json({"type": "transcript", "text": transcript})
+        if not transcript:
+            await self._send_error("Sorry, I could not understand the audio.")
+            return
+
+        # Retrieval and generation start as soon as the transcript is complete, under the same
+        # rate limit and concurrency cap as /ask
+        rag_start = time.perf_counter()
+        try:
+            async with admit(client_id(self.websocket.scope), PRIORITY_NORMAL if web_search else PRIORITY_HIGH):
+                answer = await run_in_threadpool(
+                    run_rag_graph, transcript, web_search_enabled=web_search, session_id=self.session_id
+                )
+        except AdmissionRejected as e:
+            if e.reason == "rate_limit":
+                await self._send_error("Too many requests. Please slow down.")
+            else:
+                await self._send_error("The assistant is busy. Please retry shortly.")
+            return
+        except CircuitOpenError as e:
+            logger.warning("Upstream unavailable", extra={"fields": {"upstream": e.upstream}})
+            await self._send_error("The assistant is temporarily unavailable. Please retry shortly.")
+            return
+        except DeadlineExceeded:
+            logger.warning("Question timed out")
+            await self._send_error("The assistant took too long to answer. Please try again.")
+            return
+        latencies["rag"] = time.perf_counter() - rag_start
+        await self.websocket.send_json({"type": "answer", "text": answer})
+
+        tts_start = time.perf_counter()
+        first_audio: Optional[float] = None
+        try:
+            index = 0
+            async for chunk in self._speech(answer):
+                if first_audio is None:
+                    first_audio = time.perf_counter()
+                await self.websocket.send_json({"type": "audio", "index": index, "bytes": len(chunk)})
+                await self.websocket.send_bytes(chunk)
+                index += 1
+        except TTSBusyError as e:
+            await self._send_error(str(e))
+
+        now = time.perf_counter()
+        latencies["tts"] = now - tts_start
+        if first_audio is not None:
+            latencies["first_audio"] = first_audio - utterance_end
+        latencies["total"] = now - utterance_end
+
+        for stage, seconds in latencies.items():
+            stage_latency.observe(seconds, stage)
+        await self.websocket.send_json({
+            "type": "done",
+            "latencies_ms": {stage: round(seconds * 1000, 1) for stage, seconds in latencies.items()},
+        })
+
+    async def _speech(self, text: str):
+        """
+        Yield the answer's audio as WAV files: from the cache in one file, or one per sentence.
+        """
+        cache = await run_in_threadpool(get_audio_cache)
+        key = cache.key_for(text)
+        cached = await cache.lookup(key)
+        if isinstance(cached, bytes):
+            yield cached
+            return
+        if cached is not None:
+            try:
+                audio = await run_in_threadpool(_read_file, cached[0])
+            except FileNotFoundError:
+                audio = None  # Evicted since the lookup: synthesize it again
+            if audio is not None:
+                yield audio
+                return
+
+        # Each frame is a playable clip; the cache keeps them joined into one file
+        clips = []
+        async for clip in SentenceSpeechStream(text):
+            clips.append(clip)
+            yield clip
+        await run_in_threadpool(lambda: cache.store(key, join_wav(clips)))
@@ -0,0 +1,164 @@
+"""
+Startup warm-up: load (or build) the vector index, build the RAG graph and
+start the text-to-speech engines, reporting progress as it goes.
+
+Building the index is single-flight across threads and processes: an
+exclusive file lock means only one process builds it, and the others
+wait and then load the result.
+"""
+from typing import Any, Dict, Optional
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+from config import WARMUP_LOCK_PATH
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+# Stage -> progress reached when the stage starts
+STAGES = {
+    "pending": 0.0,
+    "loading_index": 0.1,
+    "building_index": 0.2,
+    "building_graph": 0.7,
+    "starting_tts": 0.8,
+    "ready": 1.0,
+}
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on path, shared by every process on the host.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class WarmUp:
+    """
+    Progress and results of the warm-up of one process.
+    """
+
+    def __init__(self, lock_path: str = WARMUP_LOCK_PATH):
+        """
+        Initialize the warm-up state.
+
+        Args:
+            lock_path: File locked while the index is loaded or built.
+        """
+        self.lock_path = lock_path
+        self.stage = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.index_load_seconds: Optional[float] = None
+        self.index_size = 0
+        self.index_ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether every stage, including the text-to-speech engines, has finished.
+        """
+        return self.stage == "ready"
+
+    def _enter(self, stage: str) -> None:
+        self.stage = stage
+        logger.info("Warm-up stage", extra={"fields": {"stage": stage}})
+
+    def prepare_index(self) -> None:
+        """
+        Load the vector index, building it first if no process has yet, and build the RAG graph.
+
+        Safe to call from several threads and processes at once.
+        """
+        from vector_store import get_shared_vector_store
+        from rag_graph import get_rag_graph
+
+        with self._lock:
+            if self.index_ready:
+                return
+            if self.started_at is None:
+                self.started_at = time.time()
+
+            start = time.perf_counter()
+            self._enter("loading_index")
+            vector_store = get_shared_vector_store()
+            if vector_store.vector_store is None:
+                with file_lock(self.lock_path):
+                    # Another process may have built the index while we waited for the lock
+                    vector_store.reload()
+                    if vector_store.vector_store is None:
+                        self._enter("building_index")
+                        from initialize_assistant import initialize_assistant
+                        if not initialize_assistant():
+                            raise RuntimeError("Failed to build the vector index")
+                        vector_store.reload()
+                    if vector_store.vector_store is None:
+                        raise RuntimeError("Vector index could not be loaded")
+            self.index_load_seconds = time.perf_counter() - start
+            self.index_size = vector_store.size()
+
+            self._enter("building_graph")
+            get_rag_graph()
+            self.index_ready = True
+
+    def run(self) -> None:
+        """
+        Run every stage. Errors are recorded rather than raised.
+        """
+        try:
+            self.prepare_index()
+
+            self._enter("starting_tts")
+            try:
+                from tts_pool import get_tts_pool
+                from audio_cache import get_audio_cache
+                get_tts_pool().warm_up()
+                # Creating the cache walks its disk tier; do it here rather than on the event loop
+                get_audio_cache()
+            except Exception:
+                # Text answers do not need speech; engines will start on first use
+                logger.exception("Text-to-speech warm-up failed")
+
+            self.finished_at = time.time()
+            self._enter("ready")
+        except Exception as e:
+            self.error = str(e)
+            self.stage = "failed"
+            logger.exception("Warm-up failed")
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Describe the warm-up for the health endpoint.
+        """
+        now = self.finished_at or time.time()
+        return {
+            "status": "ready" if self.ready else self.stage,
+            "progress": STAGES.get(self.stage, 0.0),
+            "index_ready": self.index_ready,
+            "index_size": self.index_size,
+            "index_load_seconds": round(self.index_load_seconds, 3) if self.index_load_seconds is not None else None,
+            "warm_up_seconds": round(now - self.started_at, 3) if self.started_at is not None else None,
+            "error": self.error,
+        }
+
+
+warm_up = WarmUp()
@@ -1,7 +1,7 @@
 """
 Web search and content extraction functionality.
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import requests
 from bs4 import BeautifulSoup
 from langchain_community.document_loaders import WebBaseLoader
@@ -9,6 +9,16 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.tools.tavily_search import TavilySearchResults
 
 from config import CHUNK_SIZE, CHUNK_OVERLAP, MAX_SEARCH_RESULTS
+from source_registry import SourceRegistry, get_source_registry
+from vector_store import VectorStore
+from resilience import is_transient
+from telemetry import registry, span
+from structured_logging import get_logger
+
+
+logger = get_logger(__name__)
+
+local_hits = registry.counter("web_local_source_hits_total", "Web lookups served from local sources", labels=("kind",))
 
 
 class WebRetriever:
@@ -34,93 +44,97 @@ class WebRetriever:
 
         Returns:
             List of search results.
+
+        Raises:
+            Exception: Transient errors (e.g. connection errors and timeouts), so the
+                caller's circuit breaker sees an unhealthy search service.
         """
-        # Check if the query is about Badar Abbas or Lunar AI Studio
-        badar_abbas_keywords = ["badar", "abbas", "badar abbas", "lunar", "lunar ai", "lunar studio", "lunar ai studio"]
-
-        # If the query is about Badar Abbas or Lunar AI Studio, prioritize the specific websites
-        if any(keyword.lower() in query.lower() for keyword in badar_abbas_keywords):
-            # Return predefined results for Badar Abbas and Lunar AI Studio
-            return [
-                {
-                    "title": "Lunar AI Studio",
-                    "url": "https://www.lunarstudio.site/",
-                    "content": "Lunar AI Studio is a technology company specializing in Agentic AI and Cyber Security solutions."
-                },
-                {
-                    "title": "Badar Abbas - LinkedIn",
-                    "url": "https://www.linkedin.com/in/badar-abbas/",
-                    "content": "Badar Abbas is a 17-year-old entrepreneur with expertise in business development, Agentic AI, and more."
-                }
-            ]
-
-        # For other queries, use the Tavily search tool from LangChain
         try:
             search_tool = TavilySearchResults(max_results=MAX_SEARCH_RESULTS)
-            search_results = search_tool.invoke(query)
+            with span("web.search") as search_span:
+                search_results = search_tool.invoke(query)
+                search_span.set_attribute("results", len(search_results))
             return search_results
         except Exception as e:
-            print(f"Error searching the web: {e}")
+            if is_transient(e):
+                raise
+            logger.error("Error searching the web: %s", e)
             # Return empty results if search fails
             return []
 
-    def extract_content_from_url(self, url: str) -> List:
+    def extract_content_from_url(
+        self,
+        url: str,
+        vector_store: Optional[VectorStore] = None,
+        sources: Optional[SourceRegistry] = None,
+    ) -> List:
         """
         Extract content from a URL.
 
         Args:
             url: The URL to extract content from.
+            vector_store: The index holding local copies of registered pages. If None, pages are always fetched.
+            sources: The local source registry. If None, uses the default one.
 
         Returns:
             List of document chunks.
         """
-        # Check if the URL is one of the specific websites we have local data for
-        if "lunarstudio.site" in url:
-            # Use the local data for Lunar AI Studio
-            from document_loader import load_document
-            import os
-
-            data_dir = os.path.join(os.path.dirname(__file__), "data")
-            file_path = os.path.join(data_dir, "lunar_studio_website.txt")
-
-            if os.path.exists(file_path):
-                print(f"Using local data for {url}")
-                return load_document(file_path)
-
-        elif "linkedin.com/in/badar-abbas" in url:
-            # Use the local data for Badar Abbas's LinkedIn
-            from document_loader import load_document
-            import os
-
-            data_dir = os.path.join(os.path.dirname(__file__), "data")
-            file_path = os.path.join(data_dir, "badar_abbas_linkedin.txt")
-
-            if os.path.exists(file_path):
-                print(f"Using local data for {url}")
-                return load_document(file_path)
+        # Pages we have locally are already chunked and embedded in the index
+        if vector_store is not None:
+            source = (sources or get_source_registry()).match_url(url)
+            if source is not None:
+                documents = vector_store.get_chunks_from_files(source.files)
+                if documents:
+                    local_hits.inc(1, "url")
+                    logger.debug("Using local data for %s", url)
+                    return documents
 
         # For other URLs, try to fetch the content
         try:
             # Use WebBaseLoader to load the content
             loader = WebBaseLoader(url)
-            documents = loader.load()
+            with span("web.fetch", url=url) as fetch_span:
+                documents = loader.load()
+                fetch_span.set_attribute("bytes", sum(len(doc.page_content) for doc in documents))
 
             # Split the document into chunks
             return self.text_splitter.split_documents(documents)
         except Exception as e:
-            print(f"Error extracting content from {url}: {e}")
+            logger.warning("Error extracting content from %s: %s", url, e)
             return []
 
-    def retrieve_from_web(self, query: str) -> List:
+    def retrieve_from_web(
+        self,
+        query: str,
+        vector_store: Optional[VectorStore] = None,
+        sources: Optional[SourceRegistry] = None,
+    ) -> List:
         """
         Retrieve information from the web based on a query.
 
+        Queries about a registered local source are answered with its indexed
+        chunks, without searching or fetching anything.
+
         Args:
             query: The search query.
+            vector_store: The index holding local copies of registered sources. If None, always searches the web.
+            sources: The local source registry. If None, uses the default one.
 
         Returns:
             List of document chunks.
+
+        Raises:
+            Exception: Transient errors of the web search (see search_web).
         """
+        sources = sources or get_source_registry()
+        if vector_store is not None:
+            matched = sources.match_query(query)
+            documents = sources.documents(matched, vector_store) if matched else []
+            if documents:
+                local_hits.inc(1, "query")
+                logger.debug("Using local data for %s", ", ".join(source.name for source in matched))
+                return documents
+
         # Search the web
         search_results = self.search_web(query)
 
@@ -129,7 +143,7 @@ class WebRetriever:
         for result in search_results:
             url = result.get("url")
             if url:
-                documents = self.extract_content_from_url(url)
+                documents = self.extract_content_from_url(url, vector_store=vector_store, sources=sources)
                 all_documents.extend(documents)
 
         return all_documents